@@ -0,0 +1,406 @@
+""" Positions, account summary, account updates and orders, kept subscribed so /account and /order endpoints answer
+from memory.
+
+Each of reqPositions, reqAccountSummary and reqAccountUpdates is sent once, by the first request needing it, and left
+subscribed.  TWS then sends only what changes, which message handlers apply to the Subscription's model.  Only that
+first request (or the first after our connection to TWS drops) waits on TWS; every other one reads what we hold.
+Responses carry `updated`, the epoch time of the last message applied, and `synced`, when TWS last finished sending
+everything (the End message).
+
+TWS only sends account updates for one account at a time, so asking for another account moves our one reqAccountUpdates
+subscription over to it.
+
+TWS sends every openOrder and orderStatus of orders we place without being asked, so the order book is fed from the
+first of them.  Its reqAllOpenOrders only brings in orders placed before we connected, or by other clients.
+"""
+import logging
+import threading
+import time
+
+import globals as g
+import pending
+import connection
+from utils import get_tickerId
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+# Every tag reqAccountSummary takes.  We subscribe to them all and answer each request with the tags it asks for.
+SUMMARY_TAGS = {"AccountType", "NetLiquidation", "TotalCashValue", "SettledCash", "AccruedCash", "BuyingPower",
+                "EquityWithLoanValue", "PreviousDayEquityWithLoanValue", "GrossPositionValue", "RegTEquity",
+                "RegTMargin", "SMA", "InitMarginReq", "MaintMarginReq", "AvailableFunds", "ExcessLiquidity",
+                "Cushion", "FullInitMarginReq", "FullMaintMarginReq", "FullAvailableFunds", "FullExcessLiquidity",
+                "LookAheadNextChange", "LookAheadInitMarginReq", "LookAheadMaintMarginReq",
+                "LookAheadAvailableFunds", "LookAheadExcessLiquidity", "HighestSeverity", "DayTradesRemaining",
+                "Leverage"}
+
+# Order statuses after which an order is no longer working
+DONE_STATUSES = ['Filled', 'Cancelled', 'ApiCancelled', 'Inactive']
+
+_lock = threading.Lock()
+_counts = dict(hits=0, misses=0)
+
+
+# ---------------------------------------------------------------------
+# SUBSCRIPTIONS
+# ---------------------------------------------------------------------
+class Subscription(object):
+    """ One upstream subscription and the model its messages are applied to.  `end` names the message (and `id` the
+    reqId it comes with) which tells us TWS has sent everything.  Subclasses define clear(), to empty their model,
+    and send() and cancel() of their request.
+    """
+    end = None
+    orders = False  # Whether to subscribe on g.client_connection, which places our orders
+
+    def __init__(self):
+        self.client = None
+        self.id = None
+        self.error = None
+        self.updated = None
+        self.synced = None
+        self.clear()
+
+    def start(self):
+        self.client = connection.get_client(orders=self.orders, subscription=True)
+        self.error = None
+        self.synced = None
+        self.clear()
+        if self.client is None:
+            self.error = g.error_resp[-2]
+            return
+        self.send()
+
+    def stop(self):
+        if self.client.isConnected():
+            self.cancel()
+        connection.close_client(self.client, subscription=True)
+        self.client = None
+
+    def is_lost(self):
+        """ True until started, and once TWS has sent an error for our reqId or our connection dropped """
+        return self.client is None or self.error is not None or not self.client.isConnected()
+
+    def touch(self):
+        self.updated = time.time()
+
+    def finish(self):
+        """ TWS has sent everything, so wake whoever waits on it """
+        self.synced = self.updated = time.time()
+        pending.finish(self.end, self.id)
+
+    def fail(self, error):
+        self.error = error
+
+    def freshness(self):
+        return dict(updated=self.updated, synced=self.synced)
+
+
+class Positions(Subscription):
+    """ reqPositions: every position of every account, by account and conId """
+    end = 'positionEnd'
+
+    def clear(self):
+        self.positions = dict()
+
+    def send(self):
+        self.client.reqPositions()
+
+    def cancel(self):
+        self.client.cancelPositions()
+
+    def update(self, position):
+        self.positions[(position['account'], position['contract']['m_conId'])] = position
+        self.touch()
+
+    def snapshot(self):
+        resp = dict(positionEnd=self.synced is not None,
+                    positions=[p.copy() for key, p in sorted(self.positions.items())])
+        resp.update(self.freshness())
+        return resp
+
+
+class Summary(Subscription):
+    """ reqAccountSummary for every tag of every account, as the latest value of each tag """
+    end = 'accountSummaryEnd'
+
+    def clear(self):
+        self.values = dict()
+
+    def send(self):
+        self.id = get_tickerId()
+        self.client.reqAccountSummary(self.id, 'All', ','.join(sorted(SUMMARY_TAGS)))
+
+    def cancel(self):
+        self.client.cancelAccountSummary(self.id)
+
+    def update(self, tag, value):
+        self.values[tag] = value
+        self.touch()
+
+    def snapshot(self, tags):
+        resp = {tag: self.values[tag] for tag in tags if tag in self.values}
+        resp['accountSummaryEnd'] = self.synced is not None
+        resp.update(self.freshness())
+        return resp
+
+
+class Updates(Subscription):
+    """ reqAccountUpdates for `acctCode`: its account values by key, portfolio by conId and account time """
+    end = 'accountDownloadEnd'
+
+    def __init__(self):
+        self.acctCode = None
+        super(Updates, self).__init__()
+
+    def clear(self):
+        self.values = dict()
+        self.portfolio = dict()
+        self.account_time = None
+
+    def send(self):
+        log.debug('Subscribing to account updates for %s', self.acctCode)
+        self.client.reqAccountUpdates(subscribe=True, acctCode=self.acctCode)
+
+    def cancel(self):
+        self.client.reqAccountUpdates(subscribe=False, acctCode=self.acctCode)
+
+    def update(self, typeName, msg):
+        # Anything still coming for the account we subscribed to before isn't ours
+        if msg.get('accountName', self.acctCode) != self.acctCode:
+            return
+        if typeName == 'updateAccountTime':
+            self.account_time = msg['timeStamp']
+        elif typeName == 'updateAccountValue':
+            self.values[msg['key']] = msg
+        elif typeName == 'updatePortfolio':
+            self.portfolio[msg['contract']['m_conId']] = msg
+        self.touch()
+
+    def snapshot(self):
+        resp = dict(accountDownloadEnd=self.synced is not None,
+                    updateAccountValue={key: v.copy() for key, v in self.values.items()},
+                    updatePortfolio=[p.copy() for conId, p in sorted(self.portfolio.items())])
+        if self.account_time is not None:
+            resp['updateAccountTime'] = self.account_time
+        resp.update(self.freshness())
+        return resp
+
+
+class OrderBook(Subscription):
+    """ Every order TWS has told us of, as its latest openOrder and orderStatus by orderId, indexed by permId, symbol
+    and status.  As clientId 0 we also bind orders placed in TWS itself, with reqAutoOpenOrders.
+    """
+    end = 'openOrderEnd'
+    orders = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_order = dict()
+        self.by_perm = dict()
+        self.by_symbol = dict()  # Set of orderIds by symbol
+        self.by_status = dict()  # Set of orderIds by status
+        self.sequence = 0  # Count of orderStatus messages applied
+        self.statuses = dict()  # sequence of each order's latest orderStatus
+        super(OrderBook, self).__init__()
+
+    def clear(self):
+        # What TWS sent of our own orders outlasts a resubscribe; reqAllOpenOrders brings the rest up to date
+        pass
+
+    def send(self):
+        if self.client.clientId == 0:
+            self.client.reqAutoOpenOrders(True)
+        self.client.reqAllOpenOrders()
+
+    def cancel(self):
+        if self.client.clientId == 0:
+            self.client.reqAutoOpenOrders(False)
+
+    @staticmethod
+    def _keys(entry):
+        """ Returns the (permId, symbol, status) `entry` is indexed by """
+        permId = entry['orderStatus'].get('permId') or entry['openOrder'].get('order', dict()).get('m_permId')
+        symbol = entry['openOrder'].get('contract', dict()).get('m_symbol')
+        status = entry['orderStatus'].get('status') or entry['openOrder'].get('orderState', dict()).get('m_status')
+        return permId, symbol, status
+
+    def _index(self, orderId, entry, add):
+        """ Adds `entry` to (or removes it from) our indexes.  Caller holds self.lock. """
+        permId, symbol, status = self._keys(entry)
+        if permId:
+            if add:
+                self.by_perm[permId] = orderId
+            elif self.by_perm.get(permId) == orderId:
+                del self.by_perm[permId]
+        for index, key in [(self.by_symbol, symbol), (self.by_status, status)]:
+            if key is None:
+                continue
+            if add:
+                index.setdefault(key, set()).add(orderId)
+            else:
+                index[key].discard(orderId)
+                if not index[key]:
+                    del index[key]
+
+    def update(self, typeName, msg):
+        """ Keeps `msg` as the latest `typeName` message of its order.  Returns the order's entry. """
+        orderId = msg['orderId']
+        with self.lock:
+            entry = self.by_order.get(orderId)
+            if entry is None:
+                entry = dict(openOrder=dict(), orderStatus=dict())
+            else:
+                self._index(orderId, entry, False)
+            # A new entry rather than changing the old, which readers may hold
+            entry = dict(entry)
+            entry[typeName] = msg
+            self.by_order[orderId] = entry
+            self._index(orderId, entry, True)
+            if typeName == 'orderStatus':
+                self.sequence += 1
+                self.statuses[orderId] = self.sequence
+        self.touch()
+        return entry
+
+    def status_sequence(self, orderId):
+        """ Returns the sequence of the latest orderStatus of `orderId` (0 if none came yet).  Taken before sending a
+        request for an order, an orderStatus answering it is any with a greater sequence.
+        """
+        with self.lock:
+            return self.statuses.get(orderId, 0)
+
+    def get(self, orderId):
+        """ Returns the entry of `orderId`, with empty openOrder and orderStatus if we know nothing of it """
+        with self.lock:
+            return self.by_order.get(orderId, dict(openOrder=dict(), orderStatus=dict()))
+
+    def find(self, orderId=None, permId=None, symbol=None, status=None):
+        """ Returns the entries of orders matching every filter given, by orderId.  Unless asked for by `status` or id,
+        only orders still working are returned.
+        """
+        with self.lock:
+            if permId is not None:
+                permOrderId = self.by_perm.get(permId)
+                if permOrderId is None or orderId not in (None, permOrderId):
+                    return []
+                orderId = permOrderId
+            if orderId is not None:
+                ids = set([orderId]) if orderId in self.by_order else set()
+            elif symbol is not None:
+                ids = set(self.by_symbol.get(symbol, ()))
+            elif status is not None:
+                ids = set(self.by_status.get(status, ()))
+            else:
+                ids = set(self.by_order)
+            if symbol is not None:
+                ids &= self.by_symbol.get(symbol, set())
+            if status is not None:
+                ids &= self.by_status.get(status, set())
+            elif orderId is None:
+                for done in DONE_STATUSES:
+                    ids -= self.by_status.get(done, set())
+            return [self.by_order[i] for i in sorted(ids)]
+
+    def snapshot(self, **filters):
+        entries = self.find(**filters)
+        resp = dict(openOrderEnd=self.synced is not None,
+                    openOrder=[e['openOrder'].copy() for e in entries if e['openOrder']],
+                    orderStatus=[e['orderStatus'].copy() for e in entries if e['orderStatus']])
+        resp.update(self.freshness())
+        return resp
+
+    def stats(self):
+        with self.lock:
+            return dict(orders=len(self.by_order), by_status={k: len(v) for k, v in self.by_status.items()})
+
+positions = Positions()
+summary = Summary()
+updates = Updates()
+book = OrderBook()
+
+
+def _subscribe(subscription, acctCode):
+    """ (Re)starts `subscription` if it was never started or was lost, or is for an account other than `acctCode`.
+    Returns (what to wait on for it to sync or None if it has, error response or None).
+    """
+    with _lock:
+        if subscription.is_lost() or acctCode != getattr(subscription, 'acctCode', None):
+            _counts['misses'] += 1
+            if subscription.client is not None:
+                subscription.stop()
+            if acctCode is not None:
+                subscription.acctCode = acctCode
+            try:
+                subscription.start()
+            except Exception:
+                log.exception('Failed to subscribe to %s', subscription.end)
+                return None, g.error_resp[-1]
+            if subscription.client is None:
+                return None, subscription.error
+        else:
+            _counts['hits'] += 1
+        if subscription.synced is None:
+            # Registered before we look again, so an End message arriving in between still wakes us
+            done = pending.expect((subscription.end, subscription.id), client=subscription.client)
+            if subscription.synced is None:
+                return done, None
+            pending.discard(done)
+        return None, None
+
+
+def _read(subscription, snapshot, acctCode=None):
+    """ Returns `snapshot()` of `subscription` once it has synced, (re)starting it if it was never started or was
+    lost, or is for an account other than `acctCode`.  Returns an error response if it fails to sync.
+    """
+    while True:
+        done, error = _subscribe(subscription, acctCode)
+        if error is not None:
+            return error
+        finished = done is None or done.wait()
+        # Under our lock, so another request can't move the subscription to its account before we've read ours
+        with _lock:
+            if subscription.synced is not None and acctCode == getattr(subscription, 'acctCode', None):
+                return snapshot()
+            if done is not None and (not finished or done.error is not None):
+                return done.error or g.error_resp[-1]
+            # Moved to another account or restarted while we waited, so subscribe to ours again
+
+
+def get_positions():
+    """ Returns every position, from our reqPositions subscription """
+    return _read(positions, positions.snapshot)
+
+
+def get_summary(tags):
+    """ Returns the latest value of each of `tags`, from our reqAccountSummary subscription """
+    return _read(summary, lambda: summary.snapshot(tags))
+
+
+def get_updates(acctCode):
+    """ Returns account values and portfolio of `acctCode`, from our reqAccountUpdates subscription """
+    return _read(updates, updates.snapshot, acctCode)
+
+
+def get_orders(**filters):
+    """ Returns orders matching `filters` (see OrderBook.find), from our order book """
+    return _read(book, lambda: book.snapshot(**filters))
+
+
+def fail(id, error):
+    """ Marks the subscription with reqId `id` as lost, so the next read starts it again """
+    for subscription in [positions, summary, updates]:
+        if subscription.id is not None and subscription.id == id:
+            subscription.fail(error)
+
+
+def stats():
+    """ Returns counters for the /clients endpoint """
+    now = time.time()
+    stats = dict(_counts)
+    for name, subscription in [('positions', positions), ('summary', summary), ('updates', updates),
+                               ('orders', book)]:
+        stats[name] = dict(subscribed=not subscription.is_lost(),
+                           age=round(now - subscription.updated, 1) if subscription.updated else None)
+    stats['orders'].update(book.stats())
+    return stats
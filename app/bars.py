@@ -0,0 +1,494 @@
+""" Store of historical bars already fetched from TWS, so /history only asks TWS for bars it doesn't have yet.
+
+Bars are kept per series: one contract, barSizeSetting, whatToShow and useRTH.  A series remembers the intervals of
+time it holds every bar of, merging them as they grow together, and reports the gaps a request still needs to fetch
+with reqHistoricalData.  Series are saved as JSON files in g.bar_cache_dir so a restart doesn't refetch them.
+
+Times here are epoch seconds, and each bar is keyed by the time it starts at.  reqHistoricalData's durationStr counts
+days in trading sessions.  A series finds where those start from the days it holds bars on (and the session opens TWS
+told us of), and only where it holds every bar back to them, since a day without bars may be a weekend or holiday or
+one we never fetched.  Otherwise we first fetch enough weekdays back to hold them all (see feeds.py).
+
+A series' file is a JSON line of everything it held when last written, then a line per change since, so saving after a
+fetch appends rather than rewriting the lot.  Once the series in memory hold over g.bar_cache_bars bars, those used
+longest ago are dropped (once saved) and loaded from their file again when next asked for.
+"""
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+
+import globals as g
+
+# Optional encodings of Bars
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+# Series in memory, keyed by (contract key, barSizeSetting, whatToShow, useRTH), the one used longest ago first
+_series = OrderedDict()
+# Series we've dropped from _series, for as long as a request still holds them, so none is ever loaded twice
+_dropped = weakref.WeakValueDictionary()
+_lock = threading.Lock()
+_counts = dict(hits=0, misses=0, evictions=0)
+
+DAY = 24 * 60 * 60
+# Seconds per unit of barSizeSetting (ie "5 mins") and durationStr (ie "2 D")
+BAR_UNITS = dict(sec=1, min=60, hour=60 * 60, day=DAY, week=7 * DAY, month=30 * DAY)
+DURATION_UNITS = dict(S=1, D=DAY, W=7 * DAY, M=30 * DAY, Y=365 * DAY)
+# Longest duration TWS accepts in one request, as (up to bar seconds, duration seconds)
+CHUNK_LIMITS = [(1, 1800), (5, 3600), (15, 4 * 60 * 60), (30, 8 * 60 * 60), (60, DAY), (2 * 60, 2 * DAY),
+                (20 * 60, 7 * DAY), (8 * 60 * 60, 30 * DAY)]
+
+
+# ---------------------------------------------------------------------
+# TIME FUNCTIONS
+# ---------------------------------------------------------------------
+def bar_seconds(barSizeSetting):
+    """ Returns the length of a bar in seconds, ie 300 for "5 mins".  Raises ValueError for sizes we don't know. """
+    count, unit = barSizeSetting.split()
+    for prefix, seconds in BAR_UNITS.items():
+        if unit.startswith(prefix):
+            return int(count) * seconds
+    raise ValueError('Unknown barSizeSetting {}'.format(barSizeSetting))
+
+
+def parse_end(endDateTime):
+    """ Returns the epoch time of an endDateTime of "yyyymmdd hh:mm:ss", ignoring any time zone after it """
+    return int(time.mktime(time.strptime(endDateTime[:17], '%Y%m%d %H:%M:%S')))
+
+
+def format_end(epoch):
+    return time.strftime('%Y%m%d %H:%M:%S', time.localtime(epoch))
+
+
+def duration_start(durationStr, end):
+    """ Returns when a request for `durationStr` up to `end` starts.  Days are counted in weekdays, which only
+    approximates TWS's trading sessions (see Series.session_start()).
+    """
+    count, unit = durationStr.split()
+    count = int(count)
+    if unit == 'D':
+        start = end
+        while count > 0:
+            start -= DAY
+            if time.localtime(start).tm_wday < 5:
+                count -= 1
+        return start
+    if unit not in DURATION_UNITS:
+        raise ValueError('Unknown durationStr {}'.format(durationStr))
+    return end - count * DURATION_UNITS[unit]
+
+
+def session_days(durationStr):
+    """ Returns the number of days of a durationStr in days (ie 2 for "2 D"), or None for any other unit """
+    count, unit = durationStr.split()
+    return int(count) if unit == 'D' else None
+
+
+def midnight(epoch, days=0):
+    """ Returns the start of the day `days` after (or before) the one `epoch` falls on """
+    local = time.localtime(epoch)
+    return int(time.mktime((local.tm_year, local.tm_mon, local.tm_mday + days, 0, 0, 0, 0, 0, -1)))
+
+
+def finished_window(finished):
+    """ Returns the `(start, end)` epoch times of TWS's "finished-<start>-<end>" date, or None if we can't read it """
+    try:
+        start, end = finished.split('-')[1:3]
+        return bar_time(start), bar_time(end)
+    except (AttributeError, ValueError):
+        return None
+
+
+def gap_duration(start, end, bar):
+    """ Returns the shortest durationStr covering `[start, end)` which TWS accepts for bars of `bar` seconds """
+    seconds = end - start
+    if seconds <= DAY and bar < DAY:
+        return '{} S'.format(int(max(seconds, bar)))
+    if seconds > 365 * DAY:
+        return '{} Y'.format(int(math.ceil(float(seconds) / (365 * DAY))))
+    # Count weekdays back from `end`.  With holidays, TWS's trading days go back further, which still covers the gap.
+    days = 0
+    while end > start:
+        end -= DAY
+        if time.localtime(end).tm_wday < 5:
+            days += 1
+    return '{} D'.format(max(days, bar // DAY, 1))
+
+
+def chunks(gaps, bar):
+    """ Splits the `(start, end)` gaps into the chunks, in time order, of no longer than TWS accepts in one request for
+    bars of `bar` seconds
+    """
+    limit = next((duration for largest, duration in CHUNK_LIMITS if bar <= largest), 365 * DAY)
+    split = []
+    for start, end in gaps:
+        while start < end:
+            split.append((start, min(start + limit, end)))
+            start += limit
+    return split
+
+
+def bar_time(date):
+    """ Returns the epoch time of a bar's `date`, which TWS sends as "yyyymmdd" for daily (or longer) bars, and as epoch
+    seconds or "yyyymmdd  hh:mm:ss" (for formatDate 2 or 1) otherwise
+    """
+    if len(date) == 8:
+        return int(time.mktime(time.strptime(date, '%Y%m%d')))
+    if ' ' in date:
+        return int(time.mktime(time.strptime(' '.join(date.split()), '%Y%m%d %H:%M:%S')))
+    return int(date)
+
+
+def bar_date(epoch, bar, formatDate):
+    """ Returns a bar's `date` the way TWS would have sent it for `formatDate`, with bars of `bar` seconds (or None if
+    we don't know)
+    """
+    if bar is not None and bar >= DAY:
+        return time.strftime('%Y%m%d', time.localtime(epoch))
+    if formatDate == 2:
+        return str(epoch)
+    return time.strftime('%Y%m%d  %H:%M:%S', time.localtime(epoch))
+
+
+def final_before(now, bar):
+    """ Returns when the bar still being built at `now` started.  Bars before it won't change. """
+    if bar >= DAY:
+        return midnight(now)
+    return int(now) // bar * bar
+
+
+# ---------------------------------------------------------------------
+# BARS
+# ---------------------------------------------------------------------
+# Columns of Bars, and the array typecode of each
+COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'count', 'WAP', 'hasGaps']
+TYPECODES = dict(time='l', open='d', high='d', low='d', close='d', volume='l', count='l', WAP='d', hasGaps='b')
+
+
+class Bars(object):
+    """ Bars as parallel arrays, one per column.  `time` is the epoch time a bar starts at.  Costs a few dozen bytes
+    per bar where a dict per bar costs upwards of a kilobyte.
+    """
+    def __init__(self, columns=None):
+        for column in COLUMNS:
+            setattr(self, column, array(TYPECODES[column], columns[column] if columns else []))
+        self.finished = None  # The `date` of TWS's "finished-<start>-<end>" message, once it's in
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, time, open, high, low, close, volume, count, WAP, hasGaps):
+        self.time.append(time)
+        self.open.append(open)
+        self.high.append(high)
+        self.low.append(low)
+        self.close.append(close)
+        self.volume.append(volume)
+        self.count.append(count)
+        self.WAP.append(WAP)
+        self.hasGaps.append(hasGaps)
+
+    def extend(self, other):
+        for column in COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+
+    def slice(self, lo, hi):
+        sliced = Bars()
+        for column in COLUMNS:
+            setattr(sliced, column, getattr(self, column)[lo:hi])
+        return sliced
+
+    def merge(self, other):
+        """ Adds the bars of `other`, both in time order, replacing ours from its first bar's time to its last's """
+        if not len(other):
+            return
+        lo = bisect.bisect_left(self.time, other.time[0])
+        hi = bisect.bisect_right(self.time, other.time[-1])
+        for column in COLUMNS:
+            getattr(self, column)[lo:hi] = getattr(other, column)
+
+    def between(self, start, end):
+        """ Returns the Bars starting within `[start, end)`.  Ours must be in time order. """
+        return self.slice(bisect.bisect_left(self.time, start), bisect.bisect_left(self.time, end))
+
+    def row(self, i):
+        """ Returns bar `i` as a dict like TWS's historicalData message, without its `date` """
+        return dict(open=self.open[i], high=self.high[i], low=self.low[i], close=self.close[i], volume=self.volume[i],
+                    count=self.count[i], WAP=self.WAP[i], hasGaps=bool(self.hasGaps[i]))
+
+    def columns(self):
+        """ Returns a dict of each column as a list """
+        return dict((column, getattr(self, column).tolist()) for column in COLUMNS)
+
+
+def to_json(bars):
+    """ Returns `bars` as a JSON object of a list per column """
+    return json.dumps(bars.columns())
+
+
+def to_csv(bars):
+    """ Returns `bars` as CSV, with a header row of the column names """
+    # repr() keeps every digit of a float where str() rounds
+    columns = [map(repr if TYPECODES[column] == 'd' else str, getattr(bars, column)) for column in COLUMNS]
+    rows = [','.join(COLUMNS)]
+    rows.extend(itertools.imap(','.join, itertools.izip(*columns)))
+    return '\n'.join(rows) + '\n'
+
+
+def to_binary(bars):
+    """ Returns `bars` as the number of bars (uint32), then each column in the order of COLUMNS, all little endian:
+    `time`, `volume` and `count` as int64, `hasGaps` as int8 and the rest as float64.  Ie for numpy:
+    `numpy.frombuffer(data, '<f8', count=n, offset=4 + 8 * n)` is the `open` column.
+    """
+    n = len(bars)
+    parts = [struct.pack('<I', n)]
+    for column in COLUMNS:
+        values = getattr(bars, column)
+        code = dict(l='q', d='d', b='b')[values.typecode]
+        if sys.byteorder == 'little' and values.itemsize == struct.calcsize(code):
+            # Already laid out as we send it
+            parts.append(values.tostring())
+        else:
+            parts.append(struct.pack('<{}{}'.format(n, code), *values))
+    return ''.join(parts)
+
+
+def to_msgpack(bars):
+    """ Returns `bars` as a MessagePack map of an array per column.  Needs msgpack. """
+    return msgpack.packb(bars.columns())
+
+
+def to_arrow(bars):
+    """ Returns `bars` as an Arrow IPC stream of one record batch, a column each.  Needs pyarrow. """
+    types = dict(l=pyarrow.int64(), d=pyarrow.float64(), b=pyarrow.bool_())
+    arrays = [pyarrow.array(getattr(bars, column).tolist(), type=types[TYPECODES[column]]) for column in COLUMNS]
+    batch = pyarrow.RecordBatch.from_arrays(arrays, COLUMNS)
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.RecordBatchStreamWriter(sink, batch.schema)
+    writer.write_batch(batch)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+# ---------------------------------------------------------------------
+# SERIES
+# ---------------------------------------------------------------------
+class Series(object):
+    """ The bars of one series we've fetched, and the intervals `[start, end)` we hold all bars of """
+    def __init__(self, key, path=None):
+        self.key = key
+        self.path = path
+        self.intervals = []  # Sorted and non-overlapping
+        self.bars = Bars()  # In time order
+        self.opens = []  # Sorted times TWS told us trading sessions start at
+        self.unsaved = []  # Changes made since we last saved, as lines to append to our file
+        self.written = 0  # Bytes of our file's first line, which has everything we held when it was written
+        self.appended = 0  # Bytes of changes appended to our file since
+        # Held to look at or change the series, never while waiting on TWS or a reader
+        self.lock = threading.Lock()
+        self.fetching = []  # (start, end, Event) of chunks being fetched, each Event set once its bars are in
+
+    def missing(self, start, end):
+        """ Returns the `(start, end)` gaps of `[start, end)` we don't hold yet """
+        gaps = []
+        cursor = start
+        for have_start, have_end in self.intervals:
+            if have_end <= cursor:
+                continue
+            if have_start >= end:
+                break
+            if have_start > cursor:
+                gaps.append((cursor, have_start))
+            cursor = max(cursor, have_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def add(self, bars, start=None, end=None, opens=False):
+        """ Keeps `bars`, in time order.  Given `start` and `end`, also records that we now hold every bar of
+        `[start, end)`, and with `opens` that a trading session starts at `start` (as TWS tells us of a durationStr in
+        days).
+        """
+        self._add(bars, start, end, opens)
+        if self.path is not None:
+            self.unsaved.append(json.dumps(dict(start=start, end=end, opens=opens, columns=bars.columns())))
+
+    def _add(self, bars, start, end, opens):
+        self.bars.merge(bars)
+        if start is None or start >= end:
+            return
+        if opens and start not in self.opens:
+            bisect.insort(self.opens, start)
+        merged = []
+        for interval in sorted(self.intervals + [(start, end)]):
+            if merged and interval[0] <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], interval[1]))
+            else:
+                merged.append(interval)
+        self.intervals = merged
+
+    def between(self, start, end):
+        """ Returns the Bars starting within `[start, end)` """
+        return self.bars.between(start, end)
+
+    def session_start(self, sessions, end, final):
+        """ Returns when the last `sessions` trading sessions up to `end` start, counting the days we hold bars on:
+        the earliest day's midnight, or the time TWS told us its session opens at.  Returns None unless we hold every
+        bar of the days without any in between (up to `final`) and of the earliest day before its first, as only then
+        can we tell a day without bars (ie a weekend or holiday) from one we haven't fetched.
+        """
+        times = self.bars.time
+        upto = min(end, final)
+        day_end = end
+        day = midnight(end - 1)
+        while True:
+            i = bisect.bisect_left(times, day)
+            if i == len(times) or times[i] >= day_end:
+                if self.missing(day, min(day_end, upto)):
+                    return None
+            else:
+                sessions -= 1
+                if sessions <= 0:
+                    first = times[i]
+                    if not self.missing(day, first):
+                        return day
+                    # Unless TWS told us its session opens before the first bar we hold of it
+                    j = bisect.bisect_left(self.opens, day)
+                    if j < len(self.opens) and self.opens[j] <= first and not self.missing(self.opens[j], first):
+                        return self.opens[j]
+                    return None
+            day_end = day
+            day = midnight(day, -1)
+
+    def save(self):
+        """ Appends the changes since we last saved to our file, or rewrites it once they'd outgrow what it started
+        with
+        """
+        if self.path is None or not self.unsaved:
+            return
+        data = ''.join(line + '\n' for line in self.unsaved)
+        self.unsaved = []
+        try:
+            if self.appended + len(data) > self.written:
+                self._write()
+            else:
+                with open(self.path, 'a') as f:
+                    f.write(data)
+                self.appended += len(data)
+        except (IOError, OSError) as e:
+            log.warning('Could not save bars to %s: %s', self.path, e)
+
+    def _write(self):
+        """ Rewrites our file as just what we hold now """
+        tmp = self.path + '.tmp'
+        # json.dumps() encodes in C where json.dump() writes piece by piece in Python
+        data = json.dumps(dict(key=self.key, intervals=self.intervals, opens=self.opens,
+                               columns=self.bars.columns())) + '\n'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        # Replace in one step so a crash mid-write can't leave us a truncated file
+        os.rename(tmp, self.path)
+        self.written = len(data)
+        self.appended = 0
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                first = f.readline()
+                saved = json.loads(first)
+                self.bars = Bars(saved['columns'])
+                self.intervals = [tuple(interval) for interval in saved['intervals']]
+                self.opens = saved.get('opens', [])
+                # Files from before we appended changes don't end their line, so the next save rewrites them
+                self.written = len(first) if first.endswith('\n') else 0
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # A change cut short by a crash is the last, and we just don't hold its bars
+                        log.warning('Ignoring a partly saved change at the end of %s', self.path)
+                        self.written = 0
+                        break
+                    self._add(Bars(change['columns']), change['start'], change['end'], change['opens'])
+                    self.appended += len(line)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            log.warning('Could not load bars from %s: %s', self.path, e)
+            self.bars = Bars()
+            self.intervals = []
+            self.opens = []
+
+
+def series(key):
+    """ Returns the Series for `key`, loading it from g.bar_cache_dir the first time, or the first since it was dropped
+    to keep within g.bar_cache_bars
+    """
+    with _lock:
+        found = _series.pop(key, None) or _dropped.pop(key, None)
+        if found is not None:
+            _series[key] = found
+            _evict()
+            return found
+        path = None
+        if g.bar_cache_dir:
+            if not os.path.isdir(g.bar_cache_dir):
+                os.makedirs(g.bar_cache_dir)
+            # JSON rather than repr() so str and unicode args name the same file
+            name = hashlib.sha1(json.dumps(key)).hexdigest()
+            path = os.path.join(g.bar_cache_dir, '{}.json'.format(name))
+        found = _series[key] = Series(key, path)
+        found.load()
+        _evict()
+        return found
+
+
+def _evict():
+    """ Drops the series used longest ago until those left hold at most g.bar_cache_bars bars, except the one just
+    asked for and any with changes not saved yet.  Caller holds _lock.
+    """
+    total = sum(len(s.bars) for s in _series.values())
+    for key, found in _series.items()[:-1]:
+        if total <= g.bar_cache_bars:
+            break
+        if found.unsaved:
+            continue
+        total -= len(found.bars)
+        del _series[key]
+        _dropped[key] = found
+        _counts['evictions'] += 1
+
+
+def count(hit):
+    """ Counts a request answered entirely from the store (`hit`) or which had to fetch gaps """
+    with _lock:
+        _counts['hits' if hit else 'misses'] += 1
+
+
+def stats():
+    """ Returns counters for the /clients endpoint """
+    with _lock:
+        stats = dict(series=len(_series), bars=sum(len(s.bars) for s in _series.values()))
+        stats.update(_counts)
+    return stats
@@ -0,0 +1,201 @@
+""" Captures of the raw bytes TWS sends us, to replay later with bench/replay.py.
+
+With g.capture_dir set (IBREST_CAPTURE_DIR), every connection to TWS writes what its EReader reads to a file of its own
+in that folder, named for its clientId and when it connected.  Each chunk the socket returned is kept as it arrived,
+with the time it did, so a replay reproduces both the bytes and their pacing.  The EReader thread only queues a chunk;
+a writer thread per capture compresses and writes it.
+
+A capture is a gzip file of:
+  - MAGIC, then HEADER: the clientId and the epoch time the capture started
+  - a RECORD per chunk: the epoch time it was read and its length, followed by the chunk itself
+The chunks start with the connection handshake: the server version, then (from version 20) the TWS time.
+"""
+import atexit
+import functools
+import gzip
+import logging
+import os
+import Queue
+import struct
+import threading
+import time
+
+from ib.ext.EClientSocket import EClientSocket
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'IBCAP1'
+HEADER = struct.Struct('!Id')
+RECORD = struct.Struct('!dI')
+COMPRESS_LEVEL = 1  # Captures are big and mostly text, so even the fastest level shrinks them several times over
+FLUSH_INTERVAL = 1  # Seconds a chunk may wait in the compressor before it's readable from the file
+FLUSH_TIMEOUT = 10
+
+_STOP = object()
+_lock = threading.Lock()
+_captures = dict()  # Capture being written by clientId
+_counts = dict(files=0, chunks=0, bytes=0)
+
+
+class Capture(object):
+    """ One connection's capture file and the thread writing it """
+    def __init__(self, path, clientId):
+        self.path = path
+        self.clientId = clientId
+        self.failed = False  # Set once writing fails, after which nothing more is queued
+        self.queue = Queue.Queue()
+        self.file = gzip.open(path, 'wb', COMPRESS_LEVEL)
+        self.file.write(MAGIC + HEADER.pack(clientId, time.time()))
+        self.writer = threading.Thread(target=self._write, name='Capture-{}'.format(clientId))
+        self.writer.daemon = True
+        self.writer.start()
+
+    def record(self, chunk):
+        """ Queues a chunk the EReader read, with the time it arrived """
+        if not self.failed:
+            self.queue.put((time.time(), chunk))
+
+    def _write(self):
+        """ Writer thread: writes queued chunks, flushing whenever none has arrived for FLUSH_INTERVAL """
+        dirty = False
+        while True:
+            try:
+                item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except Queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            try:
+                if item is None:
+                    if dirty:
+                        self.file.flush()
+                        dirty = False
+                    continue
+                arrived, chunk = item
+                self.file.write(RECORD.pack(arrived, len(chunk)) + chunk)
+            except IOError:
+                log.exception('Stopped capturing to %s', self.path)
+                self._fail()
+                break
+            dirty = True
+            with _lock:
+                _counts['chunks'] += 1
+                _counts['bytes'] += len(chunk)
+        try:
+            self.file.close()
+        except IOError:
+            log.exception('Could not close %s', self.path)
+
+    def _fail(self):
+        """ Stops queueing chunks, drops those queued, and forgets this capture so its connection's next one starts
+        afresh
+        """
+        self.failed = True
+        with _lock:
+            if _captures.get(self.clientId) is self:
+                del _captures[self.clientId]
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        self.queue.put(_STOP)
+        self.writer.join(timeout)
+        if self.writer.is_alive():
+            log.error('%s chunks were not written to %s within %ss', self.queue.qsize(), self.path, timeout)
+
+
+def start(folder, clientId):
+    """ EClientSocket.captureFactory: starts a capture of a new connection for `clientId`, ending the one of its last
+    connection.  Returns the callable to give each chunk read to, or None if we couldn't open a file.
+    """
+    path = os.path.join(folder, 'ibgw-{}-{}.cap.gz'.format(clientId, time.strftime('%Y%m%d-%H%M%S')))
+    with _lock:
+        previous = _captures.pop(clientId, None)
+    if previous is not None:
+        previous.close()
+    try:
+        capture = Capture(path, clientId)
+    except IOError:
+        log.exception('Not capturing client %s', clientId)
+        return None
+    with _lock:
+        _captures[clientId] = capture
+        _counts['files'] += 1
+    log.info('Capturing client %s to %s', clientId, path)
+    return capture.record
+
+
+def install(folder):
+    """ Captures each connection made from now on to a file in `folder` """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    EClientSocket.captureFactory = functools.partial(start, folder)
+
+
+@atexit.register
+def close(timeout=FLUSH_TIMEOUT):
+    """ Writes everything queued and closes every capture.  Runs at exit. """
+    with _lock:
+        captures = _captures.values()
+        _captures.clear()
+    for capture in captures:
+        capture.close(timeout)
+
+
+def stats():
+    """ Returns capture counters for the /clients endpoint """
+    with _lock:
+        stats = dict(capturing=len(_captures), depth=sum(c.queue.qsize() for c in _captures.values()))
+        stats.update(_counts)
+    return stats
+
+
+# ---------------------------------------------------------------------
+# READING
+# ---------------------------------------------------------------------
+def is_capture(path):
+    """ True if `path` is a capture file rather than a raw byte stream """
+    try:
+        with gzip.open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def read(path):
+    """ Returns `(clientId, started, records)` of a capture, where `records` generates a `(time, chunk)` tuple for each
+    chunk in the order they arrived
+    """
+    f = gzip.open(path, 'rb')
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError('{} is not a capture'.format(path))
+    clientId, started = HEADER.unpack(f.read(HEADER.size))
+
+    def records():
+        with f:
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                arrived, length = RECORD.unpack(head)
+                chunk = f.read(length)
+                if len(chunk) < length:
+                    # Cut short, ie we were killed mid write
+                    return
+                yield arrived, chunk
+    return clientId, started, records()
+
+
+def strip_handshake(data):
+    """ Returns `(server version, the bytes after the connection handshake)` of the start of a capture """
+    fields = data.split('\0', 2)
+    serverVersion = int(fields[0])
+    if serverVersion >= 20:
+        return serverVersion, fields[2]
+    return serverVersion, data[len(fields[0]) + 1:]
@@ -1,13 +1,18 @@
 """ Needs documentation
 """
 import time
+import threading
+from Queue import Queue
 # from app import log
 import logging
+from functools import partial
 import globals as g
 #from flask import g
 import utils
 import handlers
+import metrics
 from flask import current_app
+from ib.ext.EClientSocket import EClientSocket
 
 __author__ = 'Jason Haury'
 
@@ -15,33 +20,144 @@ log = logging.getLogger(__name__)
 # log = utils.setup_logger(log)
 #log.setLevel(logging.WARN)
 
-# TODO use single clientId.  Update sync.py for all /order endpoints
-def get_client():
-    """ Creates a client connection to be used with orders
+
+class Multiplexer(object):
+    """ Shares one ibConnection between any number of concurrent requests.
+
+    Requests tell their answers apart by reqId/tickerId/orderId (see pending.py and utils.get_tickerId()), so they
+    don't need the connection to themselves.  EClientSocket requests (reqXxx, cancelXxx, placeOrder...) are queued and
+    sent in order by a single writer thread, so a request thread never blocks on the socket.  Everything else (ie
+    isConnected(), register()) goes straight to the connection.
+    """
+    # Every method which writes a request to the socket, including those ib.opt.signatures leaves out
+    requestNames = frozenset(name for name, method in vars(EClientSocket).items() if getattr(method, 'flushed', False))
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.in_flight = 0  # Requests between get_client() and close_client()
+        self.subscriptions = 0  # Subscriptions between get_client(subscription=True) and close_client()
+        self.sent = 0
+        self.queue = Queue()
+        self._lock = threading.Lock()
+        self._reconnect_lock = threading.Lock()
+        self._reconnect_attempted = 0
+        writer = threading.Thread(target=self._write, name='Writer-{}'.format(connection.clientId))
+        writer.daemon = True
+        writer.start()
+
+    def __getattr__(self, name):
+        attr = getattr(self.connection, name)
+        if name not in self.requestNames:
+            return attr
+
+        def enqueue(*args, **kwargs):
+            self.queue.put((name, attr, args, kwargs))
+        return enqueue
+
+    def _write(self):
+        """ Writer thread: sends queued requests one at a time, in the order they were made """
+        while True:
+            name, method, args, kwargs = self.queue.get()
+            start = time.time()
+            try:
+                method(*args, **kwargs)
+                self.sent += 1
+            except Exception:
+                log.exception('Failed sending %s on client %s', name, self.connection.clientId)
+            metrics.OUTBOUND.observe(time.time() - start, (name,))
+
+    def isConnected(self):
+        try:
+            return self.connection.isConnected()
+        except AttributeError:
+            # Never connected, so there's no EClientSocket to ask yet
+            return False
+
+    def acquire(self, subscription=False):
+        with self._lock:
+            if subscription:
+                self.subscriptions += 1
+            else:
+                self.in_flight += 1
+
+    def release(self, subscription=False):
+        with self._lock:
+            if subscription:
+                self.subscriptions -= 1
+            else:
+                self.in_flight -= 1
+
+    def reconnect(self):
+        """ Reconnects if not connected.  Only one caller reconnects at a time; the rest wait on it. """
+        with self._reconnect_lock:
+            if self.isConnected():
+                return True
+            log.debug('Client %s not connected.  Trying to reconnect...', self.connection.clientId)
+            self._reconnect_attempted = time.time()
+            self.connection.disconnect()
+            time.sleep(1)
+            self.connection.connect()
+            connected = self.isConnected()
+            metrics.RECONNECTS.inc((str(self.connection.clientId), str(connected).lower()))
+            return connected
+
+    def reconnect_later(self, interval=30):
+        """ Starts reconnecting in the background, unless we last tried within `interval` seconds.  Lets a pool bring
+        back a lost connection without making a request wait on it.
+        """
+        if self.isConnected() or time.time() - self._reconnect_attempted < interval:
+            return
+        self._reconnect_attempted = time.time()
+        reconnect = threading.Thread(target=self.reconnect, name='Reconnect-{}'.format(self.connection.clientId))
+        reconnect.daemon = True
+        reconnect.start()
+
+    def load(self):
+        """ Requests using this connection plus requests waiting to be written.  Subscriptions don't count, since they
+        only wait on TWS for as long as the request which started them.
+        """
+        return self.in_flight + self.queue.qsize()
+
+    def stats(self):
+        """ Returns counters for the /clients endpoint """
+        return dict(connected=self.isConnected(),
+                    in_flight=self.in_flight,
+                    subscriptions=self.subscriptions,
+                    queue_depth=self.queue.qsize(),
+                    sent=self.sent)
+
+
+def get_client(orders=False, subscription=False):
+    """ Returns the least loaded connected client from our pool, reconnecting if needed.  Requests collect their own
+    responses (see pending.py), so any number of them may share a connection at once.  Pair each call with
+    close_client().  Returns None when no client can connect.
+
+    Set `orders` for anything placing, modifying or cancelling orders.  IB only lets the clientId which placed an order
+    change it, so these always get g.client_connection.
+
+    Set `subscription` for a subscription held open until cancelled (ie reqMktData), and pass it to close_client() too.
+    These are spread over the pool, but don't count toward the load requests are routed by.
     """
-    # Get client ID from our non-order pool list in memory
-    timeout = g.timeout
-    while g.clientId_in_use:
-        log.debug('Waiting for clientId to become available...({})'.format(timeout))
-        time.sleep(0.5)
-        timeout -= 1
-
-    client = g.client_connection
-
-    # Enable logging if we're in debug mode
-    if current_app.debug is True:
-        client.enableLogging()
-
-    # Reconnect if needed
-    if not client.isConnected():
-        log.debug('Client {} not connected.  Trying to reconnect...'.format(g.client_id))
-        client.disconnect()
-        time.sleep(1)
-        client.connect()
-        # If we failed to reconnect, be sure to put our client ID back in the pool
-        if client.isConnected() is False:
-            raise Exception('Client cannot connect')
-    return client
+    if orders or not g.client_pool:
+        candidates = [g.client_connection]
+    else:
+        # Connected clients first, then least loaded, then fewest subscriptions
+        candidates = sorted(g.client_pool, key=lambda c: (not c.isConnected(), c.load(), c.subscriptions))
+        if candidates[0].isConnected():
+            for client in candidates[1:]:
+                client.reconnect_later()
+
+    for client in candidates:
+        # Enable logging if we're in debug mode
+        if current_app.debug is True:
+            client.enableLogging()
+
+        # Reconnect if needed, else try the next client
+        if client.isConnected() or client.reconnect():
+            client.acquire(subscription)
+            return client
+        log.warn('Client %s cannot connect', client.clientId)
+    return None
 
 
 def setup_client(client):
@@ -55,9 +171,10 @@ def setup_client(client):
     client.register(handlers.account_summary_handler, 'AccountSummary', 'AccountSummaryEnd')
     client.register(handlers.account_update_handler, 'UpdateAccountTime', 'UpdateAccountValue', 'UpdatePortfolio',
                     'AccountDownloadEnd')
-    client.register(handlers.contract_handler, 'ContractDetails')
-    client.register(handlers.executions_handler, 'ExecDetails', 'ExecDetailsEnd', 'CommissionsReport')
+    client.register(handlers.contract_handler, 'ContractDetails', 'ContractDetailsEnd')
+    client.register(handlers.executions_handler, 'ExecDetails', 'ExecDetailsEnd', 'CommissionReport')
     client.register(handlers.error_handler, 'Error')
+    client.register(partial(handlers.connection_closed_handler, client=client), 'ConnectionClosed')
     # Add handlers for feeds
     client.register(handlers.market_handler, 'TickSize', 'TickPrice')
 
@@ -68,12 +185,11 @@ def setup_client(client):
     client.disconnect()
 
 
-def close_client(client):
-    """ Put clientId back into pool but don't close connection
+def close_client(client, subscription=False):
+    """ Done using `client` for a request (or `subscription`, as given to get_client()), but don't close connection
     """
     if client is None:
         log.warn('Trying to close None client')
         return
-    client_id = client.clientId
-    g.clientId_in_use = False
-    return client_id
+    client.release(subscription)
+    return client.clientId
@@ -1,7 +1,28 @@
-from sqlalchemy import create_engine
+""" SQLite storage of filled orders and commission reports.
+
+Handlers run on the EReader thread, so they never write here themselves: `save()` queues a record and returns, and a
+writer thread merges everything queued into one transaction per batch.  The database is in WAL mode, so /order/filled
+and /executions/commissions can read while a batch commits.  Records still queued at exit are written by `flush()`.
+"""
+import atexit
+import json
+import logging
+import Queue
+import re
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Index, Integer, String
+
+import metrics
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
 
 engine = create_engine('sqlite:///ibrest.db', convert_unicode=True)
 db_session = scoped_session(sessionmaker(autocommit=False,
@@ -10,40 +31,255 @@ db_session = scoped_session(sessionmaker(autocommit=False,
 Base = declarative_base()
 Base.query = db_session.query_property()
 
+# Executions' sides as orders' actions, so both tables are filtered by the same side
+SIDES = {'BOT': 'BUY', 'SLD': 'SELL'}
+
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL lets readers carry on during a commit, and only needs syncing at checkpoints to be safe from corruption
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
 # ---------------------------------------------------------------------
 # MODELS
 # ---------------------------------------------------------------------
 class FilledOrders(Base):
-    """ Once an order is filled, fill price, etc should be saved here """
+    """ Once an order is filled, fill price, etc should be saved here.  `order_status` is the orderStatus message as
+    JSON, and the rest is kept in columns of its own for filtering.
+    """
     __tablename__ = 'filled_orders'
     order_id = Column(Integer, primary_key=True)
+    perm_id = Column(Integer, index=True)
+    symbol = Column(String)
+    account = Column(String)
+    side = Column(String)
+    qty = Column(Float)
+    price = Column(Float)
+    time = Column(Integer, index=True)  # Epoch seconds we got the Filled status
     order_status = Column(String)
-
-    def __init__(self, order_id=None, order_status=None):
-        self.order_id = order_id
-        self.order_status = order_status
+    __table_args__ = (Index('ix_filled_orders_symbol_time', 'symbol', 'time'),
+                      Index('ix_filled_orders_account_time', 'account', 'time'))
 
     def __repr__(self):
-        return '<IB OrderID {}>'.format(self.ib_id)
+        return '<IB OrderID {}>'.format(self.order_id)
 
 
 class Commissions(Base):
-    """ Once an order is filled, fill price, etc should be saved here """
+    """ Each execution, from its execDetails, and once it comes, its CommissionReport.  Either is saved with only its
+    own columns set, so merging one keeps what the other saved.
+    """
     __tablename__ = 'commissions'
-    exec_id = Column(Integer, primary_key=True)
+    exec_id = Column(String, primary_key=True)
+    order_id = Column(Integer, index=True)
+    perm_id = Column(Integer, index=True)
+    symbol = Column(String)
+    account = Column(String)
+    side = Column(String)
+    qty = Column(Float)
+    price = Column(Float)
+    time = Column(Integer, index=True)  # Epoch seconds of the execution
+    commission = Column(Float)
+    currency = Column(String)
+    realized_pnl = Column(Float)
+    execution = Column(String)
     commission_report = Column(String)
-
-    def __init__(self, exec_id=None, commission_report=None):
-        self.exec_id = exec_id
-        self.commission_report = commission_report
+    __table_args__ = (Index('ix_commissions_symbol_time', 'symbol', 'time'),
+                      Index('ix_commissions_account_time', 'account', 'time'))
 
     def __repr__(self):
-        return '<IB ExecID {}>'.format(self.ib_id)
-
+        return '<IB ExecID {}>'.format(self.exec_id)
 
 
 def init_db():
     # import all modules here that might define models so that
     # they will be registered properly on the metadata.  Otherwise
     # you will have to import them first before calling init_db()
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    inspector = inspect(engine)
+    names = inspector.get_table_names()
+    copied = False
+    for table in Base.metadata.sorted_tables:
+        # Tables set aside by an earlier start which didn't copy their rows over
+        old_tables = sorted(name for name in names if re.match(r'{}_\d+$'.format(table.name), name))
+        if table.name in names:
+            columns = set(c['name'] for c in inspector.get_columns(table.name))
+            if columns != set(table.columns.keys()):
+                # A table from before its current columns, whose primary key may not even be typed as ours now, so
+                # it's set aside and its rows copied into a new one
+                old = '{}_{}'.format(table.name, int(time.time()))
+                log.warning('Migrating table %s, which has columns %s', table.name, sorted(columns))
+                for index in inspector.get_indexes(table.name):
+                    engine.execute('DROP INDEX {}'.format(index['name']))
+                engine.execute('ALTER TABLE {} RENAME TO {}'.format(table.name, old))
+                old_tables.append(old)
+        table.create(bind=engine, checkfirst=True)
+        for old in old_tables:
+            _copy_rows(table, old)
+            copied = True
+    if copied:
+        _fill_columns()
+    # Executions saved before their sides were stored as actions
+    for side, action in SIDES.items():
+        engine.execute(Commissions.__table__.update().where(Commissions.side == side).values(side=action))
+
+
+def _copy_rows(table, old):
+    """ Copies the rows of table `old` into `table`, with the columns they have in common, then drops `old` """
+    columns = ', '.join(c['name'] for c in inspect(engine).get_columns(old) if c['name'] in table.columns)
+    with engine.begin() as conn:
+        copied = conn.execute('INSERT OR IGNORE INTO {} ({}) SELECT {} FROM {}'.format(table.name, columns, columns,
+                                                                                      old)).rowcount
+        conn.execute('DROP TABLE {}'.format(old))
+    log.info('Copied %s rows of %s into %s', copied, old, table.name)
+
+
+def _fill_columns():
+    """ Sets the columns of rows copied from tables which only had their JSON, from that JSON """
+    session = sessionmaker(bind=engine)()
+    try:
+        for row in session.query(FilledOrders).filter(FilledOrders.perm_id.is_(None),
+                                                      FilledOrders.order_status.isnot(None)):
+            status = json.loads(row.order_status)
+            row.perm_id, row.qty, row.price = status.get('permId'), status.get('filled'), status.get('avgFillPrice')
+        for row in session.query(Commissions).filter(Commissions.commission.is_(None),
+                                                     Commissions.commission_report.isnot(None)):
+            report = json.loads(row.commission_report).get('commissionReport', dict())
+            row.commission, row.currency = report.get('m_commission'), report.get('m_currency')
+            # Java's Double.MAX_VALUE stands for no realized P&L, as in handlers.executions_handler
+            realized_pnl = report.get('m_realizedPNL')
+            row.realized_pnl = None if realized_pnl is None or realized_pnl >= sys.float_info.max else realized_pnl
+        session.commit()
+    finally:
+        session.close()
+
+
+def find(model, start=None, end=None, limit=None, offset=0, required=(), **filters):
+    """ Returns rows of `model`, newest first, with every column named in `filters` equal to its value (unless None),
+    every column named in `required` set, and a time from `start` up to (but not including) `end`
+    """
+    query = model.query
+    for name in required:
+        query = query.filter(getattr(model, name).isnot(None))
+    for name, value in filters.items():
+        if value is not None:
+            query = query.filter(getattr(model, name) == value)
+    if start is not None:
+        query = query.filter(model.time >= start)
+    if end is not None:
+        query = query.filter(model.time < end)
+    key = model.__table__.primary_key.columns.values()[0]
+    return query.order_by(model.time.desc(), key.desc()).offset(offset).limit(limit).all()
+
+
+# ---------------------------------------------------------------------
+# WRITER
+# ---------------------------------------------------------------------
+BATCH_SIZE = 500  # Most records merged in one transaction
+RETRIES = 3  # Attempts at committing a batch before its records are dropped (and logged)
+FLUSH_TIMEOUT = 10  # Seconds we wait at exit for queued records to be written
+
+_STOP = object()
+_queue = Queue.Queue()
+_lock = threading.Lock()
+_writer = None
+_counts = dict(queued=0, written=0, commits=0, dropped=0, commit_msec=0.0, max_commit_msec=0.0)
+
+
+def save(record):
+    """ Queues a model instance to be merged into the database by our writer thread
+    """
+    with _lock:
+        _start_writer()
+        _queue.put(record)
+        _counts['queued'] += 1
+
+
+def _start_writer():
+    """ Starts the writer thread if it isn't running.  Caller holds _lock. """
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        _writer = threading.Thread(target=_write, name='SQLiteWriter')
+        _writer.daemon = True
+        _writer.start()
+
+
+def _write():
+    # Our own session, which autoflushes so that a batch may merge the same order more than once
+    session = sessionmaker(bind=engine)()
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except Queue.Empty:
+                break
+        records = [record for record in batch if record is not _STOP]
+        if records:
+            _commit(session, records)
+        if len(records) < len(batch):
+            return
+
+
+def _commit(session, records):
+    """ Merges `records` in one transaction, retrying a few times.  If they still won't go, each is tried on its own so
+    one bad record doesn't cost us the rest of its batch.
+    """
+    for attempt in range(RETRIES):
+        if _merge(session, records):
+            return
+        time.sleep(0.1 * 2 ** attempt)
+    dropped = [record for record in records if len(records) == 1 or not _merge(session, [record])]
+    with _lock:
+        _counts['dropped'] += len(dropped)
+    log.error('Dropped records SQLite would not take: %s',
+              [{c: getattr(record, c) for c in record.__table__.columns.keys()} for record in dropped])
+
+
+def _merge(session, records):
+    start = time.time()
+    try:
+        for record in records:
+            session.merge(record)
+        session.commit()
+    except Exception:
+        session.rollback()
+        log.exception('Failed to write %s records to SQLite', len(records))
+        return False
+    finally:
+        session.close()
+    seconds = time.time() - start
+    metrics.COMMITS.observe(seconds)
+    msec = seconds * 1000
+    with _lock:
+        _counts['written'] += len(records)
+        _counts['commits'] += 1
+        _counts['commit_msec'] += msec
+        _counts['max_commit_msec'] = max(_counts['max_commit_msec'], msec)
+    return True
+
+
+@atexit.register
+def flush(timeout=FLUSH_TIMEOUT):
+    """ Writes everything queued so far and stops the writer thread, which the next `save()` starts again.  Runs at exit.
+    """
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+        if writer is None:
+            return
+        _queue.put(_STOP)
+    writer.join(timeout)
+    if writer.is_alive():
+        log.error('%s records were not written to SQLite within %ss', _queue.qsize(), timeout)
+
+
+def stats():
+    """ Returns queue depth and commit counters for the /clients endpoint """
+    with _lock:
+        stats = dict(depth=_queue.qsize())
+        stats.update(_counts)
+    stats['commit_msec'] = round(stats['commit_msec'] / stats['commits'], 2) if stats['commits'] else 0.0
+    stats['max_commit_msec'] = round(stats['max_commit_msec'], 2)
+    return stats
@@ -3,133 +3,612 @@
 This is accomplished by storing data in a Sqlite3 DB
 """
 import logging
+import json
+import math
+import threading
 import time
+from collections import OrderedDict
+from Queue import Queue, Empty, Full
 from datetime import datetime, timedelta
+from functools import partial
 
+from flask import current_app
+
+import bars
 import connection
 import globals as g
+import pacing
+import pending
 import utils
 from connection import get_client, close_client
 from ib.ext.Contract import Contract
 from sync import log
-from utils import make_contract
+from utils import make_contract, get_tickerId
 
 __author__ = 'Jason Haury'
 log = logging.getLogger(__name__)
 
-
-# log = utils.setup_logger(log)
-def get_tickerId():
-    """ Returns next valid ticker ID in a way which won't overlap with recent orderIds in the error responses"""
-
-    g.tickerId += 1
-    # Since error messages key off `id` being both an orderId or tickerId depending on context, we may have overlapping
-    # `id`'s between our feeds and sync functions.  As a safety, keep our either much larger or much lower than our
-    # orderId since we can't control orderId
-    id_threshold = 10000
-    if g.orderId < id_threshold:
-        if g.tickerId < id_threshold:
-            g.tickerId += id_threshold
-    elif g.tickerId > id_threshold:
-        # our orderId is >= id_threshold
-        g.tickerId -= id_threshold
-    return g.tickerId
+# Market data subscriptions keyed by contract, least recently used first.  Each holds one of our g.market_lines
+# reqMktData lines and outlives the request which started it, so later requests answer from its cached quote.
+_market_subscriptions = OrderedDict()
+_market_lock = threading.Lock()
+_market_counts = dict(hits=0, misses=0, evictions=0)
 
 
 # ---------------------------------------------------------------------
 # MARKET DATA FUNCTIONS
 # ---------------------------------------------------------------------
-# TODO This needs to be a feed, not an endpoint.   http://flask.pocoo.org/snippets/10/.
+class MarketSubscription(object):
+    """ One upstream reqMktData subscription.  Keeps the latest tickPrice/tickSize of each tick type as `quote`, and
+    fans every message out to the queue of each /market/<symbol>/stream listener.  Messages arrive through
+    handlers.market_handler via g.market_streams.
+    """
+    def __init__(self, key, contract):
+        self.key = key
+        self.contract = contract
+        self.listeners = set()
+        self.quote = dict()  # Latest (typeName, tick message) per tick type (`field`)
+        self.ready = False  # Whether /market requests answer from `quote` without waiting, once the first has waited
+        self.error = None
+        self.last_used = time.time()
+        self.client = None
+        self.tickerId = None
+
+    def start(self):
+        self.client = get_client(subscription=True)
+        if self.client is None:
+            self.error = g.error_resp[-2]
+            return
+        self.tickerId = get_tickerId()
+        g.market_streams[self.tickerId] = self
+        log.info('Subscribing to market data for %s on tickerId %s', self.contract.m_symbol, self.tickerId)
+        self.client.reqMktData(self.tickerId, self.contract, '', False)
+
+    def stop(self):
+        if self.client is None:
+            return
+        log.info('Unsubscribing from market data for %s on tickerId %s', self.contract.m_symbol, self.tickerId)
+        g.market_streams.pop(self.tickerId, None)
+        if self.client.isConnected():
+            self.client.cancelMktData(self.tickerId)
+        close_client(self.client, subscription=True)
+
+    def is_lost(self):
+        """ True once TWS has sent an error for our tickerId or our connection dropped, so quotes won't update """
+        return self.error is not None or not self.client.isConnected()
+
+    def update(self, typeName, tick):
+        """ Keeps `tick` as the latest of its tick type, then publishes it """
+        self.quote[tick['field']] = (typeName, tick)
+        self.publish(typeName, tick)
+        if not self.ready and len(self.quote) >= g.market_ticks:
+            self.ready = True
+            pending.finish('market', self.tickerId)
+
+    def fail(self, error):
+        self.error = error
+        self.publish('error', error)
+
+    def publish(self, typeName, data):
+        """ Hands a message to every listener.  A listener too slow to keep up misses it rather than holding up the
+        reader thread.
+        """
+        for listener in list(self.listeners):
+            try:
+                listener.put_nowait((typeName, data))
+            except Full:
+                pass
+
+
+def _market_key(contract):
+    return tuple(sorted((k, v) for k, v in contract.__dict__.items() if not isinstance(v, list)))
+
+
+def _market_evict():
+    """ Stops subscriptions nobody is streaming which are lost or have been unused for g.market_idle_timeout seconds,
+    then the least recently used of those while we're at our line budget.  Caller holds _market_lock.
+    """
+    now = time.time()
+    for subscription in _market_subscriptions.values():
+        if not subscription.listeners and (subscription.is_lost() or
+                                           now - subscription.last_used > g.market_idle_timeout):
+            del _market_subscriptions[subscription.key]
+            subscription.stop()
+            _market_counts['evictions'] += 1
+    for subscription in _market_subscriptions.values():
+        if len(_market_subscriptions) < g.market_lines:
+            break
+        if not subscription.listeners:
+            del _market_subscriptions[subscription.key]
+            subscription.stop()
+            _market_counts['evictions'] += 1
+
+
+def _market_subscription(key, contract):
+    """ Returns the subscription for `key` marked as most recently used, starting one if needed.  Returns None when
+    every line in our budget is held by a stream, or one without a client (and with its error) when no client can
+    connect.  Caller holds _market_lock.
+    """
+    subscription = _market_subscriptions.pop(key, None)
+    if subscription is not None and subscription.is_lost():
+        subscription.stop()
+        subscription = None
+    if subscription is None:
+        _market_counts['misses'] += 1
+        _market_evict()
+        if len(_market_subscriptions) >= g.market_lines:
+            return None
+        subscription = MarketSubscription(key, contract)
+        subscription.start()
+        if subscription.client is None:
+            # Not worth keeping.  Our caller returns its error.
+            return subscription
+    else:
+        _market_counts['hits'] += 1
+    subscription.last_used = time.time()
+    _market_subscriptions[key] = subscription
+    return subscription
+
+
+def market_stats():
+    """ Returns counters for the /clients endpoint """
+    with _market_lock:
+        stats = dict(lines=len(_market_subscriptions), budget=g.market_lines,
+                     streaming=sum(1 for s in _market_subscriptions.values() if s.listeners))
+        stats.update(_market_counts)
+    return stats
+
+
 def get_market_data(symbol, args):
     """ The m_symbol for the contract is all our API takes from user (for now).
     User must have appropriate IB subscriptions.
     https://www.interactivebrokers.com/en/software/api/apiguide/java/reqmktdata.htm
+
+    Returns the latest tickPrice/tickSize message of each tick type.  These come from a subscription we keep open, so
+    only the first request for a contract waits on TWS, for g.market_ticks tick types to arrive or until it times out.
+    Contracts sending fewer (ie halted or illiquid ones) are then answered with what we have.
     """
     # TODO consider taking more args to get our market data with: filter (price, size, optionComputation, etc) and desired length of data.  Also, tick lists
-    log.debug('Getting market data for {}'.format(symbol))
-    # Connect to TWS
-    client = get_client()
-    if client.isConnected() is False:
-        return {'error': 'Not connected to TWS'}
-    log.debug('Creating Contract for symbol {}'.format(symbol))
     contract = make_contract(str(symbol), args)  # , prim_exch='NASDAQ')
+    with _market_lock:
+        subscription = _market_subscription(_market_key(contract), contract)
+        if subscription is None:
+            return g.error_resp[-3]
+        if subscription.client is None:
+            return subscription.error
+        done = None
+        if not subscription.ready:
+            log.debug('Waiting on market data for %s', symbol)
+            done = pending.expect(('market', subscription.tickerId), client=subscription.client)
+            # Registered before we look again, so the tick making it ready while we register still wakes us
+            if subscription.ready:
+                pending.discard(done)
+                done = None
+    if done is not None:
+        done.wait()
+        subscription.ready = True
+        if done.error is not None and not subscription.quote:
+            return done.error
+    return [tick for field, (typeName, tick) in sorted(subscription.quote.items())]
 
-    our_tickerId = get_tickerId()
-    g.market_resp[our_tickerId] = []
-    log.info('Requesting market data')
-    client.reqMktData(our_tickerId, contract, '', False)
-    timeout = g.timeout
-    while len(g.market_resp[our_tickerId]) < 5 and client.isConnected() is True and timeout > 0:
-        log.info("Waiting for responses on {}...".format(client))
-        time.sleep(0.25)
-        timeout -= 1
-    client.cancelMktData(our_tickerId)
-    log.debug('Disconnected Market client {}'.format(close_client(client)))
-    return g.market_resp.pop(our_tickerId)
+
+def _market_subscribe(key, contract):
+    """ Returns the subscription for `key` and a new listener queue on it.  Returns `(None, None)` if we're out of
+    lines, and no listener if no client can connect.
+    """
+    listener = Queue(maxsize=g.stream_queue_size)
+    with _market_lock:
+        subscription = _market_subscription(key, contract)
+        if subscription is None or subscription.client is None:
+            return subscription, None
+        # Start with what we already know, so a new listener doesn't wait on the next tick of each type
+        for field, message in sorted(subscription.quote.items()):
+            listener.put_nowait(message)
+        subscription.listeners.add(listener)
+    return subscription, listener
+
+
+def _market_unsubscribe(subscription, listener):
+    """ Removes a listener.  The subscription stays cached until evicted. """
+    with _market_lock:
+        subscription.listeners.discard(listener)
+        subscription.last_used = time.time()
+
+
+def _market_events(subscription, listener):
+    """ Generates a Server-Sent Event for each message on `listener` """
+    # Servers hold back response headers until the first chunk, so send one straight away
+    yield ': subscribed\n\n'
+    while True:
+        try:
+            typeName, data = listener.get(timeout=g.stream_keepalive)
+        except Empty:
+            if not subscription.client.isConnected():
+                yield 'event: error\ndata: {}\n\n'.format(json.dumps(g.error_resp[-1]))
+                return
+            # A comment line keeps proxies from timing out an idle stream
+            yield ': keepalive\n\n'
+            continue
+        yield 'event: {}\ndata: {}\n\n'.format(typeName, json.dumps(data))
+        # An error for our tickerId (ie no market data permissions) ends the stream
+        if typeName == 'error':
+            return
+
+
+def stream_market_data(symbol, args):
+    """ Subscribes to tickPrice and tickSize messages for the contract of `symbol` and `args`.  All listeners of a
+    contract share one reqMktData subscription, along with /market requests.
+    https://www.interactivebrokers.com/en/software/api/apiguide/java/reqmktdata.htm
+
+    Returns `(events, close)`: a generator of Server-Sent Events, and a function to call once the HTTP client is gone.
+    Returns an error response instead if every market data line is already held by a stream.
+    """
+    contract = make_contract(str(symbol), args)
+    subscription, listener = _market_subscribe(_market_key(contract), contract)
+    if subscription is None:
+        return g.error_resp[-3]
+    if listener is None:
+        return subscription.error
+    return _market_events(subscription, listener), partial(_market_unsubscribe, subscription, listener)
 
 
 # ---------------------------------------------------------------------
 # HISTORY FUNCTIONS
 # ---------------------------------------------------------------------
 # TODO move this to sync.py since it is not really a feed (it provides a `finished` message)
-def get_history(symbol, args):
-    """ Args may be any of those in reqHistoricalData()
-    https://www.interactivebrokers.com/en/software/api/apiguide/java/reqhistoricaldata.htm
+def _request_history(contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, formatDate):
+    """ Sends one reqHistoricalData and waits for its bars.  Returns `(done, error)` where `done` is the finished
+    pending.Pending, whose `resp` is a bars.Bars.
     """
-    log.debug('history symbol {}, args: {}'.format(symbol, args))
-
     client = connection.get_client()
     if client is None:
-        return g.error_resp[-2]
+        return None, g.error_resp[-2]
     elif client.isConnected() is False:
-        return g.error_resp[-1]
-
-    # Populate contract with appropriate
-    contract = utils.make_contract(str(symbol), args)
-
-    # log.debug('contract: {}'.format(contract))
+        connection.close_client(client)
+        return None, g.error_resp[-1]
 
     our_tickerId = get_tickerId()
-    g.history_resp[our_tickerId] = dict()
     g.error_resp[our_tickerId] = None
-    # endtime = (datetime.now() - timedelta(minutes=15)).strftime('%Y%m%d %H:%M:%S')
-    log.debug('requesting historical data')
     req_dict = dict(tickerId=our_tickerId,
                     contract=contract,
-                    endDateTime=str(args.get('endDateTime', datetime.now().strftime('%Y%m%d %H:%M:%S'))),
-                    durationStr=str(args.get('durationStr', '1 D')),
-                    barSizeSetting=str(args.get('barSizeSetting', '1 min')),
-                    whatToShow=args.get('whatToShow', 'TRADES'),
-                    useRTH=int(args.get('useRTH', 0)),
-                    formatDate=int(args.get('formatDate', 2))
+                    endDateTime=endDateTime,
+                    durationStr=durationStr,
+                    barSizeSetting=barSizeSetting,
+                    whatToShow=whatToShow,
+                    useRTH=useRTH,
+                    formatDate=formatDate
                     )
-    log.debug('req_dict {}'.format(req_dict))
-    client.reqHistoricalData(**req_dict)
-
-    """
-    durationStr='60 S',
-    barSizeSetting='1 min',
-    whatToShow='TRADES',
-    useRTH=0,
-    formatDate=1)
-    """
-    log.debug('waiting for historical data)')
-    timeout = g.timeout
-    while not any(
-            ["finished" in h for h in g.history_resp[our_tickerId].keys()]) and client.isConnected() and timeout > 0:
-        log.debug("Waiting for History responses on client {}...".format(client.clientId))
-        if g.error_resp.get(our_tickerId, None) is not None:
-            # An errorCode of 366 seen on IBGW logs is often meaningless since it shows up for every history call several
-            # seconds after it's already found data and receive the "finished" message.  If data
+    log.debug('req_dict %s', req_dict)
+    try:
+        done = pending.expect(('historicalData', our_tickerId), resp=bars.Bars(), client=client)
+        client.reqHistoricalData(**req_dict)
+
+        log.debug('waiting for historical data)')
+        done.wait()
+        if done.error is not None:
+            # An errorCode of 366 seen on IBGW logs is often meaningless since it shows up for every history call
+            # several seconds after it's already found data and receive the "finished" message.  If data
             # did exist, then it would be returned before the error message was generated
-            connection.close_client(client)
-            return g.error_resp[our_tickerId]
-        elif client.isConnected() is False:
-            return {'errorMsg': 'Connection lost'}
-        time.sleep(0.25)
-        timeout -= 1
-    # log.debug('history: {}'.format(g.history_resp))
-    log.debug('closing historical data stream')
-    client.cancelHistoricalData(our_tickerId)
-    connection.close_client(client)
-    return g.history_resp.pop(our_tickerId)
+            if client.isConnected() is False:
+                return done, {'errorMsg': 'Connection lost'}
+            return done, done.error
+        log.debug('closing historical data stream')
+        client.cancelHistoricalData(our_tickerId)
+        return done, None
+    finally:
+        connection.close_client(client)
+
+
+def _paced_history(priority, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, formatDate):
+    """ Like `_request_history()`, once pacing allows.  Callers making an identical request at the same time share
+    one.  Returns `(done, error, waited)`, with the seconds we were queued for.
+    """
+    key = (_market_key(contract), endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, formatDate)
+    send = partial(_request_history, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                   formatDate)
+    (done, error), waited = pacing.run(key, (key[0], whatToShow), send, priority)
+    if error is not None:
+        pacing.forget(key)
+    return done, error, waited
+
+
+def _too_busy(rule, priority, count):
+    """ Returns an error response if `count` requests would be queued for over g.history_max_wait seconds """
+    wait = pacing.estimate(rule, priority, count)
+    if wait <= g.history_max_wait:
+        return None
+    return dict(g.error_resp[-4], retryAfter=int(math.ceil(wait)))
+
+
+def _fetch_chunks(app, series, contract, chunks, priority, cancelled):
+    """ Fetches the `(start, end, fetched)` chunks of `series` on up to g.history_workers threads (in `app`'s context),
+    earliest first, until `cancelled` is set.  Each chunk's bars are added to `series` as it comes in, then it's taken
+    off `series.fetching` and its `fetched` Event set.  Returns a Queue per chunk which gets its
+    `(done, error, waited)`.
+    """
+    contract_key, barSizeSetting, whatToShow, useRTH = series.key
+    bar = bars.bar_seconds(barSizeSetting)
+    todo = Queue()
+    results = []
+    for start, end, fetched in chunks:
+        result = Queue(maxsize=1)
+        todo.put((start, end, fetched, result))
+        results.append(result)
+
+    def work():
+        with app.app_context():
+            fetch()
+
+    def fetch():
+        while True:
+            try:
+                start, end, fetched, result = todo.get_nowait()
+            except Empty:
+                return
+            answer = None
+            if not cancelled.is_set():
+                try:
+                    answer = _paced_history(priority, contract, bars.format_end(end),
+                                            bars.gap_duration(start, end, bar), barSizeSetting, whatToShow, useRTH, 2)
+                except Exception:
+                    log.exception('Fetching historical data for %s failed', contract.m_symbol)
+                    answer = (None, g.error_resp[-1], 0.0)
+            with series.lock:
+                if answer is not None:
+                    done, error = answer[:2]
+                    # "HMDS query returned no data" just means there are no bars in the chunk, ie over a holiday
+                    if done is not None and (error is None or 'returned no data' in str(error.get('errorMsg'))):
+                        try:
+                            # The bar still being built (and anything after it) may change, so we never record
+                            # holding it
+                            if done.is_finished():
+                                series.add(done.resp, start, min(end, bars.final_before(time.time(), bar)))
+                            else:
+                                series.add(done.resp)
+                            series.save()
+                        except Exception:
+                            log.exception('Storing historical data for %s failed', contract.m_symbol)
+                series.fetching.remove((start, end, fetched))
+            fetched.set()
+            if answer is not None:
+                result.put(answer)
+
+    for i in xrange(min(g.history_workers, len(chunks))):
+        worker = threading.Thread(target=work, name='history-{}'.format(i))
+        worker.daemon = True
+        worker.start()
+    return results
+
+
+def _series_bars(app, series, contract, start, end, priority, paced):
+    """ Generates the bars.Bars of `series` within `[start, end)`, in time order.  Gaps we don't hold are fetched from
+    TWS in chunks, concurrently, and generated as each is stitched in.  If TWS answers a chunk with an error, generates
+    the error response and stops.  Adds the seconds spent queued for pacing to `paced['waited']`.
+
+    The series' lock is only held to look at it, never while we yield, so a slow reader holds up nobody.  Gaps another
+    request is already fetching are waited on rather than fetched again.
+    """
+    bar = bars.bar_seconds(series.key[1])
+    cancelled = threading.Event()
+    while True:
+        with series.lock:
+            gaps = series.missing(start, end)
+            fetching = [fetched for fetch_start, fetch_end, fetched in series.fetching
+                        if fetch_start < end and fetch_end > start]
+            if not gaps or not fetching:
+                chunks = [(chunk_start, chunk_end, threading.Event()) for chunk_start, chunk_end in
+                          bars.chunks(gaps, bar)]
+                series.fetching.extend(chunks)
+                break
+        for fetched in fetching:
+            fetched.wait()
+    bars.count(not chunks)
+    try:
+        if chunks:
+            log.debug('requesting historical data in chunks %s', [chunk[:2] for chunk in chunks])
+        results = _fetch_chunks(app, series, contract, chunks, priority, cancelled)
+        cursor = start
+        for (chunk_start, chunk_end, fetched), result in zip(chunks, results):
+            with series.lock:
+                segment = series.between(cursor, chunk_start)
+            yield segment
+            done, error, waited = result.get()
+            paced['waited'] += waited
+            if error is not None and 'returned no data' not in str(error.get('errorMsg')):
+                yield error
+                return
+            with series.lock:
+                segment = series.between(chunk_start, chunk_end)
+            yield segment
+            cursor = chunk_end
+        with series.lock:
+            segment = series.between(cursor, end)
+        yield segment
+    finally:
+        # Stop fetching chunks nobody will read, ie when a stream's client went away
+        cancelled.set()
+
+
+def _finished(start, end):
+    """ Returns the date of the "finished" bar TWS would end its answer for `[start, end)` with """
+    return 'finished-{}-{}'.format(time.strftime('%Y%m%d  %H:%M:%S', time.localtime(start)),
+                                   time.strftime('%Y%m%d  %H:%M:%S', time.localtime(end)))
+
+
+def _session_bars(app, series, contract, days, fetch_start, end, priority, paced, shape, unstored):
+    """ Generates the bars.Bars of the last `days` trading sessions of `series` up to `end`, or else an error response,
+    once every bar from `fetch_start` is in.  Sets `shape['finished']` once we know when they start.  Should our bars
+    still not tell (ie over a long run of holidays), generates `unstored()` instead, which asks TWS.
+    """
+    for segment in _series_bars(app, series, contract, fetch_start, end, priority, paced):
+        if isinstance(segment, dict):
+            yield segment
+            return
+    with series.lock:
+        start = series.session_start(days, end, bars.final_before(time.time(), shape['bar']))
+        segment = series.between(start, end) if start is not None else None
+    if start is None:
+        log.debug('Bars store can\'t tell when the last %s sessions started.  Asking TWS.', days)
+        for segment in unstored():
+            yield segment
+        return
+    shape['finished'] = _finished(start, end)
+    yield segment
+
+
+def _finished_bar(date):
+    """ Returns the `(date, bar)` of the "finished-<start>-<end>" bar TWS ends its answer with """
+    return date, dict(date=date, open=-1, high=-1, low=-1, close=-1, volume=-1, count=-1, WAP=-1, hasGaps=False)
+
+
+def _unstored_history(app, priority, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                      formatDate, paced, series=None):
+    """ Generates the bars.Bars of one request straight to TWS, or its error response.  Given a `series`, its bars are
+    kept in it, as every bar of the window TWS says it answered for.
+    """
+    # A stream's generator runs after the request's context is gone
+    with app.app_context():
+        done, error, waited = _paced_history(priority, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                             useRTH, formatDate)
+    paced['waited'] += waited
+    if error is not None:
+        yield error
+        return
+    window = bars.finished_window(done.resp.finished)
+    if series is not None and window is not None:
+        # Its first bar may start before the window, if the window starts part way through it
+        start = min(window[0], done.resp.time[0]) if len(done.resp) else window[0]
+        final = bars.final_before(time.time(), bars.bar_seconds(barSizeSetting))
+        with series.lock:
+            series.add(done.resp, start, min(window[1], final), opens=True)
+            series.save()
+    yield done.resp
+
+
+def _history(symbol, args, stream=False):
+    """ Starts answering a /history request.  Returns `(segments, paced, shape)`: `segments` generates bars.Bars in
+    time order, or else ends with an error response, `paced['waited']` counts the seconds spent queued for pacing, and
+    `shape` has what `_bar_dicts()` needs to render them.  Returns an error response as `segments` if we'd be queued
+    for too long, for all of the request or with `stream` for its first chunk.
+    """
+    log.debug('history symbol %s, args: %s', symbol, args)
+
+    # Populate contract with appropriate
+    contract = utils.make_contract(str(symbol), args)
+    endDateTime = str(args.get('endDateTime', datetime.now().strftime('%Y%m%d %H:%M:%S')))
+    durationStr = str(args.get('durationStr', '1 D'))
+    barSizeSetting = str(args.get('barSizeSetting', '1 min'))
+    whatToShow = str(args.get('whatToShow', 'TRADES'))
+    useRTH = int(args.get('useRTH', 0))
+    formatDate = int(args.get('formatDate', 2))
+    priority = int(args.get('priority', 0))
+    rule = (_market_key(contract), whatToShow)
+    paced = dict(waited=0.0)
+    app = current_app._get_current_object()
+    try:
+        bar = bars.bar_seconds(barSizeSetting)
+        end = bars.parse_end(endDateTime)
+        days = bars.session_days(durationStr)
+        start = bars.duration_start(durationStr, end) if days is None else None
+    except ValueError as e:
+        log.debug('Not using bars store: %s', e)
+        error = _too_busy(rule, priority, 1)
+        if error is not None:
+            return error, paced, None
+        segments = _unstored_history(app, priority, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                     useRTH, formatDate, paced)
+        return segments, paced, dict(bar=None, formatDate=formatDate, finished=None)
+
+    series = bars.series((rule[0], barSizeSetting, whatToShow, useRTH))
+    shape = dict(bar=bar, formatDate=formatDate, finished=None)
+    if days is not None:
+        # Also without the series' lock.  Should a fetch change it meanwhile, we still only serve bars we hold.
+        start = series.session_start(days, end, bars.final_before(time.time(), bar))
+        if start is None:
+            # Fetch enough weekdays back to hold every session despite holidays, then count them
+            fetch_start = bars.midnight(bars.duration_start(durationStr, end), -(days // 5 + 1))
+            chunks = len(bars.chunks(series.missing(fetch_start, end), bar))
+            error = _too_busy(rule, priority, chunks)
+            if error is not None:
+                return error, paced, None
+            unstored = partial(_unstored_history, app, priority, contract, endDateTime, durationStr, barSizeSetting,
+                               whatToShow, useRTH, 2, paced, series)
+            segments = _session_bars(app, series, contract, days, fetch_start, end, priority, paced, shape, unstored)
+            return segments, paced, shape
+    # Without the series' lock, so only an estimate like the rest
+    chunks = len(bars.chunks(series.missing(start, end), bar))
+    if chunks:
+        error = _too_busy(rule, priority, 1 if stream else chunks)
+        if error is not None:
+            return error, paced, None
+    segments = _series_bars(app, series, contract, start, end, priority, paced)
+    shape['finished'] = _finished(start, end)
+    return segments, paced, shape
+
+
+def _bar_dicts(segments, shape):
+    """ Generates the `(date, bar)` of each bar in `segments` like TWS's historicalData messages, ending with the
+    "finished" bar, or else with `(None, error)`
+    """
+    last = None
+    for segment in segments:
+        if isinstance(segment, dict):
+            yield None, segment
+            return
+        for i in xrange(len(segment)):
+            date = bars.bar_date(segment.time[i], shape['bar'], shape['formatDate'])
+            bar_dict = segment.row(i)
+            bar_dict['date'] = date
+            yield date, bar_dict
+        last = segment
+    if shape['finished'] is not None:
+        yield _finished_bar(shape['finished'])
+    elif last is not None and last.finished is not None:
+        yield _finished_bar(last.finished)
+
+
+def get_history(symbol, args):
+    """ Args may be any of those in reqHistoricalData()
+    https://www.interactivebrokers.com/en/software/api/apiguide/java/reqhistoricaldata.htm
+
+    Bars already in our bars store are served from it, and only the gaps of the requested interval are requested from
+    TWS, split into chunks short enough for TWS to accept and fetched concurrently.  Args we can't work out the interval
+    of are passed straight to TWS.  Requests to TWS are paced (see pacing.py), queued by the optional `priority` arg
+    (higher first, default 0).
+
+    Returns `(resp, waited)`, with the seconds spent queued for pacing.  If the queue is too long, returns an error
+    response with the seconds to `retryAfter` instead of waiting.
+    """
+    segments, paced, shape = _history(symbol, args)
+    if isinstance(segments, dict):
+        return segments, paced['waited']
+    resp = dict()
+    for date, bar_dict in _bar_dicts(segments, shape):
+        if date is None:
+            return bar_dict, paced['waited']
+        resp[date] = bar_dict
+    return resp, paced['waited']
+
+
+def get_history_bars(symbol, args):
+    """ Like `get_history()`, but returns the bars as one bars.Bars (or an error response) for the columnar formats """
+    segments, paced, shape = _history(symbol, args)
+    if isinstance(segments, dict):
+        return segments, paced['waited']
+    found = bars.Bars()
+    for segment in segments:
+        if isinstance(segment, dict):
+            return segment, paced['waited']
+        found.extend(segment)
+    return found, paced['waited']
+
+
+def stream_history(symbol, args):
+    """ Like `get_history()`, but returns a generator of newline delimited JSON: one bar per line in time order, from
+    as soon as the first are in.  An error part way through is sent as the last line.  Returns an error response
+    instead if the first chunk would be queued too long.
+    """
+    segments, paced, shape = _history(symbol, args, stream=True)
+    if isinstance(segments, dict):
+        return segments
+    return ('{}\n'.format(json.dumps(bar_dict)) for date, bar_dict in _bar_dicts(segments, shape))
@@ -13,6 +13,8 @@ __author__ = 'Jason Haury'
 ibgw_host = os.getenv('IBGW_PORT_4003_TCP_ADDR', os.getenv('IBGW_HOST', '127.0.0.1'))
 ibgw_port = int(os.getenv('IBGW_PORT_4003_TCP_PORT', os.getenv('IBGW_PORT', '4003')))  # Use 7496 for TWS
 client_id = int(os.getenv('IBGW_CLIENT_ID', 0))  # Use a unique value for each IBREST instance you connect to same TWS
+# Number of connections to TWS, using clientIds client_id to client_id + pool_size - 1.  Orders always use client_id.
+pool_size = int(os.getenv('IBGW_POOL_SIZE', 1))
 
 # Beacon globals
 id_secret_key = os.getenv('ID_SECRET_KEY', None)
@@ -22,11 +24,36 @@ beacon_current_token = None
 current_ip = None
 
 timeout = 20  # Max loops
+# Seconds to wait for TWS to finish answering a request before returning what we have so far
+request_timeout = float(os.getenv('IBREST_REQUEST_TIMEOUT', 5))
+market_ticks = 5  # Number of tickPrice/tickSize messages to collect for a /market response
+# Most reqMktData lines to hold open at once (IB's default allowance is 100), and seconds an unused one is kept for
+market_lines = int(os.getenv('IBREST_MARKET_LINES', 100))
+market_idle_timeout = float(os.getenv('IBREST_MARKET_IDLE_TIMEOUT', 300))
+stream_keepalive = 15  # Seconds between keepalive comments on an idle /market/<symbol>/stream
+stream_queue_size = 1000  # Messages buffered per stream listener before it starts missing them
+# Folder historical bars are saved in between restarts.  Set it empty to only keep them in memory.
+bar_cache_dir = os.getenv('IBREST_BAR_CACHE_DIR', 'bar_cache')
+# Most bars held in memory.  Past it, the series used longest ago are dropped, to be loaded from bar_cache_dir again.
+bar_cache_bars = int(os.getenv('IBREST_BAR_CACHE_BARS', 5000000))
+# Most seconds a /history request may be queued to keep within IB's pacing rules before we answer 429 instead
+history_max_wait = float(os.getenv('IBREST_HISTORY_MAX_WAIT', 30))
+history_workers = 4  # Chunks of one /history request fetched from TWS at once
+compress_min_size = 1024  # Bytes a response must have to be worth compressing for Accept-Encoding
+compress_level = 6  # zlib level, from 1 (fastest) to 9 (smallest)
+# Folder each connection's bytes from TWS are captured in, for bench/replay.py.  Empty (the default) captures nothing.
+capture_dir = os.getenv('IBREST_CAPTURE_DIR', '')
+# Level we log at, and levels of chosen loggers (and those under them) as comma separated name=LEVEL pairs, ie
+# 'handlers=DEBUG,sync=DEBUG,ib=WARNING'
+log_level = os.getenv('IBREST_LOG_LEVEL', 'INFO').upper()
+log_levels = dict(pair.strip().split('=', 1) for pair in os.getenv('IBREST_LOG_LEVELS', '').split(',') if '=' in pair)
+# Seconds between DEBUG records from any one line of code, since some dump every message from TWS.  0 logs them all.
+log_debug_interval = float(os.getenv('IBREST_LOG_DEBUG_INTERVAL', 1))
 
 # Mutables
 managedAccounts = set()
-clientId_in_use = False
 client_connection = ibConnection(ibgw_host, ibgw_port, client_id)
+client_pool = []  # All our connections, starting with client_connection
 getting_order_id = False
 orderId = 0
 tickerId = 0
@@ -35,30 +62,21 @@ tickerId = 0
 # ---------------------------------------------------------------------
 # SYNCHRONOUS RESPONSES
 # ---------------------------------------------------------------------
-# Responses.  Global dicts to use for our responses as updated by Message handlers, keyed by clientId
-portfolio_positions_resp = {client_id: dict()}
-account_summary_resp = {client_id: dict(accountSummaryEnd=False)}
-account_update_resp = dict(accountDownloadEnd=False, updateAccountValue=dict(), updatePortfolio=[])
-# Track errors keyed in "id" which is the orderId or tickerId (or -1 for connection errors)
+# Each request collects its own response on its pending.Pending.  Only state which outlives a single request is kept
+# here.
+# Track errors keyed in "id" which is the orderId or tickerId.  Negative ids are our own errors, which TWS' messages for
+# no request in particular (id -1, ie 2104 "Market data farm connection is OK") never overwrite.
 error_resp = {-1: {"errorCode": 502, "errorMsg": "Couldn't connect to TWS.  Confirm that \"Enable ActiveX and Socket "
                                                  "Clients\" is enabled on the TWS \"Configure->API\" menu.", "id": -1},
-              -2: {"errorCode": None, "errorMsg": "Too many requests.  Client ID not available in time.  Try request later", "id": -2}}
-
-# Store contractDetails messages
-contract_resp = dict(contractDetailsEnd=False, contractDetails=dict(), bondContractDetails=dict())
-# When getting order info, we want it for all clients, and don't care so much if multiple requests try to populate this
-order_resp = dict(openOrderEnd=False, openOrder=[], orderStatus=[])
-# When placing/deleting orders, we care about what orderId is used.  Key off orderId.
-order_resp_by_order = dict()
-# Recent Executions
-executions_resp = dict(execDetailsEnd=False, execDetails=[], commissionReport=dict())
+              -2: {"errorCode": None, "errorMsg": "No client connected to TWS.  Try request later", "id": -2},
+              -3: {"errorCode": None, "errorMsg": "All market data lines are in use by streams.  Try request later", "id": -3},
+              -4: {"errorCode": None, "errorMsg": "Too many historical data requests queued for IB's pacing rules.  Try request after retryAfter seconds", "id": -4},
+              -5: {"errorCode": 502, "errorMsg": "Connection to TWS closed before it answered.  Try request later", "id": -5}}
 
 
 # ---------------------------------------------------------------------
-# FEED RESPONSE BUFFERS
+# FEED SUBSCRIPTIONS
 # ---------------------------------------------------------------------
-# Globals to use for feed responses
-market_resp = dict()  # market feed
-# Dict of history responses keyed off of reqId (tickerId)
-history_resp = dict()
+# feeds.MarketSubscription keyed by tickerId, for handlers to publish ticks to
+market_streams = dict()
 
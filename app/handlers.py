@@ -1,8 +1,14 @@
 """ Needs documentation
 """
+import accounts
+import bars
 import globals as g
+import metrics
+import pending
 # import os
 import json
+import sys
+import time
 # import sync
 from ib.ext.Contract import Contract
 from ib.ext.Order import Order
@@ -10,13 +16,13 @@ from ib.ext.OrderState import OrderState
 from ib.ext.ContractDetails import ContractDetails
 from ib.ext.Execution import Execution
 from ib.ext.CommissionReport import CommissionReport
-from database import FilledOrders, Commissions,  db_session
+import database
+from database import FilledOrders, Commissions
 import logging
 
 __author__ = 'Jason Haury'
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 
 
 
@@ -45,114 +51,132 @@ def connection_handler(msg):
         g.orderId = max(int(msg.orderId), g.orderId)
         # log.info('Connection lock released.  OrderId set to {}'.format(g.orderId))
         # g.getting_order_id = False  # Unlock place_order() to now be called again.
-        log.info('Updated orderID: {}'.format(g.orderId))
+        log.info('Updated orderID: %s', g.orderId)
     elif msg.typeName == 'managedAccounts':
         g.managedAccounts = set(msg.accountsList.split(','))
-        log.debug('Updated managed accounts: {}'.format(g.managedAccounts))
+        log.debug('Updated managed accounts: %s', g.managedAccounts)
 
 
 def account_summary_handler(msg):
-    """ Update our global Account Summary data response dict
+    """ Update our account summary with each tag's value
     """
     if msg.typeName == 'accountSummary':
-        # account = msg_to_dict(msg)
-        g.account_summary_resp[int(msg.reqId)][msg.tag] = msg.value
+        accounts.summary.update(msg.tag, msg.value)
     elif msg.typeName == 'accountSummaryEnd':
-        g.account_summary_resp[int(msg.reqId)]['accountSummaryEnd'] = True
-    log.debug('SUMMARY: {})'.format(msg))
+        accounts.summary.finish()
+    log.debug('SUMMARY: %s)', msg)
 
 
 def account_update_handler(msg):
-    """ Update our global Account Update data response dict
+    """ Update our account values and portfolio of the account we're subscribed to
     """
-    if msg.typeName == 'updateAccountTime':
-        g.account_update_resp[msg.typeName] = msg.updateAccountTime
-    elif msg.typeName == 'updateAccountValue':
-        account = msg_to_dict(msg)
-        g.account_update_resp[msg.typeName][msg.key] = account
-    elif msg.typeName == 'updatePortfolio':
-        account = msg_to_dict(msg)
-        g.account_update_resp[msg.typeName].append(account.copy())
+    if msg.typeName in ['updateAccountTime', 'updateAccountValue', 'updatePortfolio']:
+        accounts.updates.update(msg.typeName, msg_to_dict(msg))
     elif msg.typeName == 'accountDownloadEnd':
-        g.account_update_resp[msg.typeName] = True
-    log.debug('UPDATE: {})'.format(msg))
+        accounts.updates.finish()
+    log.debug('UPDATE: %s)', msg)
 
 
 def portfolio_positions_handler(msg):
-    """ Update our global Portfolio Positions data response dict
+    """ Update our positions with each one TWS sends
     """
     if msg.typeName == 'position':
-        position = msg_to_dict(msg)
-        g.portfolio_positions_resp['positions'].append(position.copy())
+        accounts.positions.update(msg_to_dict(msg))
     elif msg.typeName == 'positionEnd':
-        g.portfolio_positions_resp['positionEnd'] = True
-    log.debug('POSITION: {})'.format(msg))
+        accounts.positions.finish()
+    log.debug('POSITION: %s)', msg)
 
 
 def history_handler(msg):
-    """ Update our global history data response dict
+    """ Append the bar to the history response (a bars.Bars) of the request with this reqId
     """
-    history = msg_to_dict(msg)
-    g.history_resp[int(history['reqId'])][msg.date] = history.copy()
+    waiting = pending.responses('historicalData', int(msg.reqId))
+    # The last bar of a request has a date of "finished-<start>-<end>"
+    if msg.date.startswith('finished'):
+        for resp in waiting:
+            resp.finished = msg.date
+        pending.finish('historicalData', int(msg.reqId))
+    elif waiting:
+        t = bars.bar_time(msg.date)
+        for resp in waiting:
+            resp.append(t, msg.open, msg.high, msg.low, msg.close, msg.volume, msg.count, msg.WAP, msg.hasGaps)
     # log.debug('HISTORY: {})'.format(msg))
 
 
 def order_handler(msg):
-    """ Update our global Order data response dict
+    """ Update our order book with the latest openOrder and orderStatus of each orderId
     """
     if msg.typeName in ['orderStatus', 'openOrder']:
         d = msg_to_dict(msg)
-        g.order_resp[msg.typeName].append(d.copy())
-        order_msg = g.order_resp_by_order.get(d['orderId'], dict(openOrder=dict(), orderStatus=dict()))
-        order_msg[msg.typeName] = d.copy()
-        g.order_resp_by_order[d['orderId']] = order_msg
+        order_msg = accounts.book.update(msg.typeName, d)
 
-        # Save all filled orders to SQLite DB
+        # Save all filled orders to SQLite DB, off this thread
         if msg.typeName == 'orderStatus' and msg.status == 'Filled':
-            filled_order = FilledOrders(msg.id, json.dumps(d))
-            db_session.merge(filled_order)
-            db_session.commit()
-
-
-        log.debug('ORDER: {}'.format(d))
+            contract = order_msg['openOrder'].get('contract', dict())
+            order = order_msg['openOrder'].get('order', dict())
+            database.save(FilledOrders(order_id=msg.orderId, perm_id=msg.permId, symbol=contract.get('m_symbol'),
+                                       account=order.get('m_account'), side=order.get('m_action'), qty=msg.filled,
+                                       price=msg.avgFillPrice, time=int(time.time()), order_status=json.dumps(d)))
+
+        if msg.typeName == 'orderStatus':
+            pending.finish('orderStatus', d['orderId'])
+        log.debug('ORDER: %s', d)
     elif msg.typeName == 'openOrderEnd':
-        g.order_resp['openOrderEnd'] = True
-    log.debug('ORDER: {})'.format(msg))
+        accounts.book.finish()
+    log.debug('ORDER: %s)', msg)
 
 
 def contract_handler(msg):
-    """ Update our global to keep the latest ContractDetails available for API returns.
+    """ Update the ContractDetails response of the request with this reqId.
     https://www.interactivebrokers.com/en/software/api/apiguide/java/contractdetails.htm
 
     """
     if msg.typeName in ['contractDetails', 'bondContractDetails']:
         d = msg_to_dict(msg)
-        g.contract_resp[msg.typeName][msg.reqId] = d[msg.typeName].copy()
-        log.debug('CONTRACT: {}'.format(d))
+        for resp in pending.responses('contractDetailsEnd', int(msg.reqId)):
+            resp[msg.typeName] = d[msg.typeName].copy()
+        log.debug('CONTRACT: %s', d)
     elif msg.typeName == 'contractDetailsEnd':
-        g.contract_resp['contractDetailsEnd'] = True
-    log.debug('CONTRACT: {})'.format(msg))
+        for resp in pending.responses('contractDetailsEnd', int(msg.reqId)):
+            resp['contractDetailsEnd'] = True
+        pending.finish('contractDetailsEnd', int(msg.reqId))
+    log.debug('CONTRACT: %s)', msg)
 
 
 def executions_handler(msg):
-    """ Update our global to keep the latest execDetails available for API returns.
+    """ Update the execDetails response of the request with this reqId.
     https://www.interactivebrokers.com/en/software/api/apiguide/java/execdetails.htm
 
     """
     if msg.typeName in ['execDetails', 'commissionReport']:
         d = msg_to_dict(msg)
-        log.debug('Dictified msg: {}'.format(d))
+        log.debug('Dictified msg: %s', d)
         if msg.typeName == 'execDetails':
-            g.executions_resp[msg.typeName].append(dict(execution=d['execution'].copy(), contract=d['contract'].copy()))
-        # Save all CommissionReports to SQLite DB
+            for resp in pending.responses('execDetailsEnd', int(msg.reqId)):
+                resp[msg.typeName].append(dict(execution=d['execution'].copy(), contract=d['contract'].copy()))
+            # Save all executions to SQLite DB, off this thread.  Their time may be followed by a time zone.
+            execution = msg.execution
+            database.save(Commissions(exec_id=execution.m_execId, order_id=execution.m_orderId,
+                                      perm_id=execution.m_permId, symbol=msg.contract.m_symbol,
+                                      account=execution.m_acctNumber,
+                                      side=database.SIDES.get(execution.m_side, execution.m_side),
+                                      qty=execution.m_shares, price=execution.m_price,
+                                      time=bars.bar_time(' '.join(execution.m_time.split()[:2])),
+                                      execution=json.dumps(dict(execution=d['execution'], contract=d['contract']))))
+        # Save all CommissionReports to SQLite DB, off this thread
         elif msg.typeName == 'commissionReport':
-            commission_report = Commissions(msg.m_execId, json.dumps(d))
-            db_session.merge(commission_report)
-            db_session.commit()
-        log.debug('EXECUTIONS: {}'.format(d))
+            report = msg.commissionReport
+            # TWS sends Java's Double.MAX_VALUE until a closing execution has realized P&L
+            realized_pnl = None if report.m_realizedPNL >= sys.float_info.max else report.m_realizedPNL
+            database.save(Commissions(exec_id=report.m_execId, commission=report.m_commission,
+                                      currency=report.m_currency, realized_pnl=realized_pnl,
+                                      commission_report=json.dumps(d)))
+        log.debug('EXECUTIONS: %s', d)
     elif msg.typeName == 'execDetailsEnd':
-        g.executions_resp['execDetailsEnd'] = True
-    log.debug('EXECUTIONS: {})'.format(msg))
+        for resp in pending.responses('execDetailsEnd', int(msg.reqId)):
+            resp['execDetailsEnd'] = True
+        pending.finish('execDetailsEnd', int(msg.reqId))
+    log.debug('EXECUTIONS: %s)', msg)
 
 
 def error_handler(msg):
@@ -162,22 +186,51 @@ def error_handler(msg):
 
     IbPy provides and id of -1 for connection error messages
     """
+    metrics.ERRORS.inc((str(msg.errorCode),))
+    if msg.id is None:
+        # An exception in IbPy (ie our EReader's) rather than an answer to any request.  Requests waiting without a
+        # reqId wait on None, so it mustn't finish them.
+        log.error('ERROR: %s', msg)
+        return
+    if msg.id < 0:
+        # Not about any request of ours, and mostly notices (2100-2199) such as 2104 "Market data farm connection is
+        # OK".  Keep it out of error_resp, whose negative ids are our own errors.
+        if 2100 <= msg.errorCode < 2200:
+            log.info('TWS notice: %s', msg)
+        else:
+            log.error('ERROR: %s', msg)
+        return
     g.error_resp[msg.id] = {i[0]: i[1] for i in msg.items()}
-    log.error('ERROR: {}'.format(msg))
+    log.error('ERROR: %s', msg)
+    subscription = g.market_streams.get(msg.id)
+    if subscription is not None:
+        subscription.fail(g.error_resp[msg.id])
+    accounts.fail(msg.id, g.error_resp[msg.id])
+    # Whatever request caused this error won't get its End message, so stop waiting on it
+    pending.finish_id(msg.id, g.error_resp[msg.id])
 
     # TODO if clientId is already in use erroneously, attempt to recover, or generate new clientId
     # If our client connections get out of sync:
 
 
+def connection_closed_handler(msg, client=None):
+    """ Stop waiting on any requests sent on `client` when TWS closes its connection, since nothing more will come back
+    for them
+    """
+    log.warn('Connection to TWS closed for client %s', getattr(client, 'clientId', None))
+    pending.finish_all(g.error_resp[-5], client)
+
+
 def generic_handler(msg):
-    log.debug('MESSAGE: {}, {})'.format(msg, msg.keys))
+    log.debug('MESSAGE: %s, %s)', msg, msg.keys)
 
 
 # ---------------------------------------------------------------------
 # FEED MESSAGE HANDLERS
 # ---------------------------------------------------------------------
 def market_handler(msg):
-    """ Update our global Market data response dict
+    """ Update the cached quote (and streams) of the market data subscription with this tickerId
     """
-    resp = msg_to_dict(msg)
-    g.market_resp[int(msg.tickerId)].append(resp.copy())
+    subscription = g.market_streams.get(int(msg.tickerId))
+    if subscription is not None:
+        subscription.update(msg.typeName, msg_to_dict(msg))
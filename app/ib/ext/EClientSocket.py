@@ -19,6 +19,8 @@ def synchronized(call):
 #
 # WARNING: all changes to this file will be lost.
 
+import functools
+
 from ib.ext.EClientErrors import EClientErrors
 from ib.ext.EReader import EReader
 from ib.ext.Util import Util
@@ -29,6 +31,37 @@ from ib.lib import Double, Integer
 
 from threading import RLock
 mlock = RLock()
+
+
+def flushed(call):
+    """ Writes everything a request method buffered to the socket in a single call once it returns.  If it raises
+    instead, what it buffered is dropped, since sending part of a request would corrupt the stream.
+
+    @param call EClientSocket request method
+    @return decorated method
+    """
+    name = call.__name__
+    @functools.wraps(call)
+    def inner(self, *args, **kwds):
+        try:
+            result = call(self, *args, **kwds)
+        except Exception:
+            dos = self.m_dos
+            if dos is not None:
+                dos.discard()
+            raise
+        # None when the request failed and closed the connection
+        dos = self.m_dos
+        if dos is not None:
+            try:
+                dos.flush(name)
+            except Exception as e:
+                self.error(EClientErrors.NO_VALID_ID, EClientErrors.FAIL_SEND, str(e))
+                self.close()
+        return result
+    # Tells callers (ie our Multiplexer) this method is a request written to the socket
+    inner.flushed = True
+    return inner
 # 
 #  * EClientSocket.java
 #  *
@@ -223,6 +256,10 @@ class EClientSocket(object):
     m_serverVersion = 0
     m_TwsTime = ""
     m_socket = None
+    m_requestStats = None   #  per request type counts of requests and bytes sent
+    #  optional callable taking the clientId on each connect, returning a callable given every chunk of bytes read
+    #  from TWS (ie to capture the session), or None.  Set a staticmethod or a partial, so it isn't bound.
+    captureFactory = None
 
     def serverVersion(self):
         """ generated source for method serverVersion """
@@ -243,6 +280,13 @@ class EClientSocket(object):
     def __init__(self, anyWrapper):
         """ generated source for method __init__ """
         self.m_anyWrapper = anyWrapper
+        self.m_requestStats = {}
+
+    def sendStats(self):
+        """ Counts of requests sent and bytes written, keyed by request method name """
+        with mlock:
+            return dict((name, dict(zip(('requests', 'bytes'), stat)))
+                        for name, stat in self.m_requestStats.items())
 
     def isConnected(self):
         """ generated source for method isConnected """
@@ -286,11 +330,13 @@ class EClientSocket(object):
     def eConnect_0(self, socket, clientId):
         """ generated source for method eConnect_0 """
         #  create io streams
-        self.m_dos = DataOutputStream(socket.getOutputStream())
+        self.m_dos = DataOutputStream(socket.getOutputStream(), self.m_requestStats)
         #  set client version
         self.send(self.CLIENT_VERSION)
+        self.m_dos.flush('eConnect')
         #  start reader thread
-        self.m_reader = self.createReader(self, DataInputStream(socket.getInputStream()))
+        record = self.captureFactory(clientId) if self.captureFactory is not None else None
+        self.m_reader = self.createReader(self, DataInputStream(socket.getInputStream(), record=record))
         #  check server version
         self.m_serverVersion = self.m_reader.readInt()
         print "Server Version: %d" % self.m_serverVersion
@@ -304,6 +350,7 @@ class EClientSocket(object):
         #  Send the client id
         if self.m_serverVersion >= 3:
             self.send(clientId)
+            self.m_dos.flush('eConnect')
         self.m_reader.start()
         #  set connected flag
         self.m_connected = True
@@ -336,6 +383,7 @@ class EClientSocket(object):
             pass
 
     @synchronized(mlock)
+    @flushed
     def cancelScannerSubscription(self, tickerId):
         """ generated source for method cancelScannerSubscription """
         #  not connected?
@@ -356,6 +404,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqScannerParameters(self):
         """ generated source for method reqScannerParameters """
         #  not connected?
@@ -374,6 +423,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqScannerSubscription(self, tickerId, subscription):
         """ generated source for method reqScannerSubscription """
         #  not connected?
@@ -416,6 +466,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqMktData(self, tickerId, contract, genericTickList, snapshot):
         """ generated source for method reqMktData """
         if not self.m_connected:
@@ -498,6 +549,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelHistoricalData(self, tickerId):
         """ generated source for method cancelHistoricalData """
         #  not connected?
@@ -517,6 +569,7 @@ class EClientSocket(object):
             self.error(tickerId, EClientErrors.FAIL_SEND_CANHISTDATA, str(e))
             self.close()
 
+    @flushed
     def cancelRealTimeBars(self, tickerId):
         """ generated source for method cancelRealTimeBars """
         #  not connected?
@@ -538,6 +591,7 @@ class EClientSocket(object):
 
     #  Note that formatData parameter affects intra-day bars only; 1-day bars always return with date in YYYYMMDD format. 
     @synchronized(mlock)
+    @flushed
     def reqHistoricalData(self, tickerId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, formatDate):
         """ generated source for method reqHistoricalData """
         #  not connected?
@@ -599,6 +653,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqRealTimeBars(self, tickerId, contract, barSize, whatToShow, useRTH):
         """ generated source for method reqRealTimeBars """
         #  not connected?
@@ -642,6 +697,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqContractDetails(self, reqId, contract):
         """ generated source for method reqContractDetails """
         #  not connected?
@@ -692,6 +748,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqMktDepth(self, tickerId, contract, numRows):
         """ generated source for method reqMktDepth """
         #  not connected?
@@ -734,6 +791,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelMktData(self, tickerId):
         """ generated source for method cancelMktData """
         #  not connected?
@@ -751,6 +809,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelMktDepth(self, tickerId):
         """ generated source for method cancelMktDepth """
         #  not connected?
@@ -772,6 +831,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def exerciseOptions(self, tickerId, contract, exerciseAction, exerciseQuantity, account, override):
         """ generated source for method exerciseOptions """
         #  not connected?
@@ -813,6 +873,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def placeOrder(self, id, contract, order):
         """ generated source for method placeOrder """
         #  not connected?
@@ -1156,6 +1217,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqAccountUpdates(self, subscribe, acctCode):
         """ generated source for method reqAccountUpdates """
         #  not connected?
@@ -1176,6 +1238,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqExecutions(self, reqId, filter):
         """ generated source for method reqExecutions """
         #  not connected?
@@ -1204,6 +1267,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelOrder(self, id):
         """ generated source for method cancelOrder """
         #  not connected?
@@ -1221,6 +1285,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqOpenOrders(self):
         """ generated source for method reqOpenOrders """
         #  not connected?
@@ -1237,6 +1302,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqIds(self, numIds):
         """ generated source for method reqIds """
         #  not connected?
@@ -1253,6 +1319,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqNewsBulletins(self, allMsgs):
         """ generated source for method reqNewsBulletins """
         #  not connected?
@@ -1269,6 +1336,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelNewsBulletins(self):
         """ generated source for method cancelNewsBulletins """
         #  not connected?
@@ -1285,6 +1353,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def setServerLogLevel(self, logLevel):
         """ generated source for method setServerLogLevel """
         #  not connected?
@@ -1302,6 +1371,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqAutoOpenOrders(self, bAutoBind):
         """ generated source for method reqAutoOpenOrders """
         #  not connected?
@@ -1319,6 +1389,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqAllOpenOrders(self):
         """ generated source for method reqAllOpenOrders """
         #  not connected?
@@ -1335,6 +1406,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqManagedAccts(self):
         """ generated source for method reqManagedAccts """
         #  not connected?
@@ -1351,6 +1423,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def requestFA(self, faDataType):
         """ generated source for method requestFA """
         #  not connected?
@@ -1371,6 +1444,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def replaceFA(self, faDataType, xml):
         """ generated source for method replaceFA """
         #  not connected?
@@ -1392,6 +1466,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqCurrentTime(self):
         """ generated source for method reqCurrentTime """
         #  not connected?
@@ -1411,6 +1486,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqFundamentalData(self, reqId, contract, reportType):
         """ generated source for method reqFundamentalData """
         # not connected?
@@ -1445,6 +1521,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelFundamentalData(self, reqId):
         """ generated source for method cancelFundamentalData """
         # not connected?
@@ -1465,6 +1542,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def calculateImpliedVolatility(self, reqId, contract, optionPrice, underPrice):
         """ generated source for method calculateImpliedVolatility """
         # not connected?
@@ -1505,6 +1583,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelCalculateImpliedVolatility(self, reqId):
         """ generated source for method cancelCalculateImpliedVolatility """
         #  not connected?
@@ -1525,6 +1604,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def calculateOptionPrice(self, reqId, contract, volatility, underPrice):
         """ generated source for method calculateOptionPrice """
         #  not connected?
@@ -1565,6 +1645,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def cancelCalculateOptionPrice(self, reqId):
         """ generated source for method cancelCalculateOptionPrice """
         # not connected?
@@ -1585,6 +1666,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqGlobalCancel(self):
         """ generated source for method reqGlobalCancel """
         #  not connected?
@@ -1604,6 +1686,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqMarketDataType(self, marketDataType):
         """ generated source for method reqMarketDataType """
         #  not connected?
@@ -1624,6 +1707,7 @@ class EClientSocket(object):
             self.close()
 
     @synchronized(mlock)
+    @flushed
     def reqPositions(self):
         """ generated source for method reqPositions """
         #  not connected?
@@ -1641,6 +1725,7 @@ class EClientSocket(object):
             self.error(EClientErrors.NO_VALID_ID, EClientErrors.FAIL_SEND_REQPOSITIONS, "" + e)
 
     @synchronized(mlock)
+    @flushed
     def cancelPositions(self):
         """ generated source for method cancelPositions """
         #  not connected?
@@ -1658,6 +1743,7 @@ class EClientSocket(object):
             self.error(EClientErrors.NO_VALID_ID, EClientErrors.FAIL_SEND_CANPOSITIONS, "" + e)
 
     @synchronized(mlock)
+    @flushed
     def reqAccountSummary(self, reqId, group, tags):
         """ generated source for method reqAccountSummary """
         #  not connected?
@@ -1678,6 +1764,7 @@ class EClientSocket(object):
             self.error(EClientErrors.NO_VALID_ID, EClientErrors.FAIL_SEND_REQACCOUNTDATA, "" + e)
 
     @synchronized(mlock)
+    @flushed
     def cancelAccountSummary(self, reqId):
         """ generated source for method cancelAccountSummary """
         #  not connected?
@@ -1695,18 +1782,17 @@ class EClientSocket(object):
         except Exception as e:
             self.error(EClientErrors.NO_VALID_ID, EClientErrors.FAIL_SEND_CANACCOUNTDATA, "" + e)
 
-    #  @deprecated, never called. 
-    @overloaded
     @synchronized(mlock)
-    def error(self, err):
-        """ generated source for method error """
-        self.m_anyWrapper.error(err)
+    def error(self, *args):
+        """ Reports an error to the wrapper.
 
-    @synchronized(mlock)
-    @error.register(object, int, int, str)
-    def error_0(self, id, errorCode, errorMsg):
-        """ generated source for method error_0 """
-        self.m_anyWrapper.error(id, errorCode, errorMsg)
+        Called as error(err), error(id, errorCode, errorMsg) or error(id, pair, tail) where pair is an
+        EClientErrors.CodeMsgPair whose message gets tail appended.
+        """
+        if len(args) == 3 and isinstance(args[1], EClientErrors.CodeMsgPair):
+            id, pair, tail = args
+            args = (id, pair.code(), pair.msg() + tail)
+        self.m_anyWrapper.error(*args)
 
     def close(self):
         """ generated source for method close """
@@ -1725,66 +1811,57 @@ class EClientSocket(object):
         #  return true if the string is null or empty
         return not cls.is_(strval)
 
-    @error.register(object, int, EClientErrors.CodeMsgPair, str)
-    def error_1(self, id, pair, tail):
-        """ generated source for method error_1 """
-        self.error(id, pair.code(), pair.msg() + tail)
+    #  field encoders keyed by value type; types without an entry are resolved through their base classes
+    #  by encoderFor() and cached here
+    encoders = {
+        str: lambda val: val,
+        int: str,
+        long: str,
+        float: str,
+        bool: lambda val: '1' if val else '0',
+        type(None): lambda val: '',
+    }
 
-    @overloaded
-    def send(self, strval):
-        """ generated source for method send """
-        #  write string to data buffer; writer thread will
-        #  write it to socket
-        if not self.IsEmpty(strval):
-            self.m_dos.write(strval)
-        self.sendEOL()
+    @classmethod
+    def encoderFor(cls, valueType):
+        """ Finds (and caches) the field encoder for a value type.
+
+        @param valueType type of a value passed to send()
+        @return callable turning a value into the string to write
+        """
+        for base in valueType.__mro__:
+            if base in cls.encoders:
+                encoder = cls.encoders[base]
+                break
+        else:
+            #  anything else (ie unicode) is written as is unless empty
+            encoder = lambda val: '' if cls.IsEmpty(val) else val
+        cls.encoders[valueType] = encoder
+        return encoder
+
+    def send(self, val):
+        """ Writes a field to the data buffer, encoded according to its type, followed by EOL.  The buffer is
+        written to the socket when the request method returns.
+        """
+        try:
+            encoder = self.encoders[type(val)]
+        except KeyError:
+            encoder = self.encoderFor(type(val))
+        write = self.m_dos.write
+        write(encoder(val))
+        write(self.EOL)
 
     def sendEOL(self):
         """ generated source for method sendEOL """
         self.m_dos.write(self.EOL)
 
-    @send.register(object, int)
-    def send_0(self, val):
-        """ generated source for method send_0 """
-        self.send(str(val))
-
-    @send.register(object, str)
-    def send_1(self, val):
-        """ generated source for method send_1 """
-        self.m_dos.write(val)
-        self.sendEOL()
-
-    @send.register(object, float)
-    def send_2(self, val):
-        """ generated source for method send_2 """
-        self.send(str(val))
-
-    @send.register(object, long)
-    def send_3(self, val):
-        """ generated source for method send_3 """
-        self.send(str(val))
-
-    @overloaded
     def sendMax(self, val):
-        """ generated source for method sendMax """
+        """ Sends val, or an empty field if val is the Integer/Double MAX_VALUE sentinel """
         if val == Double.MAX_VALUE:
             self.sendEOL()
         else:
             self.send(str(val))
 
-    @sendMax.register(object, int)
-    def sendMax_0(self, val):
-        """ generated source for method sendMax_0 """
-        if val == Integer.MAX_VALUE:
-            self.sendEOL()
-        else:
-            self.send(str(val))
-
-    @send.register(object, bool)
-    def send_4(self, val):
-        """ generated source for method send_4 """
-        self.send(1 if val else 0)
-
     @classmethod
     def IsEmpty(cls, strval):
         """ generated source for method IsEmpty """
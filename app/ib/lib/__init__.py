@@ -108,48 +108,126 @@ class Cloneable(object):
 class DataInputStream(object):
     """ Partial implementation of the Java DataInputStream type.
 
+    Reads are buffered: the contained stream is drained in chunks of
+    up to bufferSize bytes, and NUL-terminated fields are split out of
+    that buffer with a single search instead of one recv() per byte.
     """
-    def __init__(self, stream):
+    bufferSize = 65536
+
+    def __init__(self, stream, bufferSize=None, record=None):
         """ Constructor.
 
         @param stream any object with recv method
+        @param bufferSize=None maximum number of bytes to request per recv
+        @param record=None callable given each chunk read, ie to capture
+               the stream
         """
         self.stream = stream
         self.recv = stream.recv
+        if bufferSize is not None:
+            self.bufferSize = bufferSize
+        self.record = record
+        self.buf = b''
+        self.pos = 0
+
+    def fill(self):
+        """ Reads the next chunk from the contained stream into the buffer.
+
+        Bytes already consumed are dropped from the buffer first.
+
+        @return None; raises EOFError if the stream has been closed
+        """
+        chunk = self.recv(self.bufferSize)
+        if not chunk:
+            raise EOFError('Stream closed by peer')
+        if self.record is not None:
+            self.record(chunk)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
 
     def readByte(self, unpack=struct.unpack):
         """ Reads a byte from the contained stream.
 
         @return string read from stream
         """
-        return unpack('!b', self.recv(1))[0]
+        if self.pos >= len(self.buf):
+            self.fill()
+        pos = self.pos
+        self.pos = pos + 1
+        return unpack('!b', self.buf[pos:pos + 1])[0]
+
+    def readString(self, eol=b'\0'):
+        """ Reads a NUL-terminated field from the contained stream.
+
+        @return field contents as string, without the terminator
+        """
+        end = self.buf.find(eol, self.pos)
+        while end < 0:
+            # Only search the newly arrived bytes for the terminator
+            start = len(self.buf) - self.pos
+            self.fill()
+            end = self.buf.find(eol, start)
+        strval = self.buf[self.pos:end]
+        self.pos = end + 1
+        if sys.version_info[0] > 2:
+            strval = strval.decode('utf-8')
+        return strval
 
 
 class DataOutputStream(object):
     """ Partial implementation of the Java DataOutputStream type
 
+    Writes are buffered.  Nothing reaches the contained stream until
+    flush(), which sends everything written so far with one sendall().
     """
-    def __init__(self, stream):
+    def __init__(self, stream, stats=None):
         """ Constructor.
 
-        @param stream any object with send method
+        @param stream any object with sendall method
+        @param stats=None mapping updated on each flush with
+               [flushes, bytes] keyed by flush name
         """
-        self.send = stream.send
+        self.sendall = stream.sendall
+        self.stats = stats if stats is not None else {}
+        self.buf = []
 
-    def write(self, data, pack=struct.pack, eol=struct.pack('!b', 0)):
-        """ Writes data to the contained stream.
+    def write(self, data, eol=struct.pack('!b', 0)):
+        """ Writes data to the buffer.
 
         @param data string to send, or 0
         @return None
         """
-        send = self.send
         if data == 0:
-            send(eol)
+            self.buf.append(eol)
         else:
-            for char in data:
-                if sys.version_info[0] > 2:
-                    char = char.encode('utf-8')
-                send(pack('!c', char))
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            self.buf.append(data)
+
+    def flush(self, name=None):
+        """ Sends the buffered data to the contained stream.
+
+        @param name=None key to count this flush under in stats
+        @return number of bytes sent
+        """
+        if not self.buf:
+            return 0
+        data = b''.join(self.buf)
+        del self.buf[:]
+        self.sendall(data)
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0]
+        stat[0] += 1
+        stat[1] += len(data)
+        return len(data)
+
+    def discard(self):
+        """ Drops the buffered data without sending it.
+
+        @return None
+        """
+        del self.buf[:]
 
 
 class Double(float):
@@ -5,6 +5,7 @@
 # Defines Dispatcher class to send messages to registered listeners.
 #
 ##
+import time
 from Queue import Queue, Empty
 
 from ib.lib import maybeName, logger
@@ -15,6 +16,10 @@ class Dispatcher(object):
     """
 
     """
+    # optional callable given each message's name and the seconds its listeners took (ie for metrics).  Set a
+    # staticmethod or a partial, so it isn't bound.
+    observer = None
+
     def __init__(self, listeners=None, messageTypes=None):
         """ Initializer.
 
@@ -33,11 +38,15 @@ class Dispatcher(object):
         @return None
         """
         results = []
+        observer = self.observer
         try:
             messageType = self.messageTypes[name]
             listeners = self.listeners[maybeName(messageType[0])]
         except (KeyError, ):
+            if observer is not None:
+                observer(name, 0.0)
             return results
+        start = time.time() if observer is not None else 0
         message = messageType[0](**args)
         for listener in listeners:
             try:
@@ -47,6 +56,8 @@ class Dispatcher(object):
                           "Handler '%s' for '%s'")
                 self.logger.exception(errmsg, maybeName(listener), name)
                 results.append(None)
+        if observer is not None:
+            observer(name, time.time() - start)
         return results
 
     def enableLogging(self, enable=True):
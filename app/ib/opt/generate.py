@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# Generates the ib.opt.signatures module.
+#
+# This module inspects the source of the AnyWrapper, EWrapper and
+# EClientSocket classes to find the method signatures that the
+# ib.opt.message types are built from, and writes them out as a plain
+# Python module.  Loading that module at import time is much cheaper
+# than parsing the sources, and works when only compiled files are
+# shipped.
+#
+# Rebuild after changing any of those classes:
+#
+#    {{{
+#    cd app
+#    python -m ib.opt.generate
+#    }}}
+#
+# Pass --check to only report whether the checked in module is current.
+##
+
+import os
+import sys
+from ast import NodeVisitor, parse
+from inspect import getsourcefile
+from re import match
+
+from ib.ext.AnyWrapper import AnyWrapper
+from ib.ext.EWrapper import EWrapper
+from ib.ext.EClientSocket import EClientSocket
+
+
+class SignatureAccumulator(NodeVisitor):
+    """
+
+    """
+    def __init__(self, classes):
+        NodeVisitor.__init__(self)
+        self.signatures = []
+        for filename in (getsourcefile(cls) for cls in classes):
+            self.visit(parse(open(filename).read()))
+
+    def visit_FunctionDef(self, node):
+        if sys.version_info[0] < 3:
+            args = [arg.id for arg in node.args.args]
+        else:
+            args = [arg.arg for arg in node.args.args]
+        self.signatures.append((node.name, args[1:]))
+
+
+class EClientSocketAccumulator(SignatureAccumulator):
+    def getSignatures(self):
+        for name, args in self.signatures:
+            if match('(?i)req|cancel|place', name):
+                yield (name, args)
+
+
+class EWrapperAccumulator(SignatureAccumulator):
+    def getSignatures(self):
+        for name, args in self.signatures:
+            if match('(?!((?i)error.*))', name):
+                yield (name, args)
+
+
+##
+# Header written at the top of the generated module.
+header = '''#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# Method signatures used to build the ib.opt.message types.
+#
+# GENERATED by ib.opt.generate from the AnyWrapper, EWrapper and
+# EClientSocket sources.  Do not edit; rebuild with:
+#
+#    python -m ib.opt.generate
+##'''
+
+
+def render():
+    """ Builds the source of the signatures module.
+
+    @return module source as a string
+    """
+    wrapperMethods = list(EWrapperAccumulator((AnyWrapper, EWrapper)).getSignatures())
+    clientSocketMethods = list(EClientSocketAccumulator((EClientSocket, )).getSignatures())
+    lines = [header]
+    for name, signatures in (('wrapperMethods', wrapperMethods), ('clientSocketMethods', clientSocketMethods)):
+        lines.append('')
+        lines.append('%s = [' % name)
+        lines.extend('    %r,' % (signature, ) for signature in signatures)
+        lines.append(']')
+    return str.join('\n', lines) + '\n'
+
+
+def main(argv=None):
+    """ Writes (or with --check, verifies) the signatures module.
+
+    @param argv command line arguments; defaults to sys.argv[1:]
+    @return process exit status
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    target = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signatures.py')
+    source = render()
+    if '--check' in argv:
+        current = open(target).read() if os.path.exists(target) else None
+        if current != source:
+            sys.stderr.write('%s is out of date; run python -m ib.opt.generate\n' % target)
+            return 1
+        return 0
+    with open(target, 'w') as output:
+        output.write(source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
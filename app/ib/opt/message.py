@@ -4,52 +4,17 @@
 ##
 # Defines message types for the Receiver class.
 #
-# This module inspects the EWrapper class to build a set of Message
-# types.  In creating the types, it also builds a registry of them
-# that the Receiver class then uses to determine message types.
+# This module builds a set of Message types from the EWrapper and
+# EClientSocket method signatures.  In creating the types, it also
+# builds a registry of them that the Receiver class then uses to
+# determine message types.
+#
+# The signatures are read from the ib.opt.signatures module, which is
+# generated from the class sources by ib.opt.generate.
 ##
 
-import sys
-from ast import NodeVisitor, parse
-from inspect import getsourcefile
-from re import match
-
-from ib.ext.AnyWrapper import AnyWrapper
-from ib.ext.EWrapper import EWrapper
-from ib.ext.EClientSocket import  EClientSocket
 from ib.lib import toTypeName
-
-
-class SignatureAccumulator(NodeVisitor):
-    """
-
-    """
-    def __init__(self, classes):
-        NodeVisitor.__init__(self)
-        self.signatures = []
-        for filename in (getsourcefile(cls) for cls in classes):
-            self.visit(parse(open(filename).read()))
-
-    def visit_FunctionDef(self, node):
-        if sys.version_info[0] < 3:
-            args = [arg.id for arg in node.args.args]
-        else:
-            args = [arg.arg for arg in node.args.args]
-        self.signatures.append((node.name, args[1:]))
-
-
-class EClientSocketAccumulator(SignatureAccumulator):
-    def getSignatures(self):
-        for name, args in self.signatures:
-            if match('(?i)req|cancel|place', name):
-                yield (name, args)
-
-
-class EWrapperAccumulator(SignatureAccumulator):
-    def getSignatures(self):
-        for name, args in self.signatures:
-            if match('(?!((?i)error.*))', name):
-                yield (name, args)
+from ib.opt.signatures import wrapperMethods, clientSocketMethods
 
 
 ##
@@ -150,11 +115,6 @@ def buildMessageRegistry(seq, suffixes=[''], bases=(Message, )):
 
 
 
-eWrapperAccum = EWrapperAccumulator((AnyWrapper, EWrapper))
-eClientAccum = EClientSocketAccumulator((EClientSocket, ))
-
-wrapperMethods = list(eWrapperAccum.getSignatures())
-clientSocketMethods = list(eClientAccum.getSignatures())
 errorMethods = [('error', Error.__slots__), ]
 
 buildMessageRegistry(wrapperMethods)
@@ -174,9 +134,3 @@ except (NameError, ):
 else:
     del(initModule)
 
-
-del(AnyWrapper)
-del(EWrapper)
-del(EClientSocket)
-del(eWrapperAccum)
-del(eClientAccum)
@@ -11,7 +11,6 @@
 # ib.opt.message module more information.
 #
 ##
-from ib.lib.overloading import overloaded
 from ib.opt.message import wrapperMethods
 
 
@@ -62,36 +61,19 @@ class Receiver(object):
         """
         self.dispatcher = dispatcher
 
-    @overloaded
-    def error(self, e):
+    def error(self, *args):
         """ Dispatch an error generated by the reader.
 
         Error message types can't be associated in the default manner
-        with this family of methods, so we define these three here
-        by hand.
+        with this family of methods, so we define them here by hand.
+        Called as error(e) with some error value or string, or as
+        error(id, errorCode, errorMsg).
 
-        @param e some error value
         @return None
         """
-        self.dispatcher('error', dict(errorMsg=e))
-
-    @error.register(object, str)
-    def error_0(self, strval):
-        """ Dispatch an error given a string value.
-
-        @param strval some error value as string
-        @return None
-        """
-        self.dispatcher('error', dict(errorMsg=strval))
-
-    @error.register(object, int, int, str)
-    def error_1(self, id, errorCode, errorMsg):
-        """ Dispatch an error given an id, code and message.
-
-        @param id error id
-        @param errorCode error code
-        @param errorMsg error message
-        @return None
-        """
-        params = dict(id=id, errorCode=errorCode, errorMsg=errorMsg)
+        if len(args) == 3:
+            id, errorCode, errorMsg = args
+            params = dict(id=id, errorCode=errorCode, errorMsg=errorMsg)
+        else:
+            params = dict(errorMsg=args[0])
         self.dispatcher('error', params)
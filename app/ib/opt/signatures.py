@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# Method signatures used to build the ib.opt.message types.
+#
+# GENERATED by ib.opt.generate from the AnyWrapper, EWrapper and
+# EClientSocket sources.  Do not edit; rebuild with:
+#
+#    python -m ib.opt.generate
+##
+
+wrapperMethods = [
+    ('connectionClosed', []),
+    ('tickPrice', ['tickerId', 'field', 'price', 'canAutoExecute']),
+    ('tickSize', ['tickerId', 'field', 'size']),
+    ('tickOptionComputation', ['tickerId', 'field', 'impliedVol', 'delta', 'optPrice', 'pvDividend', 'gamma', 'vega', 'theta', 'undPrice']),
+    ('tickGeneric', ['tickerId', 'tickType', 'value']),
+    ('tickString', ['tickerId', 'tickType', 'value']),
+    ('tickEFP', ['tickerId', 'tickType', 'basisPoints', 'formattedBasisPoints', 'impliedFuture', 'holdDays', 'futureExpiry', 'dividendImpact', 'dividendsToExpiry']),
+    ('orderStatus', ['orderId', 'status', 'filled', 'remaining', 'avgFillPrice', 'permId', 'parentId', 'lastFillPrice', 'clientId', 'whyHeld']),
+    ('openOrder', ['orderId', 'contract', 'order', 'orderState']),
+    ('openOrderEnd', []),
+    ('updateAccountValue', ['key', 'value', 'currency', 'accountName']),
+    ('updatePortfolio', ['contract', 'position', 'marketPrice', 'marketValue', 'averageCost', 'unrealizedPNL', 'realizedPNL', 'accountName']),
+    ('updateAccountTime', ['timeStamp']),
+    ('accountDownloadEnd', ['accountName']),
+    ('nextValidId', ['orderId']),
+    ('contractDetails', ['reqId', 'contractDetails']),
+    ('bondContractDetails', ['reqId', 'contractDetails']),
+    ('contractDetailsEnd', ['reqId']),
+    ('execDetails', ['reqId', 'contract', 'execution']),
+    ('execDetailsEnd', ['reqId']),
+    ('updateMktDepth', ['tickerId', 'position', 'operation', 'side', 'price', 'size']),
+    ('updateMktDepthL2', ['tickerId', 'position', 'marketMaker', 'operation', 'side', 'price', 'size']),
+    ('updateNewsBulletin', ['msgId', 'msgType', 'message', 'origExchange']),
+    ('managedAccounts', ['accountsList']),
+    ('receiveFA', ['faDataType', 'xml']),
+    ('historicalData', ['reqId', 'date', 'open', 'high', 'low', 'close', 'volume', 'count', 'WAP', 'hasGaps']),
+    ('scannerParameters', ['xml']),
+    ('scannerData', ['reqId', 'rank', 'contractDetails', 'distance', 'benchmark', 'projection', 'legsStr']),
+    ('scannerDataEnd', ['reqId']),
+    ('realtimeBar', ['reqId', 'time', 'open', 'high', 'low', 'close', 'volume', 'wap', 'count']),
+    ('currentTime', ['time']),
+    ('fundamentalData', ['reqId', 'data']),
+    ('deltaNeutralValidation', ['reqId', 'underComp']),
+    ('tickSnapshotEnd', ['reqId']),
+    ('marketDataType', ['reqId', 'marketDataType']),
+    ('commissionReport', ['commissionReport']),
+    ('position', ['account', 'contract', 'pos', 'avgCost']),
+    ('positionEnd', []),
+    ('accountSummary', ['reqId', 'account', 'tag', 'value', 'currency']),
+    ('accountSummaryEnd', ['reqId']),
+]
+
+clientSocketMethods = [
+    ('cancelScannerSubscription', ['tickerId']),
+    ('reqScannerParameters', []),
+    ('reqScannerSubscription', ['tickerId', 'subscription']),
+    ('reqMktData', ['tickerId', 'contract', 'genericTickList', 'snapshot']),
+    ('cancelHistoricalData', ['tickerId']),
+    ('cancelRealTimeBars', ['tickerId']),
+    ('reqHistoricalData', ['tickerId', 'contract', 'endDateTime', 'durationStr', 'barSizeSetting', 'whatToShow', 'useRTH', 'formatDate']),
+    ('reqRealTimeBars', ['tickerId', 'contract', 'barSize', 'whatToShow', 'useRTH']),
+    ('reqContractDetails', ['reqId', 'contract']),
+    ('reqMktDepth', ['tickerId', 'contract', 'numRows']),
+    ('cancelMktData', ['tickerId']),
+    ('cancelMktDepth', ['tickerId']),
+    ('placeOrder', ['id', 'contract', 'order']),
+    ('reqAccountUpdates', ['subscribe', 'acctCode']),
+    ('reqExecutions', ['reqId', 'filter']),
+    ('cancelOrder', ['id']),
+    ('reqOpenOrders', []),
+    ('reqIds', ['numIds']),
+    ('reqNewsBulletins', ['allMsgs']),
+    ('cancelNewsBulletins', []),
+    ('reqAutoOpenOrders', ['bAutoBind']),
+    ('reqAllOpenOrders', []),
+    ('reqManagedAccts', []),
+    ('requestFA', ['faDataType']),
+    ('reqCurrentTime', []),
+    ('reqFundamentalData', ['reqId', 'contract', 'reportType']),
+    ('cancelFundamentalData', ['reqId']),
+    ('cancelCalculateImpliedVolatility', ['reqId']),
+    ('cancelCalculateOptionPrice', ['reqId']),
+    ('reqGlobalCancel', []),
+    ('reqMarketDataType', ['marketDataType']),
+    ('reqPositions', []),
+    ('cancelPositions', []),
+    ('reqAccountSummary', ['reqId', 'group', 'tags']),
+    ('cancelAccountSummary', ['reqId']),
+]
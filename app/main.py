@@ -13,25 +13,38 @@ https://www.interactivebrokers.com/en/software/api/apiguide/java/java_ewrapper_m
 import logging
 
 log_format = '%(asctime)s %(levelname)-5.5s [%(name)s-%(funcName)s:%(lineno)d][%(threadName)s] %(message)s'
-logging.basicConfig(format=log_format, level=logging.DEBUG)
+logging.basicConfig(format=log_format)
+import globals as g
+import utils
+utils.setup_logging()
 # Flask imports
-from flask import Flask, request
+from flask import Flask, request, Response
 from flask_restful import Resource, Api, reqparse, abort
 # IBREST imports
 import sync, feeds
+import accounts
 import parsers
-import globals as g
-import utils
 import json
 import time
 import os
 import connection
+import bars
+import capture
+import metrics
+import pacing
+import zlib
 # Beacon imports
 import requests
 from datetime import datetime
 from functools import wraps
 from ib.opt import ibConnection
+# Optional response formats
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 # database setup
+import database
 from database import init_db, FilledOrders, Commissions
 init_db()
 
@@ -44,6 +57,62 @@ api = Api(app)
 log = logging.getLogger(__name__)
 
 
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    # Ends each request's transaction, so the next sees what our writer has committed since
+    database.db_session.remove()
+
+
+@app.before_request
+def start_timer():
+    request.environ['ibrest.started'] = time.time()
+
+
+@app.after_request
+def observe_request(response):
+    """ Times each request for /metrics.  Registered before compress(), so it runs after it and counts its time. """
+    started = request.environ.get('ibrest.started')
+    if started is not None:
+        metrics.REST.observe(time.time() - started, (request.endpoint or '', request.method,
+                                                     str(response.status_code)))
+    return response
+
+
+# ---------------------------------------------------------------------
+# RESPONSE FORMATS
+# ---------------------------------------------------------------------
+if msgpack is not None:
+    @api.representation('application/msgpack')
+    @api.representation('application/x-msgpack')
+    def output_msgpack(data, code, headers=None):
+        """ Returns any endpoint's response as MessagePack when the Accept header prefers it to JSON """
+        return Response(msgpack.packb(data), status=code, headers=headers, mimetype='application/msgpack')
+
+
+@app.after_request
+def compress(response):
+    """ Compresses a response with gzip or deflate when the Accept-Encoding header allows.  Streamed responses are
+    sent as is, since compressing them would hold back each chunk.
+    """
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    if msgpack is not None:
+        # Any endpoint may answer in MessagePack for the Accept header
+        response.vary.add('Accept')
+    if 'Content-Encoding' in response.headers or (response.content_length or 0) < g.compress_min_size:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+    if encoding is None:
+        return response
+    # wbits of 16 + MAX_WBITS writes a gzip header and trailer, where zlib.compress() writes a zlib one for deflate
+    compressor = zlib.compressobj(g.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS if encoding == 'gzip' else
+                                  zlib.MAX_WBITS)
+    response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
 # ---------------------------------------------------------------------
 # Authentication
 # ---------------------------------------------------------------------
@@ -72,7 +141,7 @@ def authenticate(func):
         if ibrest_info['token'] in [g.beacon_current_token, g.beacon_last_token]:
             authorized = True
 
-        log.debug('Authorized = {}'.format(authorized))
+        log.debug('Authorized = %s', authorized)
         if authorized:
             return func(*args, **kwargs)
 
@@ -117,7 +186,7 @@ def send_flare_to_gae():
     # ...and deliver it:
     put_resp = requests.put('https://orion-minute.appspot.com/beacon', data={'flare': flare}).text
     resp['put_resp'] = put_resp
-    log.debug('Beacon: {}'.format(resp))
+    log.debug('Beacon: %s', resp)
 
     return resp
 
@@ -125,6 +194,25 @@ def send_flare_to_gae():
 # ---------------------------------------------------------------------
 # RESOURCES
 # ---------------------------------------------------------------------
+# Columnar encodings of bars.Bars for /history's `format` arg (or Accept header), and their mimetypes
+HISTORY_FORMATS = dict(json=(bars.to_json, 'application/json'), csv=(bars.to_csv, 'text/csv'),
+                       binary=(bars.to_binary, 'application/octet-stream'))
+if bars.msgpack is not None:
+    HISTORY_FORMATS['msgpack'] = (bars.to_msgpack, 'application/msgpack')
+if bars.pyarrow is not None:
+    HISTORY_FORMATS['arrow'] = (bars.to_arrow, 'application/vnd.apache.arrow.stream')
+
+
+def history_format():
+    """ Returns the name of the columnar format the Accept header prefers over JSON keyed by date, if any """
+    offered = ['application/json'] + sorted(mimetype for encode, mimetype in HISTORY_FORMATS.values()
+                                            if mimetype != 'application/json')
+    accepted = request.accept_mimetypes.best_match(offered)
+    if accepted == 'application/json':
+        return None
+    return next((name for name, (encode, mimetype) in HISTORY_FORMATS.items() if mimetype == accepted), None)
+
+
 class History(Resource):
     """ Resource to handle requests for historical data (15min delayed)
     """
@@ -133,9 +221,44 @@ class History(Resource):
 
     def get(self, symbol):
         """ Uses reqHistoricalData() to start a stream of historical data, then upon getting data in that streatm,
-        cancels the stream with cancelHistoricalData() before returning the history
+        cancels the stream with cancelHistoricalData() before returning the history.  Bars are keyed by date, unless
+        a `format` arg (or the Accept header) asks for them by column as json, csv, binary, msgpack or arrow.
         """
-        return utils.make_response(feeds.get_history(symbol, request.args))
+        fmt = request.args.get('format') or history_format()
+        if fmt is not None and fmt not in HISTORY_FORMATS:
+            abort(400, message='format must be one of {}'.format(', '.join(sorted(HISTORY_FORMATS))))
+        if fmt is None:
+            resp, waited = feeds.get_history(symbol, request.args)
+        else:
+            resp, waited = feeds.get_history_bars(symbol, request.args)
+        # How long this request was queued to keep within IB's pacing rules, and how long the next would be
+        headers = {'X-Pacing-Wait': '{:.1f}'.format(waited), 'X-Pacing-Estimate': '{:.1f}'.format(pacing.estimate()),
+                   'Vary': 'Accept'}
+        if isinstance(resp, dict):
+            if 'retryAfter' in resp:
+                headers['Retry-After'] = str(resp['retryAfter'])
+            return utils.make_response(resp, headers)
+        encode, mimetype = HISTORY_FORMATS[fmt]
+        return Response(encode(resp), mimetype=mimetype, headers=headers)
+
+
+class HistoryStream(Resource):
+    """ Resource to stream historical data as newline delimited JSON
+    """
+
+    method_decorators = [authenticate]
+
+    def get(self, symbol):
+        """ Streams the same bars as History, one JSON object per line in time order, starting as soon as the earliest
+        are in.  Long requests are fetched from TWS in chunks.
+        """
+        stream = feeds.stream_history(symbol, request.args)
+        headers = {'X-Pacing-Estimate': '{:.1f}'.format(pacing.estimate())}
+        if isinstance(stream, dict):
+            if 'retryAfter' in stream:
+                headers['Retry-After'] = str(stream['retryAfter'])
+            return utils.make_response(stream, headers)
+        return Response(stream, mimetype='application/x-ndjson', headers=headers)
 
 
 class Market(Resource):
@@ -152,15 +275,41 @@ class Market(Resource):
         return utils.make_response(feeds.get_market_data(symbol, request.args))
 
 
+class MarketStream(Resource):
+    """ Resource to stream live market data as Server-Sent Events
+    """
+
+    method_decorators = [authenticate]
+
+    def get(self, symbol):
+        """ Streams tickPrice and tickSize messages as they arrive.  Any number of clients may stream the same
+        contract; they share one reqMktData subscription, cancelled when the last one disconnects.
+        """
+        stream = feeds.stream_market_data(symbol, request.args)
+        if isinstance(stream, dict):
+            return utils.make_response(stream)
+        events, close = stream
+        resp = Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+        resp.call_on_close(close)
+        return resp
+
+
 class Order(Resource):
     """ Resource to handle requests for Order
     """
     method_decorators = [authenticate]
 
     def get(self):
-        """ Retrieves details of open orders using reqAllOpenOrders()
+        """ Retrieves details of open orders from our order book, which TWS keeps up to date.  Filter by `status`,
+        `symbol`, `orderId` or `permId`; only `status` or an id returns orders no longer working, ie Filled.
         """
-        return utils.make_response(sync.get_open_orders())
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('status', type=str, trim=True, help='Order status to filter, ie Submitted or Filled')
+        parser.add_argument('symbol', type=str, trim=True, help='Symbol to filter')
+        parser.add_argument('orderId', type=int, help='Order ID to filter')
+        parser.add_argument('permId', type=int, help='Permanent order ID to filter')
+        args = parser.parse_args()
+        return utils.make_response(accounts.get_orders(**args))
 
     def post(self):
         """ Places an order with placeOrder().  This requires enough args to create a Contract & an Order:
@@ -180,7 +329,7 @@ class Order(Resource):
         all_args = request.json
         all_args = json.dumps(all_args)
         all_args = json.loads(all_args, object_hook=utils.json_object_hook)
-        log.debug('all_args: {}'.format(all_args))
+        log.debug('all_args: %s', all_args)
         # If there was no JSON object, then use query string params
         if all_args is None:
             parser = parsers.order_parser.copy()
@@ -210,24 +359,12 @@ class OrderFilled(Resource):
     """
     method_decorators = [authenticate]
 
-
     def get(self):
-        """ Retrieves details of filled orders using stored data in SQLite DB
+        """ Retrieves details of filled orders using stored data in SQLite DB, newest first.  Filter by orderId, permId,
+        symbol, account, side or a time from `start` up to `end`, and page with `limit` and `offset`.
         """
-        parser = reqparse.RequestParser(bundle_errors=True)
-        parser.add_argument('orderId', type=int, required=False,
-                            help='Order ID to get ExecutionReport for')
-        args = parser.parse_args()
-        orderId = args.get('orderId')
-
-        if orderId is None:
-            # Get all filled orders available
-            resp = FilledOrders.query.all()
-        else:
-            resp = FilledOrders.query.filter(FilledOrders.order_id == orderId).first()
-        resp = [r.order_status for r in resp]
-        return utils.make_response(resp)
-
+        args = parsers.fills_parser.parse_args()
+        return filled_page(FilledOrders, lambda row: row.order_status, args)
 
 
 class OrderOCA(Resource):
@@ -256,10 +393,10 @@ class PortfolioPositions(Resource):
     method_decorators = [authenticate]
 
     def get(self):
+        """ Positions of every account, from the reqPositions subscription we keep
+        :return: JSON dict with a `positions` list, and `updated`/`synced` times
         """
-        :return: JSON dict of dicts, with main keys being tickPrice, tickSize and optionComputation.
-        """
-        return utils.make_response(sync.get_portfolio_positions())
+        return utils.make_response(accounts.get_positions())
 
 
 class AccountSummary(Resource):
@@ -274,13 +411,7 @@ class AccountSummary(Resource):
         which the API will then put together in a CSV list as needed by IbPy
         :return: JSON dict of dicts
         """
-        choices = {"AccountType", "NetLiquidation", "TotalCashValue", "SettledCash", "AccruedCash", "BuyingPower",
-                   "EquityWithLoanValue", "PreviousDayEquityWithLoanValue", "GrossPositionValue", "RegTEquity",
-                   "RegTMargin", "SMA", "InitMarginReq", "MaintMarginReq", "AvailableFunds", "ExcessLiquidity",
-                   "Cushion", "FullInitMarginReq", "FullMaintMarginReq", "FullAvailableFunds", "FullExcessLiquidity",
-                   "LookAheadNextChange", "LookAheadInitMarginReq", "LookAheadMaintMarginReq",
-                   "LookAheadAvailableFunds", "LookAheadExcessLiquidity", "HighestSeverity", "DayTradesRemaining",
-                   "Leverage"}
+        choices = accounts.SUMMARY_TAGS
         parser = reqparse.RequestParser(bundle_errors=True)
         parser.add_argument('tags', type=str, help='CSV list of tags from this set: {}'.format(choices), trim=True)
         parser.add_argument('tag', type=str, action='append', help='Account information you want to see: {error_msg}',
@@ -299,10 +430,7 @@ class AccountSummary(Resource):
         tags = set(tags)
         if not tags.issubset(choices):
             return dict(message=dict(tags='All tags must be from this set: {}'.format(choices))), 400
-        # re-create CSV list
-        tags = ','.join(list(tags))
-        # debug('TAGS: {}'.format(tags))
-        return utils.make_response(sync.get_account_summary(tags))
+        return utils.make_response(accounts.get_summary(tags))
 
 
 class AccountUpdate(Resource):
@@ -312,14 +440,14 @@ class AccountUpdate(Resource):
 
     def get(self):
         """
-        This endpoint does _not_ subscribe to account info (hence "Update" instead of "Updates" - use feed for that),
-        but only gets latest info for given acctCode.
-        :return: JSON dict of dicts
+        Gets latest info for given acctCode from the reqAccountUpdates subscription we keep, which moves to this
+        acctCode if it was for another.
+        :return: JSON dict of dicts, with `updated`/`synced` times
         """
         parser = reqparse.RequestParser()
         parser.add_argument('acctCode', type=str, help='Account number/code', trim=True, required=True)
         args = parser.parse_args()
-        return utils.make_response(sync.get_account_update(args['acctCode']))
+        return utils.make_response(accounts.get_updates(args['acctCode']))
 
 class Executions(Resource):
     """ Resource to handle requests for recent executions.
@@ -348,25 +476,37 @@ class ExecutionCommissions(Resource):
     """
     method_decorators = [authenticate]
 
-    def get(self, execId=None):
-        """ Retrieves details of filled orders using stored data in SQLite DB
+    def get(self):
+        """ Retrieves executions with their CommissionReport using stored data in SQLite DB, newest first.  Filters
+        and pages like OrderFilled, and by execId too.  Executions whose execDetails or CommissionReport hasn't come
+        yet are left out.
         """
-        parser = reqparse.RequestParser(bundle_errors=True)
-        parser.add_argument('execId', type=int, required=False,
-                            help='Execution ID to get CommissionReport for')
+        parser = parsers.fills_parser.copy()
+        parser.add_argument('execId', type=str, trim=True, help='Execution ID to get CommissionReport for')
         args = parser.parse_args()
-        execId = args.get('execId')
+        return filled_page(Commissions, execution_commission, args, required=('execution', 'commission_report'),
+                           exec_id=args['execId'])
 
-        if execId is None:
-            # Get all filled orders available
-            resp = Commissions.query.all()
-        else:
-            resp = Commissions.query.filter(Commissions.exec_id == execId).first()
-        resp = [r.commission_report for r in resp]
-        return utils.make_response(resp)
 
+def execution_commission(row):
+    """ Returns the execution, contract and commissionReport saved in a Commissions row as one dict """
+    resp = json.loads(row.execution)
+    resp.update(json.loads(row.commission_report))
+    return resp
 
 
+def filled_page(model, render, args, **filters):
+    """ Returns `render(row)` of each `model` row matching `args`, with an X-Next-Offset header when there are more
+    """
+    rows = database.find(model, start=args['start'], end=args['end'], limit=args['limit'] + 1, offset=args['offset'],
+                         order_id=args['orderId'], perm_id=args['permId'], symbol=args['symbol'],
+                         account=args['account'], side=args['side'], **filters)
+    headers = dict()
+    if len(rows) > args['limit']:
+        rows = rows[:-1]
+        headers['X-Next-Offset'] = str(args['offset'] + args['limit'])
+    return utils.make_response([render(r) for r in rows], headers)
+
 
 class ClientState(Resource):
     """ Explore what the connection state for client connection to TWS
@@ -374,11 +514,26 @@ class ClientState(Resource):
     method_decorators = [authenticate]
 
     def get(self):
-        resp = dict(connected=dict())
-        resp['connected'][g.client_id] = g.client_connection.isConnected()
+        resp = dict(connected=dict(), stats=dict(), orders=g.client_id, market=feeds.market_stats(),
+                    history=bars.stats(), pacing=pacing.stats(), database=database.stats(),
+                    accounts=accounts.stats(), capture=capture.stats())
+        for client in g.client_pool:
+            resp['connected'][client.clientId] = client.isConnected()
+            # In-flight requests, queued writes and requests sent per client
+            resp['stats'][client.clientId] = client.stats()
         return utils.make_response(resp)
 
 
+class Metrics(Resource):
+    """ Counters and histograms of messages from TWS, requests to it, our waits on it and our REST requests
+    """
+    method_decorators = [authenticate]
+
+    def get(self):
+        """ Returns every metric in Prometheus' text format, for it to scrape """
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class Beacon(Resource):
     def get(self):
         """ A GET here causes a PUT to our GAE App with needed info.  GETs initiated by GAE or a cron job with:
@@ -402,7 +557,7 @@ class Test(Resource):
     def get(self):
         resp = {k: str(v) for k, v in request.environ.iteritems()}
 
-        log.debug('Environment vars: {}'.format(resp))
+        log.debug('Environment vars: %s', resp)
         return resp
 
 
@@ -417,7 +572,9 @@ class Hello(Resource):
 # ROUTING
 # ---------------------------------------------------------------------
 api.add_resource(History, '/history/<string:symbol>')
+api.add_resource(HistoryStream, '/history/<string:symbol>/stream')
 api.add_resource(Market, '/market/<string:symbol>')
+api.add_resource(MarketStream, '/market/<string:symbol>/stream')
 api.add_resource(Order, '/order')
 api.add_resource(OrderOCA, '/order/oca')
 api.add_resource(OrderFilled, '/order/filled')
@@ -427,6 +584,7 @@ api.add_resource(AccountUpdate, '/account/update')
 api.add_resource(Executions, '/executions')
 api.add_resource(ExecutionCommissions, '/executions/commissions')
 api.add_resource(ClientState, '/clients')
+api.add_resource(Metrics, '/metrics')
 api.add_resource(Beacon, '/beacon')
 api.add_resource(Test, '/test')
 api.add_resource(Hello, '/')
@@ -434,32 +592,39 @@ api.add_resource(Hello, '/')
 # ---------------------------------------------------------------------
 # SETUP CLIENTS
 # ---------------------------------------------------------------------
+metrics.install()
+if g.capture_dir:
+    capture.install(g.capture_dir)
 
+# Requests share each connection to IBGW through a Multiplexer.  The first (g.client_id) also takes all orders.
+g.client_connection = connection.Multiplexer(g.client_connection)
+g.client_pool = [g.client_connection] + [connection.Multiplexer(ibConnection(g.ibgw_host, g.ibgw_port, g.client_id + i))
+                                         for i in range(1, g.pool_size)]
 
-log.debug('Using IB GW client at: {}:{}'.format(g.client_connection.host, g.client_connection.port))
+log.debug('Using IB GW client at: %s:%s', g.client_connection.host, g.client_connection.port)
 
 if __name__ == '__main__':
     host = os.getenv('IBREST_HOST', '127.0.0.1')
     port = int(os.getenv('IBREST_PORT', '443'))
     client_id = g.client_id
 
-    # Set up our client connection with IBGW
-    client = ibConnection(g.ibgw_host, g.ibgw_port, client_id)
-    connection.setup_client(client)
-    client.connect()
-    g.client_connection = client
+    # Set up our client connections with IBGW
+    for client in g.client_pool:
+        connection.setup_client(client)
+        client.connect()
     # g.clientId_pool = [client_id]
 
     # Call our own beacon code to register with GAE
     if g.serializer is not None:
-        log.debug('Sent flare to GAE with response: {}'.format(send_flare_to_gae()))
+        log.debug('Sent flare to GAE with response: %s', send_flare_to_gae())
     else:
-        log.debug('No beacon flare sent.  No ID_SECRET_KEY found in environment: {}.  Client ID: {}'.format(os.getenv('ID_SECRET_KEY'), client_id))
+        log.debug('No beacon flare sent.  No ID_SECRET_KEY found in environment: %s.  Client ID: %s',
+                  os.getenv('ID_SECRET_KEY'), client_id)
 
 
     # When runnning with werkzeug, we already get good logging to stdout, so disabble loggers
     # root.setLevel(logging.ERROR)
-    log.debug('Setting up IBREST at {}:{}'.format(host, port))
+    log.debug('Setting up IBREST at %s:%s', host, port)
     context = ('ibrest.crt', 'ibrest.key')
 
     # Log to file to since Docker isn't doing it for use
@@ -475,7 +640,8 @@ if __name__ == '__main__':
 
     DEBUG = False
     # For HTTPS with or without debugging
-    app.run(debug=DEBUG, host=host, port=port, ssl_context=context)
+    # Serve requests on their own threads so they can wait on TWS concurrently
+    app.run(debug=DEBUG, host=host, port=port, ssl_context=context, threaded=True)
     # app.run(debug=DEBUG, host=host, port=port)
 
 
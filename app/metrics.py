@@ -0,0 +1,166 @@
+""" Counters and histograms of the TWS and REST hot paths, served by /metrics in Prometheus' text format.
+
+Every thread records into a shard of its own, so counting a message or timing a request takes no lock.  This matters
+most to the EReader thread of each connection, which dispatches every message TWS sends.  A scrape sums the shards of
+all threads.  Shards of threads that have ended are folded into one, so that a thread per request doesn't add up.
+
+A histogram is kept as a count per bucket followed by the sum observed.  Its count is the sum of its buckets, so a
+scrape racing an update can't see a count that disagrees with them.
+"""
+import bisect
+import threading
+
+from ib.opt.dispatcher import Dispatcher
+
+__author__ = 'Jason Haury'
+
+# Upper bounds of our histogram buckets, in seconds
+SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()  # Only taken by a thread's first update and by scrapes
+_local = threading.local()
+_shards = []  # (thread, values) of every thread which has recorded something
+_retired = dict()  # Values of threads which have ended
+_metrics = []
+
+
+def _values():
+    """ Returns this thread's shard: a dict of (metric, label values) to the counter's value or histogram's buckets """
+    try:
+        return _local.values
+    except AttributeError:
+        values = _local.values = dict()
+        with _lock:
+            _retire()
+            _shards.append((threading.current_thread(), values))
+        return values
+
+
+def _merge(into, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            total = into.get(key)
+            into[key] = list(value) if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _retire():
+    """ Folds the shards of threads which have ended into _retired.  Caller holds _lock. """
+    alive = []
+    for thread, values in _shards:
+        if thread.is_alive():
+            alive.append((thread, values))
+        else:
+            _merge(_retired, values)
+    _shards[:] = alive
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                           .replace('\n', r'\n')) for name, value in pairs) + '}'
+
+
+class Counter(object):
+    """ A count of events, by the values of its labels """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        _metrics.append(self)
+
+    def inc(self, labels=(), amount=1):
+        values = _values()
+        key = (self, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def lines(self, labels, value):
+        yield '{}{} {}'.format(self.name, _labels(self.labels, labels), _number(value))
+
+
+class Histogram(object):
+    """ A distribution of observed values (ie seconds taken), by the values of its labels """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        _metrics.append(self)
+
+    def observe(self, value, labels=()):
+        values = _values()
+        key = (self, labels)
+        counts = values.get(key)
+        if counts is None:
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def lines(self, labels, counts):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(self.name, _labels(self.labels, labels, [('le', _number(bound))]),
+                                          cumulative)
+        yield '{}_sum{} {}'.format(self.name, _labels(self.labels, labels), _number(counts[-1]))
+        yield '{}_count{} {}'.format(self.name, _labels(self.labels, labels), cumulative)
+
+
+# ---------------------------------------------------------------------
+# METRICS
+# ---------------------------------------------------------------------
+INBOUND = Histogram('ibrest_tws_message_seconds', 'Messages from TWS by type, and the time their handlers took',
+                    ('type',))
+OUTBOUND = Histogram('ibrest_tws_request_seconds', 'Requests sent to TWS by type, and the time sending them took',
+                     ('type',))
+WAITS = Histogram('ibrest_tws_wait_seconds', 'Time requests waited on TWS to answer, by the message awaited and '
+                  'whether it came in time', ('message', 'outcome'))
+RECONNECTS = Counter('ibrest_tws_reconnects_total', 'Attempts at reconnecting to TWS, by client and whether they '
+                     'worked', ('client', 'connected'))
+ERRORS = Counter('ibrest_tws_errors_total', 'Error messages from TWS, by error code', ('code',))
+REST = Histogram('ibrest_rest_request_seconds', 'Time to answer REST requests, by resource, method and status',
+                 ('resource', 'method', 'status'))
+COMMITS = Histogram('ibrest_sqlite_commit_seconds', 'Time to commit a batch of fills and commissions to SQLite')
+
+
+def _observe_message(name, seconds):
+    INBOUND.observe(seconds, (name,))
+
+
+def install():
+    """ Times every message dispatched from TWS from now on """
+    Dispatcher.observer = staticmethod(_observe_message)
+
+
+def render():
+    """ Returns every metric in Prometheus' text exposition format """
+    totals = dict()
+    with _lock:
+        _retire()
+        _merge(totals, _retired)
+        shards = [values for thread, values in _shards]
+    for values in shards:
+        # Copying a dict is atomic, so its thread may keep updating it
+        _merge(totals, dict(values))
+
+    by_metric = dict()
+    for (metric, labels), value in totals.items():
+        by_metric.setdefault(metric, []).append((labels, value))
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for labels, value in sorted(by_metric.get(metric, ())):
+            lines.extend(metric.lines(labels, value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,181 @@
+""" Pacing of reqHistoricalData, so we queue history requests rather than have TWS reject them with error 162.
+
+IB allows at most:
+  - 60 historical data requests in any 10 minutes
+  - 6 requests for the same contract, exchange and whatToShow in any 2 seconds
+  - 1 identical request in any 15 seconds
+
+Each rule is a Window of the times we sent within (a little over) its period.  Callers of `run()` queue by priority
+(higher first, then in order of arrival) and the first whose rules allow it is sent next.  An identical request already
+in flight (or answered within the last IDENTICAL_PERIOD seconds) isn't sent again; its callers share the one answer.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+# Each period is padded by the time our request might take to reach TWS, which counts from when it gets it
+IDENTICAL_PERIOD = 15 + 1
+CONTRACT_PERIOD = 2 + 0.25
+ALL_PERIOD = 10 * 60 + 5
+
+
+class Window(object):
+    """ Allows at most `limit` sends in any `period` seconds """
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.sent = deque()  # Times of our sends within the last `period` seconds, oldest first
+
+    def wait(self, now, ahead=0):
+        """ Returns seconds until one more send fits, after `ahead` others queued before it """
+        while self.sent and self.sent[0] <= now - self.period:
+            self.sent.popleft()
+        index = len(self.sent) + ahead - self.limit
+        if index < 0:
+            return 0.0
+        if index < len(self.sent):
+            return self.sent[index] + self.period - now
+        # Past what we've sent so far; assume those ahead go as soon as they can
+        return (index // self.limit + 1) * self.period
+
+    def record(self, now):
+        self.sent.append(now)
+
+
+class Ticket(object):
+    """ One upstream request and everyone waiting on its answer """
+    def __init__(self, key, rule):
+        self.key = key
+        self.rule = rule
+        self.sent_at = None
+        self.result = None
+        self.exception = None
+        self.done = threading.Event()
+
+
+_cond = threading.Condition()
+_queue = []  # (-priority, arrival, Ticket) of each request not yet sent
+_arrival = itertools.count()
+_in_flight = dict()  # Ticket by key, from queued until its answer is IDENTICAL_PERIOD seconds old
+_all = Window(60, ALL_PERIOD)
+_rules = dict()  # Window(6, 2) by (contract key, whatToShow)
+_identical = dict()  # Time we last sent each key, for IDENTICAL_PERIOD seconds
+_counts = dict(sent=0, shared=0, waited=0.0)
+
+
+def _rule_window(rule):
+    window = _rules.get(rule)
+    if window is None:
+        window = _rules[rule] = Window(6, CONTRACT_PERIOD)
+    return window
+
+
+def _own_wait(ticket, now):
+    """ Seconds until `ticket`'s contract and identical request rules allow it.  Caller holds _cond. """
+    return max(_rule_window(ticket.rule).wait(now), _identical.get(ticket.key, 0) + IDENTICAL_PERIOD - now)
+
+
+def _forget_answered(now):
+    """ Drops answers too old to stand in for an identical request.  Caller holds _cond. """
+    for key, ticket in _in_flight.items():
+        if ticket.sent_at is not None and ticket.done.is_set() and now - ticket.sent_at >= IDENTICAL_PERIOD:
+            del _in_flight[key]
+    for key, sent_at in _identical.items():
+        if now - sent_at >= IDENTICAL_PERIOD:
+            del _identical[key]
+
+
+def estimate(rule=None, priority=0, count=1):
+    """ Returns the estimated seconds before `count` more requests (for contract rule `rule`, if given) at `priority`
+    would all have been sent
+    """
+    with _cond:
+        now = time.time()
+        ahead = sum(1 for p, arrival, ticket in _queue if -p >= priority)
+        wait = _all.wait(now, ahead + count - 1)
+        if rule is not None:
+            ahead = sum(1 for p, arrival, ticket in _queue if -p >= priority and ticket.rule == rule)
+            wait = max(wait, _rule_window(rule).wait(now, ahead + count - 1))
+    return wait
+
+
+def run(key, rule, send, priority=0):
+    """ Calls `send()` once pacing allows, or shares the answer of an identical request already sent.  `key` identifies
+    identical requests and `rule` is the (contract key, whatToShow) of the request.  Returns `(result, waited)`, where
+    `waited` is how many seconds we were queued.
+    """
+    start = time.time()
+    with _cond:
+        _forget_answered(start)
+        ticket = _in_flight.get(key)
+        if ticket is None:
+            ticket = _in_flight[key] = Ticket(key, rule)
+            _queue.append((-priority, next(_arrival), ticket))
+            owner = True
+        else:
+            _counts['shared'] += 1
+            owner = False
+
+    if not owner:
+        ticket.done.wait()
+        if ticket.exception is not None:
+            raise ticket.exception
+        return ticket.result, time.time() - start
+
+    with _cond:
+        while True:
+            now = time.time()
+            wait = _all.wait(now)
+            if wait <= 0:
+                # The first queued request whose own rules allow it goes next
+                waits = [(_own_wait(queued, now), queued) for p, arrival, queued in sorted(_queue)]
+                ready = [queued for own, queued in waits if own <= 0]
+                if ready and ready[0] is ticket:
+                    break
+                wait = min(own for own, queued in waits if own > 0) if not ready else None
+            _cond.wait(wait)
+        _queue.remove(next(entry for entry in _queue if entry[2] is ticket))
+        _all.record(now)
+        _rule_window(rule).record(now)
+        _identical[key] = now
+        ticket.sent_at = now
+        _counts['sent'] += 1
+        _counts['waited'] += now - start
+        # Let the next in line check whether it can go
+        _cond.notify_all()
+    if now - start > 0.01:
+        log.info('Paced historical data request %s for %.1fs', key, now - start)
+
+    try:
+        ticket.result = send()
+    except Exception as e:
+        ticket.exception = e
+        with _cond:
+            _in_flight.pop(key, None)
+        raise
+    finally:
+        ticket.done.set()
+    return ticket.result, now - start
+
+
+def forget(key):
+    """ Stops sharing the answer to `key`, ie because it was an error """
+    with _cond:
+        ticket = _in_flight.get(key)
+        if ticket is not None and ticket.done.is_set():
+            del _in_flight[key]
+
+
+def stats():
+    """ Returns counters for the /clients endpoint """
+    with _cond:
+        now = time.time()
+        stats = dict(queued=len(_queue), estimate=round(_all.wait(now, len(_queue)), 1))
+        stats.update(_counts)
+    return stats
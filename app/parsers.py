@@ -1,8 +1,11 @@
 """ Flask-RESTful request parsers which help enforce argument needs for IB types:
  * Order
  * Contract
+ * Fills saved in SQLite
 """
 from flask_restful import reqparse
+import bars
+import database
 
 __author__ = 'Jason Haury'
 
@@ -38,4 +41,41 @@ contract_parser.add_argument('secType', type=str, required=False, default='STK',
                              choices=['STK', 'OPT', 'FUT', 'IND', 'FOP', 'CASH', 'BAG', 'NEWS'], store_missing=True)
 contract_parser.add_argument('exchange', type=str, required=False, default='SMART', help='Exchange (ie NASDAQ, SMART)', store_missing=True)
 contract_parser.add_argument('currency', type=str, required=False, default='USD',
-                             help='Currency used for order (ie USD, GBP))', store_missing=True)
\ No newline at end of file
+                             help='Currency used for order (ie USD, GBP))', store_missing=True)
+
+
+# ---------------------------------------------------------------------
+# FILLS PARSER
+# ---------------------------------------------------------------------
+# Filters and pages through rows saved in SQLite, for /order/filled and /executions/commissions
+def time_arg(value):
+    """ Epoch seconds of a time given as epoch seconds, "yyyymmdd" or "yyyymmdd hh:mm:ss" """
+    try:
+        return bars.bar_time(value.strip())
+    except ValueError:
+        raise ValueError('{} is not epoch seconds, yyyymmdd or yyyymmdd hh:mm:ss'.format(value))
+
+
+def limit_arg(value):
+    value = int(value)
+    if not 1 <= value <= 10000:
+        raise ValueError('limit must be from 1 to 10000')
+    return value
+
+
+def side_arg(value):
+    """ BUY or SELL, given as either or as an execution's BOT or SLD """
+    value = value.strip().upper()
+    return database.SIDES.get(value, value)
+
+
+fills_parser = reqparse.RequestParser(bundle_errors=True)
+fills_parser.add_argument('orderId', type=int, help='Order ID to filter')
+fills_parser.add_argument('permId', type=int, help='Permanent order ID to filter')
+fills_parser.add_argument('symbol', type=str, trim=True, help='Symbol to filter')
+fills_parser.add_argument('account', type=str, trim=True, help='Account number/code to filter')
+fills_parser.add_argument('side', type=side_arg, help='Side to filter (ie BUY or SELL)')
+fills_parser.add_argument('start', type=time_arg, help='Earliest time to return')
+fills_parser.add_argument('end', type=time_arg, help='Time to return rows before')
+fills_parser.add_argument('limit', type=limit_arg, default=1000, help='Most rows to return, newest first')
+fills_parser.add_argument('offset', type=int, default=0, help='Rows to skip, for the next page')
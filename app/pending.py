@@ -0,0 +1,146 @@
+""" Completion tracking and response collection for requests sent to TWS.
+
+Sync and feed functions call `expect()` before sending a request, then block on the returned `Pending` until a message
+handler calls `finish()` for the End message (or error) answering that request.  This returns the HTTP call as soon as
+TWS is done rather than on the next polling tick.
+
+Requests are keyed by `(name, id)`, where `name` is the EWrapper message which completes the request and `id` is the
+reqId/tickerId/orderId it was sent with, or None for requests TWS answers without an id (ie reqAllOpenOrders).
+
+Each Pending carries its own `resp`, which handlers fill through `responses()` with the messages answering its key.
+Concurrent requests therefore never share (or reset) each other's response.  Requests TWS answers without an id can't
+be told apart on the wire, so `share()` lets a caller join one already in flight rather than send its own.
+"""
+import copy
+import threading
+import time
+import logging
+import globals as g
+import metrics
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+# Every Pending still being waited on, keyed by each of its (name, id) keys
+_waiting = dict()
+_lock = threading.Lock()
+
+
+class Pending(object):
+    """ A request (or group of requests) a caller is waiting on.  May be registered under several keys, in which case
+    it finishes on whichever completes first.
+    """
+    def __init__(self, keys, resp=None, client=None):
+        self.keys = keys
+        self.resp = resp if resp is not None else dict()
+        self.client = client  # Connection the request was sent on
+        self.error = None
+        self._event = threading.Event()
+
+    def finish(self, error=None):
+        if error is not None:
+            self.error = error
+        self._event.set()
+
+    def is_finished(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """ Blocks until finished or `timeout` seconds (default `g.request_timeout`) have passed, then stops listening
+        for its keys.  Returns True if finished.
+        """
+        if timeout is None:
+            timeout = g.request_timeout
+        start = time.time()
+        try:
+            finished = self._event.wait(timeout)
+        finally:
+            discard(self)
+        metrics.WAITS.observe(time.time() - start, (self.keys[0][0], 'finished' if finished else 'timeout'))
+        if not finished:
+            log.debug('Timed out after %ss waiting for %s', timeout, self.keys)
+        return finished
+
+
+def expect(*keys, **kwargs):
+    """ Registers and returns a new Pending for the `(name, id)` keys given.  Call this before sending the request so
+    a fast answer can't be missed.  Pass `resp` to start with an empty response of a given shape, and `client` for
+    the connection the request goes out on.
+    """
+    pending = Pending(keys, kwargs.get('resp'), kwargs.get('client'))
+    with _lock:
+        for key in keys:
+            _waiting.setdefault(key, set()).add(pending)
+    return pending
+
+
+def share(key, resp, client=None):
+    """ Like `expect()` for a request TWS answers without an id.  Returns `(pending, send)`: when an identical request
+    is already in flight, `pending` starts with a copy of what it has collected so far and `send` is False, since
+    sending another would only have its End message finish both early.
+    """
+    with _lock:
+        waiters = _waiting.get(key)
+        if waiters:
+            leader = next(iter(waiters))
+            pending = Pending((key,), copy.deepcopy(leader.resp), leader.client)
+            waiters.add(pending)
+            return pending, False
+        pending = Pending((key,), resp, client)
+        _waiting[key] = set([pending])
+    return pending, True
+
+
+def responses(name, id=None):
+    """ Returns the `resp` of everything waiting on `(name, id)`, for handlers to collect messages into """
+    with _lock:
+        return [pending.resp for pending in _waiting.get((name, id), ())]
+
+
+def discard(pending):
+    """ Stops listening for all of `pending`'s keys """
+    with _lock:
+        for key in pending.keys:
+            waiters = _waiting.get(key)
+            if waiters is not None:
+                waiters.discard(pending)
+                if not waiters:
+                    del _waiting[key]
+
+
+def finish(name, id=None, error=None):
+    """ Finishes everything waiting on `(name, id)`.  Called from message handlers. """
+    with _lock:
+        waiters = _waiting.pop((name, id), ())
+    for pending in waiters:
+        pending.finish(error)
+
+
+def finish_id(id, error=None):
+    """ Finishes everything waiting on `id`, whatever message it expected.  Used for errors, which only carry the id
+    of the request that caused them.
+    """
+    with _lock:
+        keys = [key for key in _waiting if key[1] == id]
+        waiters = set()
+        for key in keys:
+            waiters.update(_waiting.pop(key))
+    for pending in waiters:
+        pending.finish(error)
+
+
+def finish_all(error=None, client=None):
+    """ Finishes everything being waited on, ie when the connection to TWS is lost.  Given a `client`, only requests
+    sent on that connection are finished.
+    """
+    with _lock:
+        waiters = set()
+        for key, key_waiters in _waiting.items():
+            lost = set(pending for pending in key_waiters if client is None or pending.client is client)
+            waiters.update(lost)
+            key_waiters.difference_update(lost)
+            if not key_waiters:
+                del _waiting[key]
+    for pending in waiters:
+        pending.finish(error)
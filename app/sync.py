@@ -1,8 +1,11 @@
 """ Synchronous wrapper on IbPy to do heavy lifting for our Flask app.
 This module contains all IB client handling, even if connection will be used for a feed
 """
+import accounts
 import connection
 import globals as g
+import pending
+from utils import get_tickerId, get_orderId
 
 # from flask import g
 from ib.ext.Contract import Contract
@@ -20,61 +23,46 @@ log = logging.getLogger(__name__)
 # ---------------------------------------------------------------------
 # ORDER FUNCTIONS
 # ---------------------------------------------------------------------
-def get_open_orders():
-    """ Uses reqAllOpenOrders to get all open orders from 
-    """
-    client = connection.get_client(0)
-    if client is None:
-        return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
-
-    # Reset our order resp to prepare for new data
-    g.order_resp = dict(openOrderEnd=False, openOrder=[], orderStatus=[])
-    client.reqAllOpenOrders()
-    timeout = g.timeout
-    while g.order_resp['openOrderEnd'] is False and client.isConnected() is True and timeout > 0:
-        # log.debug("Waiting for Open Orders responses on client {}...".format(client.clientId))
-        time.sleep(0.25)
-        timeout -= 1
-    connection.close_client(client)
-    return g.order_resp
-
-
 def cancel_order(orderId):
     """ Uses cancelOrder to cancel an order.  The only response is what comes back right away (no EWrapper messages)
     """
-    g.error_resp[orderId] = None  # Reset our error for later
-
-    client = connection.get_client(0)
+    client = connection.get_client(orders=True)
     if client is None:
         return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
-
-    log.info('Cancelling order {}'.format(orderId))
-    # Reset our order resp to prepare for new data
-    g.order_resp_by_order[orderId] = dict(openOrder=dict(), orderStatus=dict())
-    client.cancelOrder(int(orderId))
-    timeout = g.timeout
-    while len(g.order_resp_by_order[orderId]['orderStatus']) == 0 and client.isConnected() is True and timeout > 0:
-        # log.debug("Waiting for Cancel Order responses on client {}...".format(client.clientId))
-        if g.error_resp[orderId] is not None:
-            connection.close_client(client)
-            return g.error_resp[orderId]
-        time.sleep(0.25)
-        timeout -= 1
-    connection.close_client(client)
-    resp = g.order_resp.copy()
+    try:
+        if client.isConnected() is False:
+            return g.error_resp[-1]
+
+        log.info('Cancelling order %s', orderId)
+        since = dict()
+        expect_order(orderId, since)
+        done = pending.expect(('orderStatus', orderId), client=client)
+        client.cancelOrder(int(orderId))
+        # Either an orderStatus or an error for this orderId finishes our wait
+        done.wait()
+    finally:
+        connection.close_client(client)
+    resp = accounts.book.get(orderId).copy()
+    if accounts.book.status_sequence(orderId) <= since[orderId] and done.error is not None:
+        return done.error
     # Cancelling an order also produces an error, we'll capture that here too
     resp['error'] = g.error_resp[orderId]
     return resp
 
 
-def wait_for_responses(order_ids, client, timeout,
+def expect_order(orderId, since):
+    """ Call before sending a request for `orderId`: resets its error and keeps the sequence of its latest orderStatus
+    in `since`, so only what TWS sends from now on answers the request
+    """
+    g.error_resp[orderId] = None
+    since[orderId] = accounts.book.status_sequence(orderId)
+
+
+def wait_for_responses(order_ids, client, timeout, since,
                        status_list=['Filled', 'Submitted', 'Presubmitted', 'Cancelled']):
     """ Takes a set of 'order_ids' and waits 'timeout' quarter-seconds for some kind of response (error or other) from
-    the open client connection.
+    the open client connection.  'since' is what expect_order() kept of each before its request was sent, so an
+    orderStatus from before then isn't taken as the response.
 
     'status_list' is list of string includeing: Filled, Submitted, Presubmitted, Cancelled
     It dictates the order status levels that are sufficient to consider a response complete.
@@ -82,23 +70,22 @@ def wait_for_responses(order_ids, client, timeout,
     Some orderIDs we don't want to wait for them to get a status in status_list, but simply want to have _something_
     to return.
     """
-    # Reset our global order resp dicts to prepare for new data
-    for orderId in order_ids:
-        g.order_resp_by_order[orderId] = dict(openOrder=dict(), orderStatus=dict())
-        g.error_resp[orderId] = None  # Reset our error for later
-
-    # The only response for placing an order is an error, so we'll check for open orders and wait for this orderId or
-    # and error to show up.
-    client.reqOpenOrders()
+    # TWS sends the openOrder and orderStatus of orders we place without being asked, so we wait for this orderId or an
+    # error to show up in our order book.
+    deadline = time.time() + timeout * 0.25
 
     resp = {}
     errors = {}
-    while order_ids and client.isConnected() is True and timeout > 0:
+    while order_ids and client.isConnected() is True and time.time() < deadline:
+        # Listen before looking so an update arriving while we check isn't missed
+        updated = pending.expect(*[('orderStatus', orderId) for orderId in order_ids], client=client)
         new_order_ids = order_ids.copy()
-        log.debug("Waiting for orderIds {} responses for {} more times...".format(order_ids, timeout))
+        log.debug("Waiting for orderIds %s responses for %.2fs more...", order_ids, deadline - time.time())
         for orderId in order_ids:
-            if g.order_resp_by_order[orderId]['orderStatus'].get('status', None):
-                order_resp = g.order_resp_by_order[orderId]
+            # Sequence before entry, so the entry is at least as new as the orderStatus we compare
+            answered = accounts.book.status_sequence(orderId) > since.get(orderId, 0)
+            order_resp = accounts.book.get(orderId)
+            if answered and order_resp['orderStatus'].get('status', None):
                 partial_resp = {'status': order_resp['orderStatus']['status']}
                 for k_o in ['m_totalQuantity', 'm_orderType', 'm_trailingPercent', 'm_auxPrice', 'm_lmtPrice']:
                     try:
@@ -122,26 +109,26 @@ def wait_for_responses(order_ids, client, timeout,
                     if avgFillPrice != 0.0: partial_resp['avgFillPrice'] = avgFillPrice
                     new_order_ids.discard(orderId)
                     # log.debug('Order Status: {}'.format(order_resp['orderStatus']))
-                    log.debug('Order {} partial response: {}'.format(orderId, partial_resp))
+                    log.debug('Order %s partial response: %s', orderId, partial_resp)
                 # # Merge in our responses to make a single response dict
                 resp[orderId] = partial_resp.copy()
             elif g.error_resp[orderId] is not None:
-                log.error('Error placing order: {}'.format(g.error_resp[orderId]))
+                log.error('Error placing order: %s', g.error_resp[orderId])
                 errors[orderId] = g.error_resp[orderId].copy()
                 new_order_ids.discard(orderId)
         # Always remove orderIds which we should only look once for if we have _something_ to return
         collected_ids = set(resp.keys())
         new_order_ids = new_order_ids - collected_ids
         order_ids = new_order_ids.copy()
-        time.sleep(0.25)
-        timeout -= 1
-        # request a new set of open orders every second
-        if timeout % 4 == 0:
-            client.reqOpenOrders()
+        if not order_ids:
+            pending.discard(updated)
+            break
+        # Sleep until one of our orders gets an orderStatus or error
+        updated.wait(min(0.25, deadline - time.time()))
 
     # add in any errors we may have found
     if errors:
-        log.error('Found these order errors: {}'.format(errors))
+        log.error('Found these order errors: %s', errors)
         resp['errors'] = errors
     return resp
 
@@ -165,12 +152,19 @@ def place_order(order_list):
     When an object in `order_list` has secType = 'BAG', it implies an Options combo order will be placed, requiring
     comboLegs: a JSON list of details required for this function to fetch the conId to then build the ComboLeg.
     """
-    log.debug('Starting place_order with args_list: {}'.format(order_list))
-    client = connection.get_client(0)
+    log.debug('Starting place_order with args_list: %s', order_list)
+    client = connection.get_client(orders=True)
     if client is None:
-        connection.close_client(client)
         return g.error_resp[-2]
-    elif client.isConnected() is False:
+    try:
+        return _place_orders(client, order_list)
+    finally:
+        connection.close_client(client)
+
+
+def _place_orders(client, order_list):
+    """ place_order() on `client` """
+    if client.isConnected() is False:
         return g.error_resp[-1]
 
     # To allow for bracketed orders (or processing a string of orders in a single request), we expect args to be a list
@@ -179,6 +173,7 @@ def place_order(order_list):
 
     parentId = None
     order_ids = set()
+    since = dict()  # Of each order, for wait_for_responses()
     dont_wait_order_ids = set()  # Some orders aren't worth waiting for responses on
     for args in order_list:
         # If an orderId was provided, we'll be updating an existing order, so only send attributes which are updatable:
@@ -187,8 +182,7 @@ def place_order(order_list):
         # log.debug('Processing args from order_list: {}'.format(args))
         orderId = args.get('orderId', None)
         if orderId is None:
-            orderId = g.orderId
-            g.orderId += 1
+            orderId = get_orderId()
         order_ids.add(orderId)
         if 'goodAfterTime' in args:
             dont_wait_order_ids.add(orderId)
@@ -210,10 +204,7 @@ def place_order(order_list):
         if comboLegs:
             # We need to build ComboLegs by first fetching the conId from the contract details
             all_legs = []
-            req_ids = []
-            # Clear out our global ContractDetails so our handler can repopulate them
-            g.contract_resp['contractDetails'] = dict()
-            g.contract_resp['contractDetailsEnd'] = False
+            legs_done = []
 
             # Request new ContractDetails so we can get the conIds needed for our legs
             for idx, leg in enumerate(comboLegs):
@@ -226,14 +217,13 @@ def place_order(order_list):
                         setattr(leg_contract, attr, leg[attr[2:]])
 
                 # Fetch conId for leg_contract
-                client.reqContractDetails(idx, leg_contract)
-                req_ids.append(idx)
+                reqId = get_tickerId()
+                legs_done.append(pending.expect(('contractDetailsEnd', reqId), client=client))
+                client.reqContractDetails(reqId, leg_contract)
 
             # We've now requested ContractDetails for all legs.  Wait to get their async responses.
-            timeout = g.timeout
-            while g.contract_resp['contractDetailsEnd'] is False and client.isConnected() is True and timeout > 0:
-                time.sleep(0.25)
-                timeout -= 1
+            for done in legs_done:
+                done.wait()
 
             # Create our ComboLegs for our order
             for idx, leg in enumerate(comboLegs):
@@ -242,7 +232,7 @@ def place_order(order_list):
                 for attr in dir(combo_leg):
                     if attr[:2] == 'm_' and attr[2:] in leg:
                         setattr(combo_leg, attr, leg[attr[2:]])
-                combo_leg.m_conId = g.contract_resp['contractDetails'][idx]['m_summary'].m_conId
+                combo_leg.m_conId = legs_done[idx].resp['contractDetails']['m_summary'].m_conId
                 all_legs.append(combo_leg)
             contract.m_comboLegs = all_legs
 
@@ -250,23 +240,22 @@ def place_order(order_list):
         if parentId:
             order.m_parentId = parentId
 
-        log.debug('Placing order # {} on client # {} (connected={}): {}'.format(orderId, client.clientId,
-                                                                                client.isConnected(), args))
+        log.debug('Placing order # %s on client # %s (connected=%s): %s', orderId, client.clientId,
+                  client.isConnected(), args)
+        expect_order(orderId, since)
         client.placeOrder(orderId, contract, order)
         # Assume our 1st order in the list is the parent.  Use this for remaining bracket orders and also error handling
         if not parentId:
             parentId = orderId
-            log.debug('Setting child order parentId={}'.format(parentId))
+            log.debug('Setting child order parentId=%s', parentId)
 
-    log.debug('Ignoring responses for these orderIds: {}'.format(dont_wait_order_ids))
+    log.debug('Ignoring responses for these orderIds: %s', dont_wait_order_ids)
     order_ids = order_ids - dont_wait_order_ids
 
     # Don't look for order status or errors until we actually transmit the last order, but then look for status for
     # all order_ids
     timeout = g.timeout
-    resp = wait_for_responses(order_ids, client, timeout)
-    connection.close_client(client)
-    return resp
+    return wait_for_responses(order_ids, client, timeout, since)
 
 
 def place_order_oca(order_list):
@@ -293,12 +282,19 @@ def place_order_oca(order_list):
 
     Setting `oca` to True implies
     """
-    log.debug('Starting place_order_oca with args_list: {}'.format(order_list))
-    client = connection.get_client(0)
+    log.debug('Starting place_order_oca with args_list: %s', order_list)
+    client = connection.get_client(orders=True)
     if client is None:
-        connection.close_client(client)
         return g.error_resp[-2]
-    elif client.isConnected() is False:
+    try:
+        return _place_orders_oca(client, order_list)
+    finally:
+        connection.close_client(client)
+
+
+def _place_orders_oca(client, order_list):
+    """ place_order_oca() on `client` """
+    if client.isConnected() is False:
         return g.error_resp[-1]
 
     # To allow for bracketed orders (or processing a string of orders in a single request), we expect args to be a list
@@ -310,6 +306,7 @@ def place_order_oca(order_list):
     oca_list = []
     ocaGroup = None
     order_ids = set()
+    since = dict()  # Of each order, for wait_for_responses()
     dont_wait_order_ids = set()  # Some orders aren't worth waiting for responses on
     for args in order_list:
         # If an orderId was provided, we'll be updating an existing order, so only send attributes which are updateable:
@@ -318,8 +315,7 @@ def place_order_oca(order_list):
         # log.debug('Processing args from order_list: {}'.format(args))
         orderId = args.get('orderId', None)
         if orderId is None:
-            orderId = g.orderId
-            g.orderId += 1
+            orderId = get_orderId()
         if 'goodAfterTime' in args:
             dont_wait_order_ids.add(orderId)
         contract = Contract()
@@ -347,13 +343,14 @@ def place_order_oca(order_list):
             # Don't actually place this OCA order just yet
             continue
 
-        log.debug('Placing Open order # {} on client # {} (connected={}): {}'.format(orderId, client.clientId,
-                                                                                     client.isConnected(), args))
+        log.debug('Placing Open order # %s on client # %s (connected=%s): %s', orderId, client.clientId,
+                  client.isConnected(), args)
+        expect_order(orderId, since)
         client.placeOrder(orderId, contract, order)
         # Assume our 1st order in the list is the parent.  Use this for remaining bracket orders and also error handling
         if not ocaGroup:
             ocaGroup = orderId
-            log.debug('Setting ocaGroup={}'.format(ocaGroup))
+            log.debug('Setting ocaGroup=%s', ocaGroup)
 
     # The only response for placing an order is an error, so we'll check for open orders and wait for this orderId or
     # and error to show up.
@@ -369,108 +366,43 @@ def place_order_oca(order_list):
     order_ids = order_ids - dont_wait_order_ids
     # Make a 1-item set representing our Open postion order
     oca_set = set([ocaGroup])
-    resp['open_resp'] = wait_for_responses(oca_set, client, timeout, ['Filled'])
+    resp['open_resp'] = wait_for_responses(oca_set, client, timeout, since, ['Filled'])
     # Our open order is filled, so now place our OCA group close orders
-    log.debug('Placing OCA group of {} orders, ignoring responses for these orderIds: {}'.
-              format(len(oca_list), dont_wait_order_ids))
+    log.debug('Placing OCA group of %s orders, ignoring responses for these orderIds: %s', len(oca_list),
+              dont_wait_order_ids)
     for o in oca_list:
+        expect_order(o[0], since)
         client.placeOrder(*o)
     # Now get responses for these new OCA orders
-    resp['close_resp'] = wait_for_responses(order_ids, client, timeout)
-    connection.close_client(client)
+    resp['close_resp'] = wait_for_responses(order_ids, client, timeout, since)
     return resp
 
 
 # ---------------------------------------------------------------------
 # ACCOUNT & PORTFOLIO FUNCTIONS
 # ---------------------------------------------------------------------
-def get_portfolio_positions():
-    client = connection.get_client()
-    if client is None:
-        return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
-    g.portfolio_positions_resp = dict(positionEnd=False, positions=[])
-    client.reqPositions()
-    timeout = g.timeout
-    while g.portfolio_positions_resp['positionEnd'] is False and client.isConnected() is True and timeout > 0:
-        # log.debug("Waiting for Portfolio Positions responses on client {}...".format(client.clientId))
-        time.sleep(0.25)
-        timeout -= 1
-    client.cancelPositions()
-    connection.close_client(client)
-    return g.portfolio_positions_resp
-
-
-def get_account_summary(tags):
-    """ Calls reqAccountSummary() then listens for accountSummary messages()
-    """
-    client = connection.get_client()
-    if client is None:
-        return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
-    client_id = client.clientId
-    g.account_summary_resp[client_id] = dict(accountSummaryEnd=False)
-    client.reqAccountSummary(client_id, 'All', tags)
-    timeout = g.timeout
-    while g.account_summary_resp[client_id]['accountSummaryEnd'] is False \
-            and client.isConnected() is True \
-            and timeout > 0:
-        # log.debug("Waiting for Account Summary responses on client {}...".format(client.clientId))
-        time.sleep(0.25)
-        timeout -= 1
-    # time.sleep(1)
-    client.cancelAccountSummary(client_id)
-    connection.close_client(client)
-    return g.account_summary_resp[client_id]
-
-
-def get_account_update(acctCode):
-    """ Calls reqAccountUpdates(subscribe=False) then listens for accountAccountTime/AccountValue/Portfolio messages
-    """
-    client = connection.get_client()
-    if client is None:
-        return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
-    client_id = client.clientId
-    g.account_update_resp = dict(accountDownloadEnd=False, updateAccountValue=dict(), updatePortfolio=[])
-    log.debug('Requesting account updates for {}'.format(acctCode))
-    client.reqAccountUpdates(subscribe=False, acctCode=acctCode)
-    timeout = g.timeout
-    while g.account_update_resp['accountDownloadEnd'] is False and client.isConnected() is True and timeout > 0:
-        # log.debug("Waiting for responses on client {}...".format(client.clientId))
-        time.sleep(.25)
-        timeout -= 1
-        log.debug('Current update {}'.format(g.account_update_resp))
-    client.cancelAccountSummary(client_id)
-    connection.close_client(client)
-    return g.account_update_resp
-
-
 def get_executions(args):
     """Gets all (filtered) executions from last 24hrs """
     client = connection.get_client()
     if client is None:
         return g.error_resp[-2]
-    elif client.isConnected() is False:
-        return g.error_resp[-1]
+    try:
+        if client.isConnected() is False:
+            return g.error_resp[-1]
 
-    g.executions_resp = dict(execDetailsEnd=False, execDetails=[], commissionReport=dict())
-    log.debug('Requesting executions for filter {}'.format(args))
-    filter = ExecutionFilter()
-    for attr in dir(filter):
-        if attr[:2] == 'm_' and attr[2:] in args:
-            setattr(filter, attr, args[attr[2:]])
-    log.debug('Filter: {}'.format(filter.__dict__))
-    filter.m_clientId = 0
-    client.reqExecutions(1, filter)
-    timeout = g.timeout / 2
-    while g.executions_resp['execDetailsEnd'] is False and client.isConnected() is True and timeout > 0:
-        # log.debug("Waiting for responses on client {}...".format(client.clientId))
-        time.sleep(.25)
-        timeout -= 1
-        log.debug('Current executions {}'.format(g.executions_resp))
-    connection.close_client(client)
-    return g.executions_resp
+        log.debug('Requesting executions for filter %s', args)
+        filter = ExecutionFilter()
+        for attr in dir(filter):
+            if attr[:2] == 'm_' and attr[2:] in args:
+                setattr(filter, attr, args[attr[2:]])
+        log.debug('Filter: %s', filter.__dict__)
+        filter.m_clientId = 0
+        reqId = get_tickerId()
+        done = pending.expect(('execDetailsEnd', reqId), resp=dict(execDetailsEnd=False, execDetails=[],
+                                                                   commissionReport=dict()), client=client)
+        client.reqExecutions(reqId, filter)
+        done.wait(g.request_timeout / 2)
+    finally:
+        connection.close_client(client)
+    log.debug('Current executions %s', done.resp)
+    return done.resp
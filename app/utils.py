@@ -1,11 +1,42 @@
 """ Needs documentation
 """
 import logging
+import threading
+import globals as g
 from ib.ext.Contract import Contract
 
 __author__ = 'Jason Haury'
 log = logging.getLogger(__name__)
 
+_tickerId_lock = threading.Lock()
+
+
+def get_tickerId():
+    """ Returns next valid ticker ID in a way which won't overlap with recent orderIds in the error responses.  Used
+    for every reqId/tickerId we send, so concurrent requests never share one.
+    """
+    with _tickerId_lock:
+        g.tickerId += 1
+        # Since error messages key off `id` being both an orderId or tickerId depending on context, we may have
+        # overlapping `id`'s between our feeds and sync functions.  As a safety, keep our either much larger or much
+        # lower than our orderId since we can't control orderId
+        id_threshold = 10000
+        if g.orderId < id_threshold:
+            if g.tickerId < id_threshold:
+                g.tickerId += id_threshold
+        elif g.tickerId > id_threshold:
+            # our orderId is >= id_threshold
+            g.tickerId -= id_threshold
+        return g.tickerId
+
+
+def get_orderId():
+    """ Returns the next orderId to place an order with, never handing out the same one twice """
+    with _tickerId_lock:
+        orderId = g.orderId
+        g.orderId += 1
+        return orderId
+
 
 def make_contract(symbol, args=None):
     contract = Contract()
@@ -20,23 +51,30 @@ def make_contract(symbol, args=None):
         for attr in dir(contract):
             if attr[:2] == 'm_' and attr[2:] in args:
                 val = str(args[attr[2:]])
-                log.debug('Setting Contract attribute {}={}'.format(attr, val))
+                log.debug('Setting Contract attribute %s=%s', attr, val)
                 setattr(contract, attr, val)
-    log.debug('Contract details: {}'.format(contract.__dict__))
+    log.debug('Contract details: %s', contract.__dict__)
     return contract
 
 
-def make_response(resp):
-    """ Returns Flask tuple `resp, code` code per http://flask.pocoo.org/docs/0.10/quickstart/#about-responses
+def make_response(resp, headers=None):
+    """ Returns Flask tuple `resp, code` code per http://flask.pocoo.org/docs/0.10/quickstart/#about-responses, along
+    with `headers` if given
     """
     if 'errorMsg' in resp:
         # Error 162 pertains to "Historical data request pacing violation"
         if resp['errorCode'] in [None, 162]:
-            return resp, 429
-        # Bad request if arg which made it to TWS wasn't right
-        return resp, 400
-    else:
+            code = 429
+        else:
+            # Bad request if arg which made it to TWS wasn't right
+            code = 400
+    elif headers is None:
         return resp
+    else:
+        code = 200
+    if headers is None:
+        return resp, code
+    return resp, code, headers
 
 
 def json_object_hook(data, ignore_dicts=False):
@@ -55,3 +93,47 @@ def json_object_hook(data, ignore_dicts=False):
             }
     # if it's anything else, return it in its original form
     return data
+
+
+
+# ---------------------------------------------------------------------
+# LOGGING
+# ---------------------------------------------------------------------
+class RateLimit(logging.Filter):
+    """ Passes at most one DEBUG record every `interval` seconds from each line of code, so that dumping every message
+    or wait loop costs formatting only that often.  The next record passed from a line says how many were dropped.
+    """
+    def __init__(self, interval):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.lines = dict()  # [time passed, records dropped since] by (pathname, lineno)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.pathname, record.lineno)
+        line = self.lines.get(key)
+        if line is None:
+            self.lines[key] = [record.created, 0]
+            return True
+        if record.created - line[0] < self.interval:
+            line[1] += 1
+            return False
+        if line[1]:
+            record.msg = '{} [{} more dropped]'.format(record.getMessage(), line[1])
+            record.args = None
+        line[0], line[1] = record.created, 0
+        return True
+
+
+def setup_logging():
+    """ Logs at g.log_level, with loggers in g.log_levels at their own.  DEBUG records are rate limited per line of code
+    by g.log_debug_interval.  Call after logging.basicConfig().
+    """
+    root = logging.getLogger()
+    root.setLevel(g.log_level)
+    for name, level in g.log_levels.items():
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    if g.log_debug_interval > 0:
+        for handler in root.handlers:
+            handler.addFilter(RateLimit(g.log_debug_interval))
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+""" Latency of /account/positions, /account/summary and /account/update reads against a stub TWS.
+
+Usage:
+    python bench/bench_accounts.py [--reads N] [--positions N] [--latency MS]
+
+A stub client stands in for TWS: reqPositions, reqAccountSummary and reqAccountUpdates are answered after `--latency`
+milliseconds with `--positions` positions (and portfolio entries) and every summary tag, on a thread of its own the
+way EReader would deliver them.  Each endpoint's function is called `--reads` times in a row, and the first read is
+reported apart from the rest.
+"""
+import argparse
+import logging
+import threading
+import time
+
+import benchutil
+from flask import Flask
+
+import globals as g
+import handlers
+import sync
+from ib.ext.Contract import Contract
+from ib.opt import message
+
+try:
+    import accounts
+except ImportError:
+    accounts = None
+
+__author__ = 'Jason Haury'
+
+ACCOUNT = 'DU12345'
+TAGS = ['NetLiquidation', 'BuyingPower', 'TotalCashValue']
+
+
+def make(name, **kwargs):
+    return message.registry[name][0](**kwargs)
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for account requests, answering each after a delay """
+    clientId = 0
+
+    def __init__(self, latency, positions):
+        self.latency = latency
+        self.contracts = []
+        for i in xrange(positions):
+            contract = Contract()
+            contract.m_conId = 1000 + i
+            contract.m_symbol = 'SYM{}'.format(i)
+            self.contracts.append(contract)
+        self.requests = 0
+
+    def isConnected(self):
+        return True
+
+    def answer(self, handler, msgs):
+        self.requests += 1
+
+        def send():
+            time.sleep(self.latency)
+            for msg in msgs:
+                handler(msg)
+        threading.Thread(target=send).start()
+
+    def reqPositions(self):
+        self.answer(handlers.portfolio_positions_handler,
+                    [make('position', account=ACCOUNT, contract=c, pos=100, avgCost=10.0) for c in self.contracts] +
+                    [make('positionEnd')])
+
+    def reqAccountSummary(self, reqId, group, tags):
+        self.answer(handlers.account_summary_handler,
+                    [make('accountSummary', reqId=reqId, account=ACCOUNT, tag=tag, value='1000', currency='USD')
+                     for tag in tags.split(',')] + [make('accountSummaryEnd', reqId=reqId)])
+
+    def reqAccountUpdates(self, subscribe, acctCode):
+        # Answered either way, as IbPy's one-off reqAccountUpdates(subscribe=False) was
+        self.answer(handlers.account_update_handler,
+                    [make('updateAccountValue', key=tag, value='1000', currency='USD', accountName=acctCode)
+                     for tag in TAGS] +
+                    [make('updatePortfolio', contract=c, position=100, marketPrice=10.0, marketValue=1000.0,
+                          averageCost=10.0, unrealizedPNL=0.0, realizedPNL=0.0, accountName=acctCode)
+                     for c in self.contracts] +
+                    [make('updateAccountTime', timeStamp='10:00'), make('accountDownloadEnd', accountName=acctCode)])
+
+    def cancelPositions(self):
+        pass
+
+    def cancelAccountSummary(self, reqId):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=20, help='Reads of each endpoint')
+    parser.add_argument('--positions', type=int, default=50, help='Positions (and portfolio entries) TWS sends')
+    parser.add_argument('--latency', type=float, default=100, help='Milliseconds TWS takes to start answering')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.CRITICAL)
+    client = StubClient(args.latency / 1000.0, args.positions)
+    g.client_connection = client
+    g.client_pool = []
+    if accounts is not None:
+        reads = [('positions', accounts.get_positions), ('summary', lambda: accounts.get_summary(TAGS)),
+                 ('update', lambda: accounts.get_updates(ACCOUNT))]
+    else:
+        reads = [('positions', sync.get_portfolio_positions),
+                 ('summary', lambda: sync.get_account_summary(','.join(TAGS))),
+                 ('update', lambda: sync.get_account_update(ACCOUNT))]
+
+    with Flask(__name__).app_context():
+        for name, read in reads:
+            requests = client.requests
+            times = []
+            for i in xrange(args.reads):
+                start = time.time()
+                read()
+                times.append(time.time() - start)
+            rest = times[1:] or times
+            print('{:<10} first msec={:8.2f} rest mean msec={:8.3f} requests to TWS={}'.format(
+                name, times[0] * 1e3, sum(rest) / len(rest) * 1e3, client.requests - requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+""" Time to first bar, total time and peak memory of a large /history backfill (`feeds.get_history`/`stream_history`).
+
+Usage:
+    python bench/bench_backfill.py [--days N] [--latency MS] [--bar-cost USEC] [--stream]
+
+A stub client stands in for TWS: each reqHistoricalData is answered with a 1 min bar for every minute of the request,
+after `--latency` milliseconds plus `--bar-cost` microseconds per bar, on a thread of its own the way EReader would
+deliver them.  `--days` of bars are requested once, with nothing in our bars store, and turned into the JSON we would
+send (a whole response, or with `--stream` one line at a time).  Peak memory is the growth of this process' maximum
+resident set size, so run each mode in its own process.
+"""
+import argparse
+import json
+import logging
+import resource
+import threading
+import time
+
+import benchutil
+from flask import Flask
+
+import bars
+import feeds
+import globals as g
+import handlers
+from ib.opt import message
+
+__author__ = 'Jason Haury'
+
+END = '20240105 16:00:00'  # A Friday in the past, so every bar is final
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for feeds, answering reqHistoricalData after a delay which grows with its bars """
+    clientId = 0
+
+    def __init__(self, latency, bar_cost):
+        self.latency = latency
+        self.bar_cost = bar_cost
+        self.requests = 0
+
+    def isConnected(self):
+        return True
+
+    def reqHistoricalData(self, tickerId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate):
+        self.requests += 1
+        end = bars.parse_end(endDateTime)
+        start = bars.duration_start(durationStr, end)
+        threading.Thread(target=self.answer, args=(tickerId, start, end)).start()
+
+    def answer(self, tickerId, start, end):
+        # Markets are shut at weekends
+        times = [t for t in xrange(start // 60 * 60, end, 60) if time.localtime(t).tm_wday < 5]
+        time.sleep(self.latency + len(times) * self.bar_cost)
+        History = message.registry['historicalData'][0]
+        for t in times:
+            handlers.history_handler(History(reqId=tickerId, date=str(t), open=100.0, high=101.0, low=99.0,
+                                             close=100.5, volume=10, count=5, WAP=100.25, hasGaps=False))
+        # TWS's last message tells the window it answered for
+        finished = 'finished-{}-{}'.format(bars.format_end(start), bars.format_end(end))
+        handlers.history_handler(History(reqId=tickerId, date=finished, open=-1, high=-1, low=-1, close=-1,
+                                         volume=-1, count=-1, WAP=-1, hasGaps=False))
+
+    def cancelHistoricalData(self, tickerId):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=10, help='durationStr of the request, in days')
+    parser.add_argument('--latency', type=float, default=200, help='Milliseconds TWS takes to start answering')
+    parser.add_argument('--bar-cost', type=float, default=20, help='Microseconds TWS takes per bar')
+    parser.add_argument('--stream', action='store_true', help='Stream the response as newline delimited JSON')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.WARNING)
+    client = StubClient(args.latency / 1000.0, args.bar_cost / 1e6)
+    g.client_connection = client
+    g.bar_cache_dir = ''
+    history_args = dict(endDateTime=END, durationStr='{} D'.format(args.days))
+    baseline = max_rss_mb()
+
+    with Flask(__name__).app_context():
+        start = time.time()
+        first = None
+        sent = 0
+        if args.stream:
+            for line in feeds.stream_history('SYM', history_args):
+                if first is None:
+                    first = time.time() - start
+                sent += 1
+        else:
+            resp = feeds.get_history('SYM', history_args)
+            if isinstance(resp, tuple):
+                resp = resp[0]
+            sent = len(json.dumps(resp)) and len(resp)
+            first = time.time() - start
+        elapsed = time.time() - start
+
+    print('{:<6} first bar msec={:8.1f} total msec={:8.1f} bars={} reqHistoricalData={} peak memory +{:.1f} MB'.format(
+        'stream' if args.stream else 'json', first * 1e3, elapsed * 1e3, sent - 1, client.requests,
+        max_rss_mb() - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+""" Cost of collecting and encoding historical bars, as dicts keyed by date versus columnar `bars.Bars`.
+
+Usage:
+    python bench/bench_bars.py [--bars N]
+
+Feeds `--bars` historicalData messages through the way `handlers.history_handler` collects them, once into a dict of
+`msg_to_dict()` copies keyed by date (how every bar was kept before `bars.Bars`) and once into a Bars.  Reports the
+cost per message, the memory held per bar, and the time to encode the lot for each `/history` format.
+"""
+import argparse
+import json
+import resource
+import time
+
+import benchutil
+
+import bars
+from handlers import msg_to_dict
+from ib.opt import message
+
+__author__ = 'Jason Haury'
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bars', type=int, default=200000, help='historicalData messages to collect')
+    args = parser.parse_args()
+
+    History = message.registry['historicalData'][0]
+    messages = [History(reqId=1, date=str(1704466800 + 60 * i), open=100.0 + i % 7, high=101.0, low=99.0,
+                        close=100.5, volume=10 + i, count=5, WAP=100.25, hasGaps=False) for i in xrange(args.bars)]
+
+    def collect_dicts():
+        resp = dict()
+        for msg in messages:
+            resp[msg.date] = msg_to_dict(msg).copy()
+        return resp
+
+    def collect_bars():
+        resp = bars.Bars()
+        for msg in messages:
+            resp.append(bars.bar_time(msg.date), msg.open, msg.high, msg.low, msg.close, msg.volume, msg.count,
+                        msg.WAP, msg.hasGaps)
+        return resp
+
+    # Measure the columnar container first, since peak memory only grows
+    for name, collect in [('bars', collect_bars), ('dicts', collect_dicts)]:
+        before = max_rss_kb()
+        collected, elapsed = timed(collect)
+        print('{:<6} usec/message={:6.2f} bytes/bar={:7.1f}'.format(
+            name, elapsed / args.bars * 1e6, (max_rss_kb() - before) * 1024.0 / args.bars))
+        if name == 'bars':
+            for fmt, encode in [('json', bars.to_json), ('csv', bars.to_csv), ('binary', bars.to_binary)]:
+                data, elapsed = timed(encode, collected)
+                print('  format={:<7} msec={:8.1f} bytes/bar={:6.1f}'.format(fmt, elapsed * 1e3,
+                                                                             len(data) / float(args.bars)))
+        else:
+            data, elapsed = timed(json.dumps, collected)
+            print('  format={:<7} msec={:8.1f} bytes/bar={:6.1f}'.format('by date', elapsed * 1e3,
+                                                                         len(data) / float(args.bars)))
+        del collected
+
+
+if __name__ == '__main__':
+    main()
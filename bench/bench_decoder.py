@@ -0,0 +1,48 @@
+#!/usr/bin/python
+""" Micro-benchmark of EReader.processMsg dispatch: decode cost per message type and over a mixed corpus.
+
+Usage:
+    python bench/bench_decoder.py [--messages N]
+
+Each message type is decoded from a stream holding only that type, so the per type figures show how dispatch cost
+varies with a message's position in the decoder; the mixed figure is a market session shaped blend of all of them.
+"""
+import argparse
+
+import benchutil
+from bench_reader import decode_all
+
+__author__ = 'Jason Haury'
+
+# Late and early messages in the decoder, keyed by name
+SAMPLES = [
+    ('TICK_PRICE', benchutil.tick_price(10001, 1, 100.25, 300)),
+    ('TICK_SIZE', benchutil.tick_size(10001, 0, 300)),
+    ('ORDER_STATUS', benchutil.order_status(12, 'Submitted', 0, 100, 0.0)),
+    ('TICK_STRING', benchutil.tick_string(10001, 45, 1464787800)),
+    ('HISTORICAL_DATA', benchutil.historical_data(10001, [('1464787800', 1, 2, 0.5, 1.5, 100, 1.2, 10)])),
+    ('COMMISSION_REPORT', benchutil.commission_report('0001f4e8.57427d2b.01.01', 1.0)),
+    ('POSITION', benchutil.position('DU12345', 'AAPL', 100, 99.5)),
+    ('ACCOUNT_SUMMARY', benchutil.account_summary(7, 'DU12345', 'BuyingPower', 400000.0)),
+]
+
+
+def best_of(data, repeat):
+    return min(benchutil.timed(decode_all, data)[::-1] for _ in xrange(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000, help='Messages per run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs to take the best of')
+    args = parser.parse_args()
+
+    for name, msg in SAMPLES:
+        elapsed, (count, _) = best_of(msg * args.messages, args.repeat)
+        print('{:<18} usec/msg={:6.2f}'.format(name, elapsed / count * 1e6))
+    elapsed, (count, _) = best_of(''.join(benchutil.mixed_corpus(args.messages)), args.repeat)
+    print('{:<18} usec/msg={:6.2f} msgs/sec={:.0f}'.format('mixed', elapsed / count * 1e6, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+""" Latency of /order/filled and /executions/commissions queries (`database.find`) after months of saved fills.
+
+Usage:
+    python bench/bench_fills.py [--rows N] [--symbols N]
+
+Saves `--rows` filled orders spread over `--symbols` symbols and a year of time, then times loading every row the way
+/order/filled used to, against a page of the newest 100 rows, the newest 100 for one symbol, and one day of one symbol.
+The database is made in a temporary folder and removed afterwards.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import benchutil
+
+__author__ = 'Jason Haury'
+
+START = 1704067200  # 2024-01-01
+
+
+def timed(func, repeat=5):
+    """ Returns the result of `func()` and the best of `repeat` runs, in seconds """
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='Filled orders saved')
+    parser.add_argument('--symbols', type=int, default=100, help='Symbols the fills are spread over')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.CRITICAL)
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # The database is opened relative to the working folder on import
+    os.chdir(folder)
+    try:
+        import database
+        from database import FilledOrders
+
+        database.init_db()
+        step = 365 * 24 * 60 * 60 // args.rows
+        database.engine.execute(FilledOrders.__table__.insert(), [
+            dict(order_id=i, perm_id=1000000 + i, symbol='SYM{}'.format(i % args.symbols), account='DU12345',
+                 side='BUY', qty=100, price=100.0, time=START + i * step, order_status='{"orderId": %d}' % i)
+            for i in xrange(args.rows)])
+        day = START + 200 * 24 * 60 * 60
+
+        queries = [('all rows', lambda: FilledOrders.query.all()),
+                   ('newest 100', lambda: database.find(FilledOrders, limit=100)),
+                   ('symbol, newest 100', lambda: database.find(FilledOrders, limit=100, symbol='SYM7')),
+                   ('symbol, one day', lambda: database.find(FilledOrders, start=day, end=day + 24 * 60 * 60,
+                                                             symbol='SYM7'))]
+        for name, query in queries:
+            rows, elapsed = timed(query)
+            database.db_session.remove()
+            print('{:<20} msec={:9.2f} rows={}'.format(name, elapsed * 1e3, len(rows)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
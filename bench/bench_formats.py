@@ -0,0 +1,104 @@
+#!/usr/bin/python
+""" Size, server time and client decode time of a /history response in each format and content encoding.
+
+Usage:
+    python bench/bench_formats.py [--days N]
+
+Serves `--days` of 1 min bars from our bars store (filled first from a stub TWS) through the Flask app, asking for each
+format with the `Accept` header, with and without `Accept-Encoding: gzip`.  Client decode time is the cost of turning
+the body back into numbers with the standard library (or msgpack/pyarrow, for those formats, when installed).  The
+database main.py opens is made in a temporary folder and removed afterwards.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import time
+from StringIO import StringIO
+
+import benchutil
+
+import bars
+import globals as g
+
+__author__ = 'Jason Haury'
+
+END = '20240105 16:00:00'  # A Friday in the past, so every bar is final
+
+
+def decode_binary(data):
+    n = struct.unpack_from('<I', data)[0]
+    offset = 4
+    columns = dict()
+    for column in bars.COLUMNS:
+        code = dict(l='q', d='d', b='b')[bars.TYPECODES[column]]
+        columns[column] = struct.unpack_from('<{}{}'.format(n, code), data, offset)
+        offset += struct.calcsize('<{}{}'.format(n, code))
+    return columns
+
+
+def decode_arrow(data):
+    return bars.pyarrow.ipc.open_stream(data).read_all()
+
+
+# (name, Accept header, function turning the body back into numbers)
+FORMATS = [('json by date', 'application/json', json.loads),
+           ('csv', 'text/csv', lambda data: list(csv.reader(StringIO(data)))),
+           ('binary', 'application/octet-stream', decode_binary)]
+if bars.msgpack is not None:
+    FORMATS.append(('msgpack', 'application/msgpack', bars.msgpack.unpackb))
+if bars.pyarrow is not None:
+    FORMATS.append(('arrow', 'application/vnd.apache.arrow.stream', decode_arrow))
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=5, help='durationStr of the request, in days')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.WARNING)
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # The database is opened relative to the working folder once main (or handlers, by bench_history) is imported
+    os.chdir(folder)
+    try:
+        import main
+        from bench_history import StubClient
+
+        g.client_connection = StubClient(0.001)
+        g.client_pool = []
+        g.bar_cache_dir = ''
+        client = main.app.test_client()
+        url = '/history/SYM?endDateTime={}&durationStr={} D'.format(END, args.days)
+        client.get(url)
+
+        for name, accept, decode in FORMATS:
+            for encoding in [None, 'gzip']:
+                headers = {'Accept': accept}
+                if encoding is not None:
+                    headers['Accept-Encoding'] = encoding
+                start = time.time()
+                resp = client.get(url, headers=headers)
+                served = time.time() - start
+                body = resp.get_data()
+                start = time.time()
+                if resp.headers.get('Content-Encoding') == 'gzip':
+                    decode(gzip.GzipFile(fileobj=StringIO(body)).read())
+                else:
+                    decode(body)
+                decoded = time.time() - start
+                print('{:<13} {:<5} bytes={:9d} server msec={:7.1f} client decode msec={:7.1f}'.format(
+                    name, encoding or '', len(body), served * 1e3, decoded * 1e3))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main_()
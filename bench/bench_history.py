@@ -0,0 +1,107 @@
+#!/usr/bin/python
+""" Latency of `feeds.get_history` (the /history endpoint) and bars fetched from TWS, with our bars store.
+
+Usage:
+    python bench/bench_history.py [--days N] [--latency MS] [--step MIN]
+
+A stub client stands in for TWS: each reqHistoricalData is answered with a 1 min bar for every minute of the request
+after `--latency` milliseconds, on a thread of its own the way EReader would deliver them.  The same `--days` of bars
+are requested cold, again, with the end moved `--step` minutes later (as a poller would), and after a restart which
+loads the store back from disk.
+"""
+import argparse
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import benchutil
+from flask import Flask
+
+import bars
+import feeds
+import globals as g
+import handlers
+from ib.opt import message
+
+__author__ = 'Jason Haury'
+
+END = '20240105 16:00:00'  # A Friday in the past, so every bar is final
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for feeds, answering reqHistoricalData after a delay """
+    clientId = 0
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.bars = 0
+
+    def isConnected(self):
+        return True
+
+    def reqHistoricalData(self, tickerId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate):
+        self.requests += 1
+        end = bars.parse_end(endDateTime)
+        start = bars.duration_start(durationStr, end)
+        threading.Timer(self.latency, self.answer, (tickerId, start, end)).start()
+
+    def answer(self, tickerId, start, end):
+        History = message.registry['historicalData'][0]
+        for t in xrange(start // 60 * 60, end, 60):
+            # Markets are shut at weekends
+            if time.localtime(t).tm_wday >= 5:
+                continue
+            self.bars += 1
+            handlers.history_handler(History(reqId=tickerId, date=str(t), open=100.0, high=101.0, low=99.0,
+                                             close=100.5, volume=10, count=5, WAP=100.25, hasGaps=False))
+        # TWS's last message tells the window it answered for
+        finished = 'finished-{}-{}'.format(bars.format_end(start), bars.format_end(end))
+        handlers.history_handler(History(reqId=tickerId, date=finished, open=-1, high=-1, low=-1, close=-1,
+                                         volume=-1, count=-1, WAP=-1, hasGaps=False))
+
+    def cancelHistoricalData(self, tickerId):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=5, help='durationStr of each request, in days')
+    parser.add_argument('--latency', type=float, default=50, help='Milliseconds TWS takes to start answering')
+    parser.add_argument('--step', type=int, default=15, help='Minutes the end moves between polls')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.WARNING)
+    client = StubClient(args.latency / 1000.0)
+    g.client_connection = client
+    g.bar_cache_dir = tempfile.mkdtemp()
+    moved = bars.format_end(bars.parse_end(END) + args.step * 60)
+    runs = [('cold', END), ('repeat', END), ('moved', moved), ('restart', moved)]
+
+    try:
+        with Flask(__name__).app_context():
+            for name, end in runs:
+                if name == 'restart':
+                    bars._series.clear()
+                requests, sent = client.requests, client.bars
+                start = time.time()
+                resp, waited = feeds.get_history('SYM', dict(endDateTime=end, durationStr='{} D'.format(args.days)))
+                elapsed = time.time() - start
+                print('{:<8} msec={:9.1f} bars={:6d} reqHistoricalData={:2d} bars from TWS={:6d}'.format(
+                    name, elapsed * 1e3, len(resp) - 1, client.requests - requests, client.bars - sent))
+    finally:
+        shutil.rmtree(g.bar_cache_dir)
+
+
+if __name__ == '__main__':
+    main()
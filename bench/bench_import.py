@@ -0,0 +1,43 @@
+#!/usr/bin/python
+""" Measures process startup cost of importing `ib.opt`, which builds the message registry.
+
+Usage:
+    python bench/bench_import.py [--runs N]
+
+Each run is a fresh interpreter, so the figure includes interpreter startup; the `python -c pass` baseline is
+reported alongside for comparison.
+"""
+import argparse
+import subprocess
+import sys
+
+import benchutil
+
+__author__ = 'Jason Haury'
+
+
+def run(code, runs):
+    """ Returns the best wall time of `runs` fresh interpreters executing `code` from the app folder
+    """
+    times = []
+    for _ in xrange(runs):
+        _, elapsed = benchutil.timed(subprocess.check_call, [sys.executable, '-c', code], cwd=benchutil.APP_DIR)
+        times.append(elapsed)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help='Interpreters to start per measurement')
+    args = parser.parse_args()
+
+    # Warm up so .pyc files exist and the OS file cache is hot
+    run('import ib.opt', 1)
+    bare = run('pass', args.runs)
+    full = run('import ib.opt', args.runs)
+    print('python -c pass:          {:.1f} ms'.format(bare * 1e3))
+    print('python -c "import ib.opt": {:.1f} ms ({:.1f} ms for the import)'.format(full * 1e3, (full - bare) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+""" Dispatch cost of our message handlers at each log level, with and without rate limited DEBUG records.
+
+Usage:
+    python bench/bench_logging.py [--messages N] [--capture FILE] [--repeat N] [--interval S]
+
+A mixed market-session stream (or a capture, as for bench_reader.py) is decoded by EReader and dispatched to the
+handlers connection.setup_client() registers, with the root logger at WARNING, INFO, then DEBUG with DEBUG records
+rate limited to one every `--interval` seconds per line (IBREST_LOG_DEBUG_INTERVAL), then DEBUG with all of them.
+Records are formatted as main.py formats them and written to os.devnull, so what's measured is our logging rather
+than a terminal.
+"""
+import argparse
+import logging
+import os
+import shutil
+import struct
+import tempfile
+
+import benchutil
+
+__author__ = 'Jason Haury'
+
+LOG_FORMAT = '%(asctime)s %(levelname)-5.5s [%(name)s-%(funcName)s:%(lineno)d][%(threadName)s] %(message)s'
+
+
+class CountingHandler(logging.StreamHandler):
+    """ Handler counting the records it writes """
+    def __init__(self, stream):
+        logging.StreamHandler.__init__(self, stream)
+        self.records = 0
+
+    def emit(self, record):
+        self.records += 1
+        logging.StreamHandler.emit(self, record)
+
+
+def dispatch_all(data, receiver):
+    """ Decodes every message in `data` and dispatches it to `receiver`'s listeners.  Returns the message count. """
+    from ib.ext.EClientSocket import EClientSocket
+    from ib.ext.EReader import EReader
+    from ib.lib import DataInputStream
+
+    parent = EClientSocket(receiver)
+    parent.m_serverVersion = benchutil.SERVER_VERSION
+    reader = EReader(parent, DataInputStream(benchutil.ByteStream(data)))
+    count = 0
+    try:
+        while reader.processMsg(reader.readInt()):
+            count += 1
+    except (EOFError, struct.error):
+        # End of our stream
+        pass
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000, help='Messages to synthesize')
+    parser.add_argument('--capture', help='Capture or raw inbound byte stream to dispatch instead of a synthesized one')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs to take the best of')
+    parser.add_argument('--interval', type=float, default=1, help='Seconds between DEBUG records from one line')
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    handler = CountingHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    # Before anything imports IbPy, whose logger() would add a handler of its own
+    root.handlers = [handler]
+
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # The database, which commission reports are saved to, is opened relative to the working folder
+    os.chdir(folder)
+    try:
+        import connection
+        import database
+        import utils
+        from ib.opt import ibConnection
+
+        database.init_db()
+        client = ibConnection()
+        connection.setup_client(client)
+        data = benchutil.load_capture(os.path.join(cwd, args.capture)) if args.capture else \
+            ''.join(benchutil.mixed_corpus(args.messages))
+
+        modes = [('WARNING', logging.WARNING, None), ('INFO', logging.INFO, None)]
+        # RateLimit is new, so leave it out when measuring a tree from before it
+        if hasattr(utils, 'RateLimit'):
+            modes.append(('DEBUG limited', logging.DEBUG, utils.RateLimit(args.interval)))
+        modes.append(('DEBUG', logging.DEBUG, None))
+
+        # Once untimed, so the first level measured doesn't pay for filling our caches
+        root.setLevel(logging.WARNING)
+        dispatch_all(data, client.receiver)
+
+        print('{:<14} {:>10} {:>10} {:>10} {:>9}'.format('level', 'usec/msg', 'msgs/sec', 'records', 'vs INFO'))
+        info = None
+        for name, level, rate_limit in modes:
+            root.setLevel(level)
+            handler.filters = [rate_limit] if rate_limit is not None else []
+            best = None
+            for _ in xrange(args.repeat):
+                handler.records = 0
+                count, elapsed = benchutil.timed(dispatch_all, data, client.receiver)
+                if best is None or elapsed < best[1]:
+                    best = (count, elapsed, handler.records)
+            count, elapsed, records = best
+            usec = elapsed / count * 1e6
+            info = usec if name == 'INFO' else info
+            print('{:<14} {:>10.2f} {:>10.0f} {:>10} {:>9}'.format(
+                name, usec, count / elapsed, records, '{:+.0%}'.format(usec / info - 1) if info else ''))
+        database.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+""" Latency of /order reads (open orders, all or for one symbol) against a stub TWS.
+
+Usage:
+    python bench/bench_orders.py [--reads N] [--orders N] [--symbols N] [--latency MS]
+
+A stub client stands in for TWS: reqAllOpenOrders is answered after `--latency` milliseconds with an openOrder and
+orderStatus for each of `--orders` working orders spread over `--symbols` symbols, on a thread of its own the way
+EReader would deliver them.  Every open order, then one symbol's, is read `--reads` times in a row, and the first read
+is reported apart from the rest.
+"""
+import argparse
+import logging
+import threading
+import time
+
+import benchutil
+from flask import Flask
+
+import globals as g
+import handlers
+import sync
+from ib.ext.Contract import Contract
+from ib.ext.Order import Order
+from ib.ext.OrderState import OrderState
+from ib.opt import message
+
+try:
+    from accounts import get_orders
+except ImportError:
+    get_orders = None
+
+__author__ = 'Jason Haury'
+
+
+def make(name, **kwargs):
+    return message.registry[name][0](**kwargs)
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for order requests, answering reqAllOpenOrders after a delay """
+    clientId = 0
+
+    def __init__(self, latency, orders, symbols):
+        self.latency = latency
+        self.messages = []
+        for orderId in xrange(1, orders + 1):
+            contract = Contract()
+            contract.m_symbol = 'SYM{}'.format(orderId % symbols)
+            order = Order()
+            order.m_orderId = orderId
+            order.m_permId = 100000 + orderId
+            order.m_action = 'BUY'
+            order.m_totalQuantity = 100
+            state = OrderState()
+            state.m_status = 'Submitted'
+            self.messages.append(make('openOrder', orderId=orderId, contract=contract, order=order,
+                                      orderState=state))
+            self.messages.append(make('orderStatus', orderId=orderId, status='Submitted', filled=0, remaining=100,
+                                      avgFillPrice=0.0, permId=100000 + orderId, parentId=0, lastFillPrice=0.0,
+                                      clientId=0, whyHeld=''))
+        self.messages.append(make('openOrderEnd'))
+        self.requests = 0
+
+    def isConnected(self):
+        return True
+
+    def reqAllOpenOrders(self):
+        self.requests += 1
+
+        def send():
+            time.sleep(self.latency)
+            for msg in self.messages:
+                handlers.order_handler(msg)
+        threading.Thread(target=send).start()
+
+    def reqAutoOpenOrders(self, autoBind):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=20, help='Reads of each kind')
+    parser.add_argument('--orders', type=int, default=200, help='Working orders TWS holds')
+    parser.add_argument('--symbols', type=int, default=50, help='Symbols the orders are spread over')
+    parser.add_argument('--latency', type=float, default=100, help='Milliseconds TWS takes to start answering')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.CRITICAL)
+    client = StubClient(args.latency / 1000.0, args.orders, args.symbols)
+    g.client_connection = client
+    g.client_pool = []
+
+    def symbol_orders(resp):
+        return [o for o in resp['openOrder'] if o['contract']['m_symbol'] == 'SYM1']
+
+    if get_orders is not None:
+        reads = [('all', get_orders), ('symbol', lambda: get_orders(symbol='SYM1'))]
+    else:
+        # Before the order book, a symbol's orders were picked out of every open order
+        reads = [('all', sync.get_open_orders), ('symbol', lambda: symbol_orders(sync.get_open_orders()))]
+
+    with Flask(__name__).app_context():
+        for name, read in reads:
+            requests = client.requests
+            times = []
+            for i in xrange(args.reads):
+                start = time.time()
+                read()
+                times.append(time.time() - start)
+            rest = times[1:] or times
+            print('{:<8} first msec={:8.2f} rest mean msec={:8.3f} requests to TWS={}'.format(
+                name, times[0] * 1e3, sum(rest) / len(rest) * 1e3, client.requests - requests))
+
+
+if __name__ == '__main__':
+    main()
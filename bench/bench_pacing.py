@@ -0,0 +1,140 @@
+#!/usr/bin/python
+""" Sustained /history throughput (`feeds.get_history`) against IB's historical data pacing rules.
+
+Usage:
+    python bench/bench_pacing.py [--requests N] [--callers N] [--symbols N] [--scale X]
+
+A stub client stands in for TWS and enforces IB's pacing rules (60 requests in any 10 minutes, 6 for a contract in any
+2 seconds, no identical request within 15 seconds), answering a violation with error 162 the way TWS does.  Each of
+`--requests` distinct requests is made by `--callers` threads at once, the way several dashboards polling the same
+chart would.  Every period is multiplied by `--scale` so a run takes seconds rather than hours.
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import deque
+
+import benchutil
+from flask import Flask
+
+import feeds
+import globals as g
+import handlers
+import pacing
+from ib.opt import message
+
+__author__ = 'Jason Haury'
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for feeds, answering reqHistoricalData with one bar, or error 162 if it breaks a
+    pacing rule
+    """
+    clientId = 0
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.sent = deque()
+        self.identical = dict()
+        self.requests = 0
+        self.violations = 0
+
+    def isConnected(self):
+        return True
+
+    def violates(self, key, contract, now):
+        period = 10 * 60 * self.scale
+        while self.sent and self.sent[0][0] <= now - period:
+            self.sent.popleft()
+        if len(self.sent) >= 60:
+            return True
+        if sum(1 for t, c in self.sent if c == contract and t > now - 2 * self.scale) >= 6:
+            return True
+        return now - self.identical.get(key, -1e9) < 15 * self.scale
+
+    def reqHistoricalData(self, tickerId, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                          formatDate):
+        key = (contract.m_symbol, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH, formatDate)
+        with self.lock:
+            self.requests += 1
+            now = time.time()
+            violation = self.violates(key, contract.m_symbol, now)
+            self.sent.append((now, contract.m_symbol))
+            self.identical[key] = now
+            if violation:
+                self.violations += 1
+        threading.Thread(target=self.answer, args=(tickerId, endDateTime, violation)).start()
+
+    def answer(self, tickerId, endDateTime, violation):
+        if violation:
+            handlers.error_handler(message.registry['error'][0](
+                id=tickerId, errorCode=162, errorMsg='Historical data request pacing violation'))
+            return
+        History = message.registry['historicalData'][0]
+        for date in [endDateTime, 'finished']:
+            handlers.history_handler(History(reqId=tickerId, date=date, open=100.0, high=101.0, low=99.0, close=100.5,
+                                             volume=10, count=5, WAP=100.25, hasGaps=False))
+
+    def cancelHistoricalData(self, tickerId):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=150, help='Distinct history requests')
+    parser.add_argument('--callers', type=int, default=3, help='Threads making each request at once')
+    parser.add_argument('--symbols', type=int, default=10, help='Symbols the requests are spread over')
+    parser.add_argument('--scale', type=float, default=0.01, help='Multiplier for every pacing period')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.CRITICAL)
+    client = StubClient(args.scale)
+    g.client_connection = client
+    g.bar_cache_dir = ''
+    g.history_max_wait = 1e9
+    # Scale our own pacing to the stub's clock, where this version paces at all
+    if hasattr(pacing, 'IDENTICAL_PERIOD'):
+        pacing.IDENTICAL_PERIOD *= args.scale
+        pacing.CONTRACT_PERIOD *= args.scale
+        pacing.ALL_PERIOD *= args.scale
+        pacing._all = pacing.Window(60, pacing.ALL_PERIOD)
+    results = dict(ok=0, error=0)
+    results_lock = threading.Lock()
+
+    def request(i):
+        # An unknown barSizeSetting goes straight to TWS, so every request is paced rather than served from the store
+        history_args = dict(endDateTime='20240105 16:00:{:02d}'.format(i % 60),
+                            durationStr='{} S'.format(60 + i // 60), barSizeSetting='1 bar')
+        with Flask(__name__).app_context():
+            resp = feeds.get_history('SYM{}'.format(i % args.symbols), history_args)
+        if isinstance(resp, tuple):
+            resp = resp[0]
+        with results_lock:
+            results['error' if 'errorMsg' in resp else 'ok'] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=request, args=(i,)) for i in xrange(args.requests)
+               for caller in xrange(args.callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print('responses ok={} error={}'.format(results['ok'], results['error']))
+    print('reqHistoricalData sent={} pacing violations={}'.format(client.requests, client.violations))
+    print('elapsed={:.2f}s ({:.1f} min unscaled), answered requests/10 min unscaled={:.1f}'.format(
+        elapsed, elapsed / args.scale / 60, (results['ok'] / float(args.callers)) / (elapsed / args.scale / 600)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+""" Time the EReader thread spends saving filled orders and commission reports to SQLite (`handlers` and `database`).
+
+Usage:
+    python bench/bench_persist.py [--fills N] [--commit-latency MS]
+
+Feeds `--fills` Filled orderStatus messages, each followed by its commissionReport, through `handlers.order_handler`
+and `handlers.executions_handler` the way EReader delivers them.  Every commit is slowed by `--commit-latency`
+milliseconds to stand in for a slow disk.  Reports the time each message held up the calling thread, and the time
+until every record was in the database.  The database is made in a temporary folder and removed afterwards.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import benchutil
+
+__author__ = 'Jason Haury'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fills', type=int, default=500, help='Filled orders, each with a commission report')
+    parser.add_argument('--commit-latency', type=float, default=5, help='Milliseconds added to every commit')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.CRITICAL)
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # The database is opened relative to the working folder on import
+    os.chdir(folder)
+    try:
+        from sqlalchemy import event
+        import database
+        import handlers
+        from ib.ext.CommissionReport import CommissionReport
+        from ib.opt import message
+
+        database.init_db()
+        event.listen(database.engine, 'commit', lambda conn: time.sleep(args.commit_latency / 1000.0))
+
+        OrderStatus = message.registry['orderStatus'][0]
+        Commission = message.registry['commissionReport'][0]
+        msgs = []
+        for i in xrange(args.fills):
+            report = CommissionReport()
+            report.m_execId = '0001f4e8.57427d2b.01.{:06d}'.format(i)
+            report.m_commission = 1.0
+            report.m_currency = 'USD'
+            msgs.append((handlers.order_handler, OrderStatus(
+                orderId=i, status='Filled', filled=100, remaining=0, avgFillPrice=100.0, permId=1000 + i, parentId=0,
+                lastFillPrice=100.0, clientId=0, whyHeld='')))
+            msgs.append((handlers.executions_handler, Commission(commissionReport=report)))
+
+        held = []
+        start = time.time()
+        for handler, msg in msgs:
+            before = time.time()
+            handler(msg)
+            held.append(time.time() - before)
+        handled = time.time() - start
+        if hasattr(database, 'flush'):
+            database.flush()
+        written = time.time() - start
+
+        rows = sqlite3.connect('ibrest.db').execute(
+            'SELECT (SELECT COUNT(*) FROM filled_orders) + (SELECT COUNT(*) FROM commissions)').fetchone()[0]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+    held.sort()
+    print('handler usec/message mean={:9.1f} p99={:9.1f} max={:9.1f}'.format(
+        sum(held) / len(held) * 1e6, held[int(len(held) * 0.99)] * 1e6, held[-1] * 1e6))
+    print('messages={} handled msec={:8.1f} written msec={:8.1f} rows={}'.format(
+        len(msgs), handled * 1e3, written * 1e3, rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+""" Latency of `feeds.get_market_data` (the /market endpoint) when polling a set of symbols.
+
+Usage:
+    python bench/bench_quotes.py [--symbols N] [--rounds N] [--latency MS]
+
+A stub client stands in for TWS: each reqMktData is answered with a tick of every common tick type after `--latency`
+milliseconds, on a thread of its own the way EReader would deliver them.  Every symbol is requested once per round,
+the way a poller would, and the first round is reported apart from the rest.
+"""
+import argparse
+import logging
+import threading
+import time
+
+import benchutil
+from flask import Flask
+
+import connection
+import feeds
+import globals as g
+import handlers
+from ib.opt import message
+
+__author__ = 'Jason Haury'
+
+# (tick type, price or None for a size tick) of the ticks a stock quote opens with
+TICKS = [(1, 100.0), (2, 100.5), (4, 100.25), (0, None), (3, None), (5, None), (8, None)]
+
+
+class StubClient(object):
+    """ Just enough of a Multiplexer for feeds, answering reqMktData after a delay """
+    clientId = 0
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    def isConnected(self):
+        return True
+
+    def enableLogging(self):
+        pass
+
+    def reqMktData(self, tickerId, contract, genericTickList, snapshot):
+        self.requests += 1
+        threading.Timer(self.latency, self.answer, (tickerId,)).start()
+
+    def answer(self, tickerId):
+        for tickType, price in TICKS:
+            if price is None:
+                msg = message.registry['tickSize'][0](tickerId=tickerId, field=tickType, size=100)
+            else:
+                msg = message.registry['tickPrice'][0](tickerId=tickerId, field=tickType, price=price, canAutoExecute=1)
+            handlers.market_handler(msg)
+
+    def cancelMktData(self, tickerId):
+        pass
+
+    def acquire(self, subscription=False):
+        pass
+
+    def release(self, subscription=False):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=50, help='Symbols polled each round')
+    parser.add_argument('--rounds', type=int, default=20, help='Times each symbol is requested')
+    parser.add_argument('--latency', type=float, default=20, help='Milliseconds TWS takes to send the first ticks')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.WARNING)
+    client = StubClient(args.latency / 1000.0)
+    g.client_connection = client
+    symbols = ['SYM{}'.format(i) for i in xrange(args.symbols)]
+
+    with Flask(__name__).app_context():
+        for round in xrange(args.rounds):
+            start = time.time()
+            for symbol in symbols:
+                feeds.get_market_data(symbol, {})
+            elapsed = time.time() - start
+            if round == 0:
+                print('{:<6} usec/request={:10.1f}'.format('first', elapsed / args.symbols * 1e6))
+                later = 0.0
+            else:
+                later += elapsed
+    if args.rounds > 1:
+        print('{:<6} usec/request={:10.1f}'.format('later', later / (args.symbols * (args.rounds - 1)) * 1e6))
+    print('reqMktData sent: {}'.format(client.requests))
+
+
+if __name__ == '__main__':
+    main()
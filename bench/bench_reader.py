@@ -0,0 +1,58 @@
+#!/usr/bin/python
+""" Measures inbound decode throughput of EReader over a byte stream.
+
+Usage:
+    python bench/bench_reader.py [--messages N] [--capture FILE] [--repeat N]
+
+Without --capture, a synthesized mixed market-session stream is used.  With --capture, FILE is a capture made with
+IBREST_CAPTURE_DIR, or a raw inbound byte stream (everything after the connection handshake).
+"""
+import argparse
+import struct
+
+import benchutil
+from ib.ext.EReader import EReader
+from ib.lib import DataInputStream
+
+__author__ = 'Jason Haury'
+
+
+def decode_all(data):
+    """ Runs every message in `data` through EReader.processMsg.  Returns (message count, recv calls)
+    """
+    stream = benchutil.ByteStream(data)
+    reader = EReader(benchutil.NullClient(), DataInputStream(stream))
+    count = 0
+    try:
+        while reader.processMsg(reader.readInt()):
+            count += 1
+    except (EOFError, struct.error):
+        # End of our stream
+        pass
+    return count, stream.recv_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000, help='Messages to synthesize')
+    parser.add_argument('--capture', help='Raw inbound byte stream to decode instead of a synthesized one')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs to take the best of')
+    args = parser.parse_args()
+
+    if args.capture:
+        data = benchutil.load_capture(args.capture)
+    else:
+        data = ''.join(benchutil.mixed_corpus(args.messages))
+
+    best = None
+    for _ in xrange(args.repeat):
+        (count, recv_calls), elapsed = benchutil.timed(decode_all, data)
+        if best is None or elapsed < best[2]:
+            best = (count, recv_calls, elapsed)
+    count, recv_calls, elapsed = best
+    print('messages={} bytes={} recv_calls={} seconds={:.3f} msgs/sec={:.0f}'.format(
+        count, len(data), recv_calls, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+""" Latency, throughput and errors of the REST endpoints under concurrent load, end to end against bench/fakegw.py.
+
+Usage:
+    python bench/bench_rest.py [--concurrency N] [--duration S] [--warmup S] [--endpoints market,history,...]
+                               [--latency MS] [--json FILE] [--compare FILE] [--url http://host:port]
+
+Starts fakegw.py and IBREST as processes of their own: IBREST serves `main.app` on werkzeug's threaded server over
+plain HTTP, connected to fakegw the way `python app/main.py` connects to TWS, with its database, bar cache and log in a
+temporary folder.  `--concurrency` threads then each request the endpoints in turn over HTTP for `--duration` seconds,
+after `--warmup` seconds that aren't counted.  With `--url`, an IBREST already running (ie against fakegw.py) is
+loaded instead.
+
+Reports p50/p95/p99 latency, requests/sec and error rate (any failure or status of 400 or more) per endpoint.
+`--json` saves the results with the commit they were measured at, and `--compare` shows the change from results saved
+before, ie at another commit.
+"""
+import argparse
+import httplib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+from collections import OrderedDict, defaultdict
+
+import benchutil
+
+__author__ = 'Jason Haury'
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SYMBOLS = ['AAPL', 'MSFT', 'IBM', 'SPY', 'QQQ', 'GE', 'F', 'T']
+START_TIMEOUT = 30
+ORDER = dict(secType='STK', exchange='SMART', currency='USD', orderType='MKT', totalQuantity=1)
+
+# Name: (method, path, form posted).  Paths are formatted with a symbol, rotating through SYMBOLS.
+ENDPOINTS = OrderedDict([
+    ('market', ('GET', '/market/{symbol}', None)),
+    ('history', ('GET', '/history/{symbol}?durationStr=1+D&barSizeSetting=5+mins', None)),
+    ('place_order', ('POST', '/order', ORDER)),
+    ('orders', ('GET', '/order', None)),
+    ('positions', ('GET', '/account/positions', None)),
+    ('summary', ('GET', '/account/summary?tags=NetLiquidation,BuyingPower,TotalCashValue', None)),
+    ('executions', ('GET', '/executions', None)),
+])
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(host, port, process, timeout=START_TIMEOUT):
+    """ Waits for `process` to listen on `port`.  Returns False if it exited or timed out first. """
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+def serve(port):
+    """ --serve: runs IBREST on `port` over HTTP, connected to TWS at IBGW_HOST/IBGW_PORT """
+    from werkzeug.serving import make_server
+
+    import connection
+    import globals as g
+    import main
+
+    for client in g.client_pool:
+        connection.setup_client(client)
+        client.connect()
+    make_server('127.0.0.1', port, main.app, threaded=True).serve_forever()
+
+
+def start(folder, latency):
+    """ Starts fakegw.py and IBREST with their output logged in `folder`.  Returns (IBREST's port, processes). """
+    gateway_port, port = free_port(), free_port()
+    log = open(os.path.join(folder, 'fakegw.log'), 'w')
+    gateway = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fakegw.py'), '--port', str(gateway_port),
+                                '--latency', str(latency)], stdout=log, stderr=subprocess.STDOUT)
+    processes = [gateway]
+    if not wait_for_port('127.0.0.1', gateway_port, gateway):
+        return None, processes
+    env = dict(os.environ, IBGW_HOST='127.0.0.1', IBGW_PORT=str(gateway_port),
+               IBREST_BAR_CACHE_DIR=os.path.join(folder, 'bar_cache'), IBREST_CAPTURE_DIR='')
+    log = open(os.path.join(folder, 'ibrest.log'), 'w')
+    ibrest = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)], cwd=folder, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    processes.append(ibrest)
+    return (port if wait_for_port('127.0.0.1', port, ibrest) else None), processes
+
+
+def request(host, port, method, path, form, timeout):
+    """ Returns the status of one request, or None if it failed without one """
+    conn = httplib.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if form is None:
+            conn.request(method, path)
+        else:
+            conn.request(method, path, urllib.urlencode(form), {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (socket.error, httplib.HTTPException):
+        return None
+    finally:
+        conn.close()
+
+
+def load(host, port, endpoints, concurrency, warmup, duration, timeout):
+    """ Requests `endpoints` from `concurrency` threads.  Returns lists of (seconds, status) by endpoint name,
+    for requests started after `warmup` and before `warmup + duration` seconds.
+    """
+    results = defaultdict(list)
+    counted = time.time() + warmup
+    deadline = counted + duration
+
+    def worker(index):
+        n = index
+        while True:
+            begin = time.time()
+            if begin >= deadline:
+                return
+            name = endpoints[n % len(endpoints)]
+            method, path, form = ENDPOINTS[name]
+            symbol = SYMBOLS[n // len(endpoints) % len(SYMBOLS)]
+            if form is not None:
+                form = dict(form, symbol=symbol, action='BUY' if n % 2 else 'SELL')
+            status = request(host, port, method, path.format(symbol=symbol), form, timeout)
+            if begin >= counted:
+                results[name].append((time.time() - begin, status))
+            n += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def summarize(samples, duration):
+    msecs = sorted(seconds * 1e3 for seconds, status in samples)
+    statuses = defaultdict(int)
+    for seconds, status in samples:
+        statuses[str(status)] += 1
+    errors = sum(n for status, n in statuses.items() if status == 'None' or int(status) >= 400)
+    return dict(requests=len(msecs), per_sec=len(msecs) / duration, errors=errors,
+                error_rate=float(errors) / len(msecs) if msecs else 0.0, statuses=statuses,
+                mean=sum(msecs) / len(msecs) if msecs else 0.0, p50=percentile(msecs, 0.5),
+                p95=percentile(msecs, 0.95), p99=percentile(msecs, 0.99), max=msecs[-1] if msecs else 0.0)
+
+
+def commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result, previous=None):
+    print('commit={commit} concurrency={concurrency} duration={duration}s {}'.format(
+        result['url'] or 'fakegw latency={}ms'.format(result['latency']), **result))
+    print('{:<12} {:>8} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8}  statuses'.format(
+        'endpoint', 'requests', 'req/sec', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for name, stats in result['endpoints'].items():
+        statuses = ' '.join('{}:{}'.format(*s) for s in sorted(stats['statuses'].items()))
+        print('{:<12} {requests:>8} {per_sec:>8.1f} {error_rate:>7.1%} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f} '
+              '{max:>8.1f}  {}'.format(name, statuses, **stats))
+    if previous is None:
+        return
+
+    def change(old, new):
+        return '{:+.0%}'.format(new / old - 1) if old else 'n/a'
+    print('\nAgainst commit {} (req/sec, errors and latency change)'.format(previous.get('commit')))
+    print('{:<12} {:>8} {:>15} {:>8} {:>8}'.format('endpoint', 'req/sec', 'errors', 'p50', 'p99'))
+    for name, stats in result['endpoints'].items():
+        old = previous['endpoints'].get(name)
+        if old is None:
+            continue
+        print('{:<12} {:>8} {:>7.1%}->{:<7.1%} {:>8} {:>8}'.format(
+            name, change(old['per_sec'], stats['per_sec']), old['error_rate'], stats['error_rate'],
+            change(old['p50'], stats['p50']), change(old['p99'], stats['p99'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads making requests at once')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of requests counted')
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of requests before those, not counted")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='Comma separated endpoints to request, of {}'.format(', '.join(ENDPOINTS)))
+    parser.add_argument('--latency', type=float, default=1, help="Milliseconds fakegw takes to send each message")
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds before a request counts as failed')
+    parser.add_argument('--url', help='Load an IBREST already running at this http://host:port instead')
+    parser.add_argument('--json', help='File to save the results in as JSON')
+    parser.add_argument('--compare', help='JSON results saved before, to show the change from')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve)
+    endpoints = args.endpoints.split(',')
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error('unknown endpoints {}'.format(', '.join(sorted(unknown))))
+    logging.disable(logging.WARNING)
+
+    folder, processes = None, []
+    try:
+        if args.url:
+            url = urlparse.urlparse(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            folder = tempfile.mkdtemp(prefix='bench_rest-')
+            host, (port, processes) = '127.0.0.1', start(folder, args.latency)
+            if port is None:
+                shutil.copytree(folder, folder + '-failed')
+                sys.exit('fakegw or IBREST did not start, see the logs in {}-failed'.format(folder))
+        samples = load(host, port, endpoints, args.concurrency, args.warmup, args.duration, args.timeout)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        if folder is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    result = dict(commit=commit(), time=time.strftime('%Y-%m-%d %H:%M:%S'), concurrency=args.concurrency,
+                  duration=args.duration, warmup=args.warmup, latency=None if args.url else args.latency,
+                  url=args.url, endpoints=OrderedDict((name, summarize(samples[name], args.duration))
+                                                      for name in endpoints))
+    result['endpoints']['all'] = summarize([s for name in endpoints for s in samples[name]], args.duration)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(result, previous)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
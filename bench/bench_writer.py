@@ -0,0 +1,132 @@
+#!/usr/bin/python
+""" Measures outbound encoding cost of EClientSocket requests: time per request (all of which is spent holding the
+global `mlock`), bytes, and socket calls made per request, plus the cost of encoding one field with send().
+
+Usage:
+    python bench/bench_writer.py [--requests N] [--fields N]
+"""
+import argparse
+import socket
+import threading
+
+import benchutil
+from ib.ext.Contract import Contract
+from ib.ext.EClientSocket import EClientSocket
+from ib.ext.Order import Order
+from ib.lib import DataOutputStream
+
+__author__ = 'Jason Haury'
+
+
+class CountingSocket(object):
+    """ Wraps one end of a real socket pair, counting the calls and bytes written to it.  A daemon thread drains the
+    other end so writes never block.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.sock, peer = socket.socketpair()
+        drain = threading.Thread(target=self.drain, args=(peer, ))
+        drain.setDaemon(True)
+        drain.start()
+
+    @staticmethod
+    def drain(peer):
+        while peer.recv(65536):
+            pass
+
+    def send(self, data):
+        self.calls += 1
+        self.bytes += len(data)
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.calls += 1
+        self.bytes += len(data)
+        return self.sock.sendall(data)
+
+
+def make_client():
+    """ Returns (client, socket) where client is an EClientSocket "connected" to a CountingSocket
+    """
+    sock = CountingSocket()
+    client = EClientSocket(benchutil.NullWrapper())
+    client.m_dos = DataOutputStream(sock)
+    client.m_connected = True
+    client.m_serverVersion = benchutil.SERVER_VERSION
+    return client, sock
+
+
+def make_contract():
+    contract = Contract()
+    contract.m_symbol = 'AAPL'
+    contract.m_secType = 'STK'
+    contract.m_exchange = 'SMART'
+    contract.m_currency = 'USD'
+    return contract
+
+
+def make_order():
+    order = Order()
+    order.m_action = 'BUY'
+    order.m_totalQuantity = 100
+    order.m_orderType = 'LMT'
+    order.m_lmtPrice = 100.25
+    return order
+
+
+def requests():
+    """ Yields (name, callable taking the client and a sequence number) for the requests we measure
+    """
+    contract, order = make_contract(), make_order()
+    yield 'placeOrder', lambda c, i: c.placeOrder(i, contract, order)
+    yield 'reqMktData', lambda c, i: c.reqMktData(i, contract, '', False)
+    yield 'reqHistoricalData', lambda c, i: c.reqHistoricalData(i, contract, '20160601 16:00:00', '1 D', '1 min',
+                                                                'TRADES', 0, 2)
+    yield 'cancelMktData', lambda c, i: c.cancelMktData(i)
+
+
+def measure(name, request, count):
+    client, sock = make_client()
+
+    def run():
+        for i in xrange(count):
+            request(client, i)
+
+    _, elapsed = benchutil.timed(run)
+    print('{:<18} usec/request={:8.1f} bytes/request={:6.0f} socket_calls/request={:7.1f}'.format(
+        name, elapsed / count * 1e6, float(sock.bytes) / count, float(sock.calls) / count))
+
+
+# One value of each type request methods pass to send()
+FIELDS = [('int', 100), ('long', 100L), ('str', 'AAPL'), ('float', 100.25), ('bool', True), ('None', None)]
+
+
+def measure_field(name, value, count):
+    client, sock = make_client()
+    send = client.send
+
+    def run():
+        for _ in xrange(count):
+            send(value)
+
+    _, elapsed = benchutil.timed(run)
+    # Throw away what was buffered without flushing it
+    client.m_dos = DataOutputStream(sock)
+    print('send({:<5}) usec/field={:6.2f}'.format(name, elapsed / count * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='Requests of each type to send')
+    parser.add_argument('--fields', type=int, default=100000, help='Fields of each type to encode')
+    args = parser.parse_args()
+    for name, request in requests():
+        measure(name, request, args.requests)
+    for name, value in FIELDS:
+        measure_field(name, value, args.fields)
+
+
+if __name__ == '__main__':
+    main()
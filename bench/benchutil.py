@@ -0,0 +1,180 @@
+""" Shared helpers for the IBREST benchmark scripts.
+
+Benchmarks are plain scripts run from the repository root, ie `python bench/bench_reader.py`.  They put the `app`
+folder on sys.path so `ib` and the IBREST modules import the same way they do inside the container.
+"""
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+__author__ = 'Jason Haury'
+
+# Server version our synthesized messages are encoded for
+SERVER_VERSION = 76
+
+
+# ---------------------------------------------------------------------
+# WIRE ENCODING
+# ---------------------------------------------------------------------
+def encode(*fields):
+    """ Encodes fields the way TWS puts them on the wire: each one as a NUL-terminated string
+    """
+    return ''.join('{}\0'.format('' if f is None else f) for f in fields)
+
+
+def tick_price(tickerId, tickType, price, size):
+    return encode(1, 6, tickerId, tickType, price, size, 1)
+
+
+def tick_size(tickerId, tickType, size):
+    return encode(2, 6, tickerId, tickType, size)
+
+
+def tick_string(tickerId, tickType, value):
+    return encode(46, 6, tickerId, tickType, value)
+
+
+def tick_generic(tickerId, tickType, value):
+    return encode(45, 6, tickerId, tickType, value)
+
+
+def order_status(orderId, status, filled, remaining, avgFillPrice):
+    return encode(3, 6, orderId, status, filled, remaining, avgFillPrice, 1000 + orderId, 0, avgFillPrice, 0, '')
+
+
+def account_value(key, value, currency, account):
+    return encode(6, 2, key, value, currency, account)
+
+
+def position(account, symbol, pos, avgCost):
+    return encode(61, 3, account, 265598, symbol, 'STK', '', 0.0, '', '', 'SMART', 'USD', symbol, 'NMS', pos, avgCost)
+
+
+def account_summary(reqId, account, tag, value):
+    return encode(63, 1, reqId, account, tag, value, 'USD')
+
+
+def commission_report(execId, commission):
+    return encode(59, 1, execId, commission, 'USD', 1.7976931348623157E308, 1.7976931348623157E308, 0)
+
+
+def historical_data(reqId, bars):
+    """ `bars` is a list of (date, open, high, low, close, volume, WAP, barCount) tuples
+    """
+    fields = [17, 3, reqId, '20160601  09:30:00', '20160601  16:00:00', len(bars)]
+    for date, o, h, l, c, v, wap, count in bars:
+        fields.extend([date, o, h, l, c, v, wap, 'false', count])
+    return encode(*fields)
+
+
+def mixed_corpus(count, seed=0):
+    """ Builds a list of `count` encoded messages shaped like a busy market session: mostly ticks, with order,
+    account and history traffic mixed in.
+    """
+    rnd = random.Random(seed)
+    msgs = []
+    for i in xrange(count):
+        tickerId = 10000 + i % 50
+        price = round(100 + rnd.random() * 10, 2)
+        r = rnd.random()
+        if r < 0.45:
+            msgs.append(tick_price(tickerId, rnd.choice([1, 2, 4]), price, rnd.randint(1, 500)))
+        elif r < 0.75:
+            msgs.append(tick_size(tickerId, rnd.choice([0, 3, 5, 8]), rnd.randint(1, 500)))
+        elif r < 0.82:
+            msgs.append(tick_string(tickerId, 45, 1464787800 + i))
+        elif r < 0.86:
+            msgs.append(tick_generic(tickerId, 49, 0.0))
+        elif r < 0.90:
+            msgs.append(order_status(i, 'Submitted', 0, 100, 0.0))
+        elif r < 0.93:
+            msgs.append(account_value('NetLiquidation', price * 1000, 'USD', 'DU12345'))
+        elif r < 0.95:
+            msgs.append(position('DU12345', 'AAPL', 100, price))
+        elif r < 0.97:
+            msgs.append(account_summary(7, 'DU12345', 'BuyingPower', price * 4000))
+        elif r < 0.98:
+            msgs.append(commission_report('0001f4e8.57427d2b.01.01', 1.0))
+        else:
+            bars = [('{}'.format(1464787800 + 60 * b), price, price + 1, price - 1, price, 1000, price, 10)
+                    for b in xrange(20)]
+            msgs.append(historical_data(tickerId, bars))
+    return msgs
+
+
+# ---------------------------------------------------------------------
+# FAKE SOCKET & WRAPPER
+# ---------------------------------------------------------------------
+class ByteStream(object):
+    """ Socket-like object serving a fixed byte string through recv(), at most `segment` bytes per call like a TCP
+    socket delivering MSS-sized segments.
+    """
+
+    def __init__(self, data, segment=1460):
+        self.data = data
+        self.pos = 0
+        self.segment = segment
+        self.recv_calls = 0
+
+    def recv(self, size):
+        self.recv_calls += 1
+        n = min(size, self.segment)
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+
+class NullWrapper(object):
+    """ EWrapper which accepts and drops every callback
+    """
+
+    def __getattr__(self, name):
+        return self.ignore
+
+    def ignore(self, *args, **kwds):
+        pass
+
+
+class NullClient(object):
+    """ Just enough of EClientSocket to act as an EReader's parent
+    """
+
+    def __init__(self, wrapper=None):
+        self.m_anyWrapper = wrapper if wrapper is not None else NullWrapper()
+
+    def wrapper(self):
+        return self.m_anyWrapper
+
+    def serverVersion(self):
+        return SERVER_VERSION
+
+    def isConnected(self):
+        return False
+
+    def error(self, *args):
+        pass
+
+
+def load_capture(path):
+    """ Reads what TWS sent in a session, after the connection handshake, from a capture made with IBREST_CAPTURE_DIR
+    (see app/capture.py) or a file of the raw inbound byte stream
+    """
+    import capture
+    if capture.is_capture(path):
+        clientId, started, records = capture.read(path)
+        return capture.strip_handshake(''.join(chunk for arrived, chunk in records))[1]
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def timed(func, *args, **kwds):
+    """ Calls func and returns (result, elapsed seconds)
+    """
+    start = time.time()
+    result = func(*args, **kwds)
+    return result, time.time() - start
@@ -0,0 +1,829 @@
+#!/usr/bin/python
+""" A stand-in for TWS/IB Gateway speaking the socket protocol of `EClientSocket`/`EReader`, for benchmarks and tests.
+
+Usage:
+    python bench/fakegw.py [--port N] [--latency MS] [--tick-rate N] [--bar-cost USEC] [--fill-delay MS]
+                           [--accounts DU1,DU2]
+
+Then start IBREST against it, ie `IBGW_HOST=127.0.0.1 IBGW_PORT=4003 python app/main.py`.
+
+Clients get the version handshake, nextValidId and managedAccounts on connecting, then scripted answers to the
+requests IBREST sends:
+  - reqMktData: a quote (bid, ask, last, high, low, close and volume), then `--tick-rate` updates a second per line
+  - reqHistoricalData: a bar for every barSizeSetting of the request, in one message taking `--bar-cost` per bar
+  - placeOrder: openOrder and orderStatus, then a fill (execDetails and commissionReport) `--fill-delay` later for
+    market orders and marketable limit orders.  Resting limit orders fill once the quote crosses them.
+  - cancelOrder, reqOpenOrders, reqAllOpenOrders, reqAutoOpenOrders, reqGlobalCancel and reqIds
+  - reqPositions, reqAccountSummary and reqAccountUpdates, kept up to date with our fills while subscribed
+  - reqExecutions, reqContractDetails, reqCurrentTime and reqManagedAccts
+Every message is sent `--latency` after whatever caused it.
+
+Import it to run one in process: `FakeGateway(port=0).start()` listens on a free port, given by its `port`.
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import math
+import random
+import socket
+import SocketServer
+import threading
+import time
+import zlib
+
+import benchutil
+from benchutil import encode, tick_price, tick_size, account_value, account_summary
+
+import bars
+
+__author__ = 'Jason Haury'
+
+log = logging.getLogger(__name__)
+
+# Order statuses after which an order is no longer working
+DONE_STATUSES = ('Filled', 'Cancelled', 'ApiCancelled', 'Inactive')
+DAY = 24 * 60 * 60
+CASH = 1000000.0  # Each account's cash before its first fill
+
+
+# ---------------------------------------------------------------------
+# REQUEST DECODING
+# ---------------------------------------------------------------------
+class FieldReader(object):
+    """ Reads the NUL-terminated fields of a client's requests off its socket """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.tail = ''
+        self.fields = []
+        self.pos = 0
+
+    def read(self):
+        while self.pos == len(self.fields):
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError('Client closed the connection')
+            self.fields = (self.tail + data).split('\0')
+            self.tail = self.fields.pop()
+            self.pos = 0
+        field = self.fields[self.pos]
+        self.pos += 1
+        return field
+
+    def read_int(self):
+        field = self.read()
+        return int(field) if field else 0
+
+    def read_fields(self, names, into):
+        for name in names:
+            into[name] = self.read()
+        return into
+
+
+def fields(*names):
+    """ Returns a decoder for a request made of `names`, read as strings """
+    return lambda r: r.read_fields(names, dict())
+
+
+def read_contract(r, primaryExch=True):
+    """ Reads the contract fields EClientSocket sends (at our server version) ahead of a request's own """
+    names = ['conId', 'symbol', 'secType', 'expiry', 'strike', 'right', 'multiplier', 'exchange']
+    if primaryExch:
+        names.append('primaryExch')
+    names.extend(['currency', 'localSymbol', 'tradingClass'])
+    return r.read_fields(names, dict())
+
+
+def read_combo_legs(r, names):
+    return [r.read_fields(names, dict()) for i in xrange(r.read_int())]
+
+
+def read_tag_values(r):
+    return [(r.read(), r.read()) for i in xrange(r.read_int())]
+
+
+def decode_mkt_data(r):
+    tickerId = r.read()
+    contract = read_contract(r)
+    if contract['secType'] == 'BAG':
+        contract['comboLegs'] = read_combo_legs(r, ('conId', 'ratio', 'action', 'exchange'))
+    if r.read() == '1':
+        contract['underComp'] = r.read_fields(('conId', 'delta', 'price'), dict())
+    return dict(tickerId=tickerId, contract=contract, genericTickList=r.read(), snapshot=r.read())
+
+
+def decode_historical_data(r):
+    tickerId = r.read()
+    contract = read_contract(r)
+    contract['includeExpired'] = r.read()
+    req = r.read_fields(('endDateTime', 'barSizeSetting', 'durationStr', 'useRTH', 'whatToShow', 'formatDate'),
+                        dict(tickerId=tickerId, contract=contract))
+    if contract['secType'] == 'BAG':
+        contract['comboLegs'] = read_combo_legs(r, ('conId', 'ratio', 'action', 'exchange'))
+    return req
+
+
+def decode_contract_details(r):
+    reqId = r.read()
+    contract = read_contract(r, primaryExch=False)
+    r.read_fields(('includeExpired', 'secIdType', 'secId'), contract)
+    return dict(reqId=reqId, contract=contract)
+
+
+ORDER_FIELDS = ('action', 'totalQuantity', 'orderType', 'lmtPrice', 'auxPrice', 'tif', 'ocaGroup', 'account',
+                'openClose', 'origin', 'orderRef', 'transmit', 'parentId', 'blockOrder', 'sweepToFill', 'displaySize',
+                'triggerMethod', 'outsideRth', 'hidden')
+ORDER_EXTENDED_FIELDS = ('sharesAllocation', 'discretionaryAmt', 'goodAfterTime', 'goodTillDate', 'faGroup', 'faMethod',
+                         'faPercentage', 'faProfile', 'shortSaleSlot', 'designatedLocation', 'exemptCode', 'ocaType',
+                         'rule80A', 'settlingFirm', 'allOrNone', 'minQty', 'percentOffset', 'eTradeOnly',
+                         'firmQuoteOnly', 'nbboPriceCap', 'auctionStrategy', 'startingPrice', 'stockRefPrice', 'delta',
+                         'stockRangeLower', 'stockRangeUpper', 'overridePercentageConstraints', 'volatility',
+                         'volatilityType', 'deltaNeutralOrderType', 'deltaNeutralAuxPrice')
+ORDER_SCALE_FIELDS = ('scalePriceAdjustValue', 'scalePriceAdjustInterval', 'scaleProfitOffset', 'scaleAutoReset',
+                      'scaleInitPosition', 'scaleInitFillQty', 'scaleRandomPercent')
+
+
+def decode_place_order(r):
+    """ Mirrors the fields `EClientSocket.placeOrder` sends at our server version """
+    orderId = r.read()
+    contract = read_contract(r)
+    r.read_fields(('secIdType', 'secId'), contract)
+    order = r.read_fields(ORDER_FIELDS, dict())
+    if contract['secType'] == 'BAG':
+        contract['comboLegs'] = read_combo_legs(r, ('conId', 'ratio', 'action', 'exchange', 'openClose',
+                                                    'shortSaleSlot', 'designatedLocation', 'exemptCode'))
+        order['orderComboLegs'] = [r.read() for i in xrange(r.read_int())]
+        order['smartComboRoutingParams'] = read_tag_values(r)
+    r.read_fields(ORDER_EXTENDED_FIELDS, order)
+    if order['deltaNeutralOrderType']:
+        r.read_fields(('deltaNeutralConId', 'deltaNeutralSettlingFirm', 'deltaNeutralClearingAccount',
+                       'deltaNeutralClearingIntent', 'deltaNeutralOpenClose', 'deltaNeutralShortSale',
+                       'deltaNeutralShortSaleSlot', 'deltaNeutralDesignatedLocation'), order)
+    r.read_fields(('continuousUpdate', 'referencePriceType', 'trailStopPrice', 'trailingPercent', 'scaleInitLevelSize',
+                   'scaleSubsLevelSize', 'scalePriceIncrement'), order)
+    if order['scalePriceIncrement'] and float(order['scalePriceIncrement']) > 0:
+        r.read_fields(ORDER_SCALE_FIELDS, order)
+    r.read_fields(('scaleTable', 'activeStartTime', 'activeStopTime', 'hedgeType'), order)
+    if order['hedgeType']:
+        order['hedgeParam'] = r.read()
+    r.read_fields(('optOutSmartRouting', 'clearingAccount', 'clearingIntent', 'notHeld'), order)
+    if r.read() == '1':
+        contract['underComp'] = r.read_fields(('conId', 'delta', 'price'), dict())
+    order['algoStrategy'] = r.read()
+    if order['algoStrategy']:
+        order['algoParams'] = read_tag_values(r)
+    order['whatIf'] = r.read()
+    return dict(id=orderId, contract=contract, order=order)
+
+
+# Request msgId -> (FakeGateway method answering it, decoder of the fields after its version)
+REQUESTS = {
+    1: ('reqMktData', decode_mkt_data),
+    2: ('cancelMktData', fields('tickerId')),
+    3: ('placeOrder', decode_place_order),
+    4: ('cancelOrder', fields('id')),
+    5: ('reqOpenOrders', fields()),
+    6: ('reqAccountUpdates', fields('subscribe', 'acctCode')),
+    7: ('reqExecutions', fields('reqId', 'clientId', 'acctCode', 'time', 'symbol', 'secType', 'exchange', 'side')),
+    8: ('reqIds', fields('numIds')),
+    9: ('reqContractDetails', decode_contract_details),
+    14: ('setServerLogLevel', fields('logLevel')),
+    15: ('reqAutoOpenOrders', fields('bAutoBind')),
+    16: ('reqAllOpenOrders', fields()),
+    17: ('reqManagedAccts', fields()),
+    20: ('reqHistoricalData', decode_historical_data),
+    25: ('cancelHistoricalData', fields('tickerId')),
+    49: ('reqCurrentTime', fields()),
+    58: ('reqGlobalCancel', fields()),
+    59: ('reqMarketDataType', fields('marketDataType')),
+    61: ('reqPositions', fields()),
+    62: ('reqAccountSummary', fields('reqId', 'group', 'tags')),
+    63: ('cancelAccountSummary', fields('reqId')),
+    64: ('cancelPositions', fields()),
+}
+
+
+# ---------------------------------------------------------------------
+# RESPONSE ENCODING
+# ---------------------------------------------------------------------
+def error(id, errorCode, errorMsg):
+    return encode(4, 2, id, errorCode, errorMsg)
+
+
+def contract_fields(contract, primaryExch=True):
+    """ Our contract fields in the order openOrder, position, execDetails and updatePortfolio share """
+    values = [contract['conId'], contract['symbol'], contract['secType'], contract['expiry'], contract['strike'] or 0.0,
+              contract['right'], contract['multiplier'], contract['exchange']]
+    if primaryExch:
+        values.append(contract['primaryExch'])
+    values.extend([contract['currency'], contract['localSymbol'] or contract['symbol'],
+                   contract['tradingClass'] or contract['symbol']])
+    return values
+
+
+def open_order(entry):
+    """ openOrder, version 32 """
+    contract, order = entry['contract'], entry['order']
+    values = [5, 32, entry['orderId']] + contract_fields(contract, primaryExch=False)
+    values.extend([order['action'], order['totalQuantity'], order['orderType'], order['lmtPrice'], order['auxPrice'],
+                   order['tif'], order['ocaGroup'], order['account'], order['openClose'], order['origin'],
+                   order['orderRef'], entry['clientId'], entry['permId'], order['outsideRth'], order['hidden'],
+                   order['discretionaryAmt'], order['goodAfterTime'], '', order['faGroup'], order['faMethod'],
+                   order['faPercentage'], order['faProfile'], order['goodTillDate'], order['rule80A'],
+                   order['percentOffset'], order['settlingFirm'], order['shortSaleSlot'], order['designatedLocation'],
+                   order['exemptCode'], order['auctionStrategy'], order['startingPrice'], order['stockRefPrice'],
+                   order['delta'], order['stockRangeLower'], order['stockRangeUpper'], order['displaySize'],
+                   order['blockOrder'], order['sweepToFill'], order['allOrNone'], order['minQty'], order['ocaType'],
+                   order['eTradeOnly'], order['firmQuoteOnly'], order['nbboPriceCap'], order['parentId'],
+                   order['triggerMethod'], order['volatility'], order['volatilityType'], '', '',
+                   order['continuousUpdate'], order['referencePriceType'], order['trailStopPrice'],
+                   order['trailingPercent'], '', '', '', 0, 0, 0, order['scaleInitLevelSize'],
+                   order['scaleSubsLevelSize'], '', order['hedgeType']])
+    if order['hedgeType']:
+        values.append(order['hedgeParam'])
+    values.extend([order['optOutSmartRouting'], order['clearingAccount'], order['clearingIntent'], order['notHeld'], 0,
+                   '', 0, entry['status'], '', '', '', '', '', '', '', ''])
+    return encode(*values)
+
+
+def order_status(entry, lastFillPrice=0.0):
+    return encode(3, 6, entry['orderId'], entry['status'], entry['filled'], entry['remaining'], entry['avgFillPrice'],
+                  entry['permId'], entry['order']['parentId'] or 0, lastFillPrice, entry['clientId'], '')
+
+
+def execution(reqId, fill):
+    """ execDetails, version 10 """
+    contract = fill['contract']
+    return encode(*[11, 10, reqId, fill['orderId']] + contract_fields(contract, primaryExch=False) +
+                  [fill['execId'], fill['time'], fill['account'], contract['exchange'] or 'SMART', fill['side'],
+                   fill['shares'], fill['price'], fill['permId'], fill['clientId'], 0, fill['cumQty'],
+                   fill['avgPrice'], fill['orderRef'], '', ''])
+
+
+def commission_report(fill):
+    return encode(59, 1, fill['execId'], fill['commission'], 'USD', 1.7976931348623157E308, 1.7976931348623157E308, 0)
+
+
+def position(account, holding):
+    return encode(*[61, 3, account] + contract_fields(holding['contract'], primaryExch=False) +
+                  [holding['position'], holding['avgCost']])
+
+
+def portfolio_value(account, holding, price):
+    """ updatePortfolio, version 8, which has no exchange """
+    values = contract_fields(holding['contract'])
+    del values[7]
+    value = holding['position'] * price
+    unrealized = value - holding['position'] * holding['avgCost']
+    return encode(*[7, 8] + values +
+                  [holding['position'], price, value, holding['avgCost'], unrealized, holding['realized'], account])
+
+
+def contract_data(reqId, contract):
+    """ contractData, version 8 """
+    symbol = contract['symbol']
+    return encode(10, 8, reqId, symbol, contract['secType'] or 'STK', contract['expiry'], contract['strike'] or 0.0,
+                  contract['right'], contract['exchange'] or 'SMART', contract['currency'] or 'USD',
+                  contract['localSymbol'] or symbol, 'NMS', contract['tradingClass'] or symbol, contract['conId'], 0.01,
+                  contract['multiplier'], 'LMT,MKT,STP,TRAIL', 'SMART,NYSE,ISLAND', 1, 0, '{} Inc'.format(symbol),
+                  contract['primaryExch'] or 'NYSE', '', 'Technology', 'Computers', 'Computers', 'EST',
+                  '20240105:0930-1600', '20240105:0930-1600', '', '', 0)
+
+
+# ---------------------------------------------------------------------
+# SESSIONS
+# ---------------------------------------------------------------------
+class Session(object):
+    """ One connected client.  Reads its requests on the server's thread for it and writes our answers, each once its
+    latency has passed, on a thread of its own.
+    """
+
+    def __init__(self, gateway, sock):
+        self.gateway = gateway
+        self.sock = sock
+        self.clientId = None
+        self.auto_bind = False
+        self.lines = dict()  # Symbol of each reqMktData line by tickerId
+        self.closed = threading.Event()
+        self._cond = threading.Condition()
+        self._outbox = []  # (due time, sequence, bytes), soonest first
+        self._sequence = itertools.count()
+
+    def send(self, data, delay=0.0):
+        """ Queues `data` to be written after our latency plus `delay` seconds """
+        with self._cond:
+            heapq.heappush(self._outbox, (time.time() + self.gateway.latency + delay, next(self._sequence), data))
+            self._cond.notify()
+
+    def _write(self):
+        while not self.closed.is_set():
+            with self._cond:
+                now = time.time()
+                while not self._outbox or self._outbox[0][0] > now:
+                    self._cond.wait(self._outbox[0][0] - now if self._outbox else None)
+                    if self.closed.is_set():
+                        return
+                    now = time.time()
+                batch = []
+                while self._outbox and self._outbox[0][0] <= now:
+                    batch.append(heapq.heappop(self._outbox)[2])
+            try:
+                self.sock.sendall(''.join(batch))
+            except socket.error:
+                self.close()
+                return
+            self.gateway.count('sent', len(batch))
+
+    def run(self):
+        reader = FieldReader(self.sock)
+        writer = threading.Thread(target=self._write, name='FakeGateway-Writer')
+        writer.daemon = True
+        writer.start()
+        try:
+            reader.read_int()  # CLIENT_VERSION
+            self.send(encode(benchutil.SERVER_VERSION, time.strftime('%Y%m%d %H:%M:%S %Z')), -self.gateway.latency)
+            self.clientId = reader.read_int()
+            if not self.gateway.connected(self):
+                return
+            while True:
+                msgId = reader.read_int()
+                if msgId not in REQUESTS:
+                    log.warning('Closing client {} after unsupported request {}'.format(self.clientId, msgId))
+                    return
+                name, decode = REQUESTS[msgId]
+                reader.read()  # VERSION
+                args = decode(reader)
+                self.gateway.count(name)
+                getattr(self.gateway, name)(self, **args)
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        with self._cond:
+            self._cond.notify()
+        self.gateway.disconnected(self)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class Handler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        Session(self.server.gateway, self.request).run()
+
+
+class Server(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# ---------------------------------------------------------------------
+# FAKE GATEWAY
+# ---------------------------------------------------------------------
+class FakeGateway(object):
+    """ Answers requests from any number of clients from one simulated account book and market.
+
+    `latency`, `bar_cost` and `fill_delay` are in seconds and `tick_rate` is quote updates per second per market data
+    line.  Pass `port=0` for a free port.
+    """
+
+    def __init__(self, host='127.0.0.1', port=4003, latency=0.0, tick_rate=4.0, bar_cost=0.0, fill_delay=0.0,
+                 accounts=('DU000000', ), seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.tick_rate = tick_rate
+        self.bar_cost = bar_cost
+        self.fill_delay = fill_delay
+        self.accounts = list(accounts)
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.sessions = set()
+        self.prices = dict()  # Last trade price by symbol
+        self.volumes = dict()
+        self.next_order_id = 1
+        self.perm_ids = itertools.count(100000)
+        self.exec_ids = itertools.count(1)
+        self.orders = dict()  # By orderId
+        self.fills = []
+        self.holdings = dict()  # Dicts of contract, position, avgCost and realized by (account, symbol)
+        self.cash = dict()  # By account, from CASH less our fills
+        self.position_subscribers = set()
+        self.summary_subscribers = dict()  # (reqId, tags) by session
+        self.update_subscribers = dict()  # Account by session
+        self.counts = dict(sent=0)
+        self._count_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.server = None
+        self.threads = []
+
+    def start(self):
+        self.server = Server((self.host, self.port), Handler)
+        self.server.gateway = self
+        self.port = self.server.server_address[1]
+        self.threads = [threading.Thread(target=self.server.serve_forever, name='FakeGateway'),
+                        threading.Thread(target=self._tick, name='FakeGateway-Ticker')]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        log.info('Fake gateway listening on {}:{}'.format(self.host, self.port))
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.drop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            for thread in self.threads:
+                thread.join()
+
+    def drop(self):
+        """ Disconnects every client, as a gateway restart would """
+        for session in list(self.sessions):
+            session.close()
+
+    def count(self, name, n=1):
+        with self._count_lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def stats(self):
+        with self._count_lock:
+            stats = dict(self.counts)
+        stats.update(clients=len(self.sessions), orders=len(self.orders), fills=len(self.fills))
+        return stats
+
+    # ---------------------------------------------------------------------
+    # CONNECTIONS
+    # ---------------------------------------------------------------------
+    def connected(self, session):
+        """ Admits a client which finished the handshake, unless its clientId is in use """
+        with self.lock:
+            if any(other.clientId == session.clientId for other in self.sessions):
+                session.sock.sendall(error(-1, 326, 'Unable to connect as the client id is already in use.  Retry '
+                                                    'with a unique client id.'))
+                return False
+            self.sessions.add(session)
+            session.send(encode(9, 1, self.next_order_id))
+        session.send(encode(15, 1, ','.join(self.accounts)))
+        self.count('clients')
+        return True
+
+    def disconnected(self, session):
+        with self.lock:
+            self.sessions.discard(session)
+            self.position_subscribers.discard(session)
+            self.summary_subscribers.pop(session, None)
+            self.update_subscribers.pop(session, None)
+
+    def reqIds(self, session, numIds):
+        with self.lock:
+            session.send(encode(9, 1, self.next_order_id))
+
+    def reqManagedAccts(self, session):
+        session.send(encode(15, 1, ','.join(self.accounts)))
+
+    def reqCurrentTime(self, session):
+        session.send(encode(49, 1, int(time.time())))
+
+    def setServerLogLevel(self, session, logLevel):
+        pass
+
+    def reqMarketDataType(self, session, marketDataType):
+        session.send(encode(58, 1, -1, marketDataType))
+
+    # ---------------------------------------------------------------------
+    # MARKET DATA
+    # ---------------------------------------------------------------------
+    def conId(self, contract):
+        return contract['conId'] if contract['conId'] not in ('', '0') else zlib.crc32(contract['symbol']) & 0xfffff
+
+    def quote(self, symbol):
+        """ Returns (bid, ask, last) for `symbol`, starting it at a price of its own.  Caller holds our lock. """
+        last = self.prices.get(symbol)
+        if last is None:
+            last = self.prices[symbol] = 20.0 + zlib.crc32(symbol) % 480
+            self.volumes[symbol] = 0
+        return round(last - 0.01, 2), round(last + 0.01, 2), round(last, 2)
+
+    def quote_ticks(self, tickerId, symbol, full=False):
+        bid, ask, last = self.quote(symbol)
+        size = self.random.randint(1, 50) * 100
+        self.volumes[symbol] += size
+        data = (tick_price(tickerId, 1, bid, size) + tick_price(tickerId, 2, ask, size) +
+                tick_price(tickerId, 4, last, size) + tick_size(tickerId, 8, self.volumes[symbol] // 100))
+        if full:
+            data += (tick_price(tickerId, 6, round(last * 1.01, 2), 0) +
+                     tick_price(tickerId, 7, round(last * 0.99, 2), 0) +
+                     tick_price(tickerId, 9, round(last * 0.995, 2), 0))
+        return data
+
+    def reqMktData(self, session, tickerId, contract, genericTickList, snapshot):
+        with self.lock:
+            session.send(self.quote_ticks(tickerId, contract['symbol'], full=True))
+            if snapshot == '1':
+                session.send(encode(57, 1, tickerId))
+            else:
+                session.lines[tickerId] = contract['symbol']
+
+    def cancelMktData(self, session, tickerId):
+        session.lines.pop(tickerId, None)
+
+    def _tick(self):
+        """ Ticker thread: moves every symbol's price and sends each market data line its quote `tick_rate` times a
+        second
+        """
+        while not self._stop.wait(1.0 / self.tick_rate if self.tick_rate > 0 else 1.0):
+            if self.tick_rate <= 0:
+                continue
+            with self.lock:
+                for symbol in self.prices:
+                    self.prices[symbol] *= 1 + self.random.gauss(0, 0.0005)
+                for session in list(self.sessions):
+                    for tickerId, symbol in session.lines.items():
+                        session.send(self.quote_ticks(tickerId, symbol))
+                resting = [entry for entry in self.orders.values() if not entry['filling'] and self.marketable(entry)]
+            for entry in resting:
+                self.fill(entry['orderId'])
+
+    # ---------------------------------------------------------------------
+    # HISTORY
+    # ---------------------------------------------------------------------
+    def reqHistoricalData(self, session, tickerId, contract, endDateTime, barSizeSetting, durationStr, useRTH,
+                          whatToShow, formatDate):
+        try:
+            bar = bars.bar_seconds(barSizeSetting)
+            end = bars.parse_end(endDateTime) if endDateTime else int(time.time())
+            start = bars.duration_start(durationStr, end)
+        except ValueError as e:
+            session.send(error(tickerId, 321, 'Error validating request:-\'{}\''.format(e)))
+            return
+        base = 20.0 + zlib.crc32(contract['symbol']) % 480
+        formatDate = int(formatDate or 1)
+        values = []
+        for t in xrange(start // bar * bar, end, bar):
+            if bar < DAY and time.localtime(t).tm_wday >= 5:
+                continue
+            o, c = base * (1 + 0.02 * math.sin(t / 7200.0)), base * (1 + 0.02 * math.sin((t + bar) / 7200.0))
+            values.extend([bars.bar_date(t, bar, formatDate), round(o, 2), round(max(o, c) + 0.05, 2),
+                           round(min(o, c) - 0.05, 2), round(c, 2), 100 + t % 900, round((o + c) / 2, 3), 'false',
+                           10])
+        count = len(values) // 9
+        session.send(encode(*[17, 3, tickerId, bars.format_end(start), bars.format_end(end), count] + values),
+                     count * self.bar_cost)
+
+    def cancelHistoricalData(self, session, tickerId):
+        pass
+
+    def reqContractDetails(self, session, reqId, contract):
+        contract['conId'] = self.conId(contract)
+        session.send(contract_data(reqId, contract) + encode(52, 1, reqId))
+
+    # ---------------------------------------------------------------------
+    # ORDERS
+    # ---------------------------------------------------------------------
+    def marketable(self, entry):
+        """ True if a working order would fill at the current quote.  Child orders wait.  Caller holds our lock. """
+        order = entry['order']
+        if entry['status'] in DONE_STATUSES or order['parentId'] not in ('', '0') or order['transmit'] == '0':
+            return False
+        if order['orderType'] == 'MKT':
+            return True
+        if order['orderType'] != 'LMT' or not order['lmtPrice']:
+            return False
+        bid, ask, last = self.quote(entry['contract']['symbol'])
+        if order['action'] == 'BUY':
+            return float(order['lmtPrice']) >= ask
+        return float(order['lmtPrice']) <= bid
+
+    def publish_order(self, entry, data):
+        """ Sends order messages to the client which placed it, and to clientId 0 if it's bound to all orders """
+        for session in list(self.sessions):
+            if session is entry['session'] or (session.auto_bind and session.clientId == 0):
+                session.send(data)
+
+    def placeOrder(self, session, id, contract, order):
+        orderId = int(id)
+        contract['conId'] = self.conId(contract)
+        order['account'] = order['account'] or self.accounts[0]
+        with self.lock:
+            entry = self.orders.get(orderId)
+            if entry is None:
+                entry = self.orders[orderId] = dict(orderId=orderId, permId=next(self.perm_ids),
+                                                    clientId=session.clientId, filled=0, avgFillPrice=0.0,
+                                                    filling=False)
+            elif entry['status'] in DONE_STATUSES:
+                session.send(error(orderId, 104, 'Can\'t modify a filled order.'))
+                return
+            entry.update(contract=contract, order=order, session=session, status='Submitted',
+                         remaining=int(order['totalQuantity'] or 0) - entry['filled'])
+            self.next_order_id = max(self.next_order_id, orderId + 1)
+            self.publish_order(entry, open_order(entry) + order_status(entry))
+            fill = entry['filling'] = self.marketable(entry)
+        if fill:
+            if self.fill_delay > 0:
+                threading.Timer(self.fill_delay, self.fill, (orderId, )).start()
+            else:
+                self.fill(orderId)
+
+    def fill(self, orderId):
+        """ Fills what remains of an order at the current quote """
+        with self.lock:
+            entry = self.orders[orderId]
+            if entry['status'] in DONE_STATUSES:
+                return
+            contract, order = entry['contract'], entry['order']
+            bid, ask, last = self.quote(contract['symbol'])
+            price = ask if order['action'] == 'BUY' else bid
+            shares = entry['remaining']
+            entry['avgFillPrice'] = round((entry['avgFillPrice'] * entry['filled'] + price * shares) /
+                                          (entry['filled'] + shares), 4)
+            entry.update(filled=entry['filled'] + shares, remaining=0, status='Filled')
+            fill = dict(orderId=orderId, contract=contract, account=order['account'], shares=shares, price=price,
+                        permId=entry['permId'], clientId=entry['clientId'], cumQty=entry['filled'],
+                        avgPrice=entry['avgFillPrice'], orderRef=order['orderRef'],
+                        side='BOT' if order['action'] == 'BUY' else 'SLD', commission=max(1.0, 0.005 * shares),
+                        execId='{:08x}.{:08x}.01.01'.format(entry['permId'], next(self.exec_ids)),
+                        time=time.strftime('%Y%m%d  %H:%M:%S'))
+            self.fills.append(fill)
+            holding = self.hold(fill)
+            self.publish_order(entry, order_status(entry, price) + open_order(entry) + execution(-1, fill) +
+                               commission_report(fill))
+            for session in list(self.position_subscribers):
+                session.send(position(fill['account'], holding))
+            for session, account in self.update_subscribers.items():
+                if account == fill['account']:
+                    session.send(portfolio_value(account, holding, last) + self.account_values(account))
+            self.publish_summary()
+
+    def cancelOrder(self, session, id):
+        orderId = int(id)
+        with self.lock:
+            entry = self.orders.get(orderId)
+            if entry is None or entry['status'] in DONE_STATUSES:
+                session.send(error(orderId, 135, 'Can\'t find order with id ={}'.format(orderId)))
+                return
+            entry['status'] = 'Cancelled'
+            self.publish_order(entry, order_status(entry) + error(orderId, 202, 'Order Canceled - reason:'))
+
+    def reqGlobalCancel(self, session):
+        with self.lock:
+            for orderId, entry in self.orders.items():
+                if entry['status'] not in DONE_STATUSES:
+                    self.cancelOrder(session, orderId)
+
+    def _open_orders(self, session, clientId=None):
+        with self.lock:
+            data = [open_order(entry) + order_status(entry) for orderId, entry in sorted(self.orders.items())
+                    if entry['status'] not in DONE_STATUSES and clientId in (None, entry['clientId'])]
+        session.send(''.join(data) + encode(53, 1))
+
+    def reqOpenOrders(self, session):
+        self._open_orders(session, session.clientId)
+
+    def reqAllOpenOrders(self, session):
+        self._open_orders(session)
+
+    def reqAutoOpenOrders(self, session, bAutoBind):
+        if session.clientId != 0:
+            session.send(error(-1, 321, 'Error validating request:-\'a\' : cause - Only clientId 0 can auto bind'))
+            return
+        session.auto_bind = bAutoBind == '1'
+
+    def reqExecutions(self, session, reqId, clientId, acctCode, time, symbol, secType, exchange, side):
+        with self.lock:
+            matched = [fill for fill in self.fills
+                       if (not acctCode or fill['account'] == acctCode) and
+                       (not symbol or fill['contract']['symbol'] == symbol) and
+                       (not secType or fill['contract']['secType'] == secType) and
+                       (not side or fill['side'] == side)]
+        session.send(''.join(execution(reqId, fill) + commission_report(fill) for fill in matched) +
+                     encode(55, 1, reqId))
+
+    # ---------------------------------------------------------------------
+    # ACCOUNTS
+    # ---------------------------------------------------------------------
+    def hold(self, fill):
+        """ Adds a fill to our holdings and cash.  Returns its holding.  Caller holds our lock. """
+        key = (fill['account'], fill['contract']['symbol'])
+        holding = self.holdings.get(key)
+        if holding is None:
+            holding = self.holdings[key] = dict(contract=fill['contract'], position=0, avgCost=0.0, realized=0.0)
+        held = holding['position']
+        shares = fill['shares'] if fill['side'] == 'BOT' else -fill['shares']
+        position = held + shares
+        if held == 0 or (held > 0) == (shares > 0):
+            holding['avgCost'] = (holding['avgCost'] * held + fill['price'] * shares) / position
+        else:
+            # Reducing, closing or reversing the position realizes the part closed
+            closed = min(abs(shares), abs(held)) * (1 if held > 0 else -1)
+            holding['realized'] += closed * (fill['price'] - holding['avgCost'])
+            if position == 0:
+                holding['avgCost'] = 0.0
+            elif (position > 0) != (held > 0):
+                holding['avgCost'] = fill['price']
+        holding['position'] = position
+        self.cash[fill['account']] = self.cash.get(fill['account'], CASH) - shares * fill['price'] - fill['commission']
+        return holding
+
+    def account_summary(self, account):
+        """ Returns our summary values for `account`, by tag.  Caller holds our lock. """
+        held = [(h['position'], self.quote(symbol)[2]) for (a, symbol), h in self.holdings.items() if a == account]
+        gross = sum(abs(position) * price for position, price in held)
+        cash = self.cash.get(account, CASH)
+        net = cash + sum(position * price for position, price in held)
+        margin = gross * 0.25
+        return dict(AccountType='INDIVIDUAL', NetLiquidation=net, TotalCashValue=cash,
+                    SettledCash=cash, BuyingPower=(net - margin) * 4, EquityWithLoanValue=net,
+                    GrossPositionValue=gross, InitMarginReq=margin, MaintMarginReq=margin, AvailableFunds=net - margin,
+                    ExcessLiquidity=net - margin, Cushion=(net - margin) / net if net else 0, DayTradesRemaining=-1,
+                    Leverage=gross / net if net else 0)
+
+    def account_values(self, account):
+        """ Returns updateAccountValue messages and the updateAccountTime ending them.  Caller holds our lock. """
+        data = [account_value(key, value, '' if isinstance(value, str) else 'USD', account)
+                for key, value in sorted(self.account_summary(account).items())]
+        return ''.join(data) + encode(8, 1, time.strftime('%H:%M'))
+
+    def reqPositions(self, session):
+        with self.lock:
+            self.position_subscribers.add(session)
+            data = [position(account, holding) for (account, symbol), holding in sorted(self.holdings.items())]
+        session.send(''.join(data) + encode(62, 1))
+
+    def cancelPositions(self, session):
+        with self.lock:
+            self.position_subscribers.discard(session)
+
+    def summary(self, reqId, tags):
+        """ Returns accountSummary messages for each of our accounts' `tags`.  Caller holds our lock. """
+        data = []
+        for account in self.accounts:
+            values = self.account_summary(account)
+            data.extend(account_summary(reqId, account, tag, values.get(tag, 0)) for tag in tags)
+        return ''.join(data)
+
+    def publish_summary(self):
+        """ Sends each summary subscriber its tags again.  Caller holds our lock. """
+        for session, (reqId, tags) in self.summary_subscribers.items():
+            session.send(self.summary(reqId, tags))
+
+    def reqAccountSummary(self, session, reqId, group, tags):
+        tags = [tag for tag in tags.split(',') if tag]
+        with self.lock:
+            self.summary_subscribers[session] = (reqId, tags)
+            session.send(self.summary(reqId, tags) + encode(64, 1, reqId))
+
+    def cancelAccountSummary(self, session, reqId):
+        with self.lock:
+            self.summary_subscribers.pop(session, None)
+
+    def reqAccountUpdates(self, session, subscribe, acctCode):
+        account = acctCode or self.accounts[0]
+        with self.lock:
+            if subscribe != '1':
+                self.update_subscribers.pop(session, None)
+                return
+            self.update_subscribers[session] = account
+            data = [portfolio_value(account, holding, self.quote(symbol)[2])
+                    for (a, symbol), holding in sorted(self.holdings.items()) if a == account]
+            session.send(self.account_values(account) + ''.join(data) + encode(54, 1, account))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=4003, help='Port to listen on (IBGW_PORT)')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds before each message is sent')
+    parser.add_argument('--tick-rate', type=float, default=4, help='Quote updates per second on each market data line')
+    parser.add_argument('--bar-cost', type=float, default=0, help='Microseconds each historical bar adds to its answer')
+    parser.add_argument('--fill-delay', type=float, default=0, help='Milliseconds before a marketable order fills')
+    parser.add_argument('--accounts', default='DU000000', help='Comma separated managed accounts')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of our price moves and trade sizes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    gateway = FakeGateway(args.host, args.port, args.latency / 1000.0, args.tick_rate, args.bar_cost / 1e6,
+                          args.fill_delay / 1000.0, args.accounts.split(','), args.seed).start()
+    try:
+        while True:
+            time.sleep(60)
+            log.info('Stats: {}'.format(gateway.stats()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+        print('Stats: {}'.format(gateway.stats()))
+
+
+if __name__ == '__main__':
+    main()
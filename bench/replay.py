@@ -0,0 +1,152 @@
+#!/usr/bin/python
+""" Replays a session captured with IBREST_CAPTURE_DIR through EReader.processMsg, the Dispatcher and our handlers.
+
+Usage:
+    python bench/replay.py CAPTURE [--speed N] [--no-handlers] [--json FILE]
+
+The capture's chunks reach an EReader the way its socket returned them: at the pace they arrived (`--speed 1`), N times
+faster, or as fast as they're decoded (`--speed 0`, the default).  Each message is decoded and dispatched as on a live
+connection, to the handlers connection.setup_client() registers unless `--no-handlers` is given.  Handlers keep their
+side effects, so fills in the capture are saved to ibrest.db in the current folder.
+
+Reports messages/sec, and per message type a histogram of the time from reading its id to its handlers returning
+(excluding any wait for the next chunk).  Paced replays also report how far dispatch fell behind the capture's own
+timing.  `--json` saves it all so runs before and after a change can be compared.
+"""
+import argparse
+import json
+import logging
+import time
+from collections import defaultdict
+
+import benchutil
+
+import capture
+import connection
+from ib.ext.EClientSocket import EClientSocket
+from ib.ext.EReader import EReader
+from ib.lib import DataInputStream
+from ib.opt import ibConnection
+
+__author__ = 'Jason Haury'
+
+# Upper bounds of our histogram buckets, in microseconds.  The last bucket holds everything slower.
+BUCKETS = [2 ** i for i in xrange(13)]
+
+
+class ReplayStream(object):
+    """ Socket-like object returning a capture's chunks through recv(), each no sooner than it arrived when replayed
+    `speed` times faster (or straight away for a speed of 0)
+    """
+
+    def __init__(self, records, speed):
+        self.records = records
+        self.speed = speed
+        self.first = None  # When the first chunk arrived, in the capture
+        self.start = None  # When we returned it
+        self.rest = ''  # What recv() didn't ask for of the last chunk
+        self.due = 0.0  # When the last chunk was due, on our clock
+        self.slept = 0.0
+
+    def recv(self, size):
+        if not self.rest:
+            try:
+                arrived, self.rest = next(self.records)
+            except StopIteration:
+                return ''
+            now = time.time()
+            if self.first is None:
+                self.first, self.start = arrived, now
+            self.due = self.start + (arrived - self.first) / self.speed if self.speed > 0 else now
+            if self.due > now:
+                time.sleep(self.due - now)
+                self.slept += time.time() - now
+        chunk, self.rest = self.rest[:size], self.rest[size:]
+        return chunk
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def summarize(seconds):
+    """ Returns the count, mean, percentiles and histogram of a list of durations, in microseconds """
+    usecs = sorted(s * 1e6 for s in seconds)
+    histogram = [0] * (len(BUCKETS) + 1)
+    bucket = 0
+    for usec in usecs:
+        while bucket < len(BUCKETS) and usec > BUCKETS[bucket]:
+            bucket += 1
+        histogram[bucket] += 1
+    return dict(count=len(usecs), mean=sum(usecs) / len(usecs) if usecs else 0.0, p50=percentile(usecs, 0.5),
+                p99=percentile(usecs, 0.99), max=usecs[-1] if usecs else 0.0, histogram=histogram)
+
+
+def replay(path, speed, handlers):
+    """ Replays the capture at `path`.  Returns (seconds, durations by message type, lags) """
+    clientId, started, records = capture.read(path)
+    connection_ = ibConnection(clientId=clientId)
+    if handlers:
+        connection.setup_client(connection_)
+    parent = EClientSocket(connection_.receiver)
+    stream = ReplayStream(records, speed)
+    reader = EReader(parent, DataInputStream(stream))
+    # The connection handshake, as EClientSocket.eConnect reads it
+    parent.m_serverVersion = reader.readInt()
+    if parent.m_serverVersion >= 20:
+        reader.readStr()
+
+    names = dict((msgId, name) for name, msgId in vars(EReader).items() if name.isupper() and isinstance(msgId, int))
+    durations = defaultdict(list)
+    lags = []
+    start = time.time()
+    try:
+        while True:
+            msgId = reader.readInt()
+            slept = stream.slept
+            begin = time.time()
+            if not reader.processMsg(msgId):
+                break
+            end = time.time()
+            durations[names.get(msgId, msgId)].append(end - begin - (stream.slept - slept))
+            if speed > 0:
+                lags.append(max(0.0, end - stream.due))
+    except EOFError:
+        # End of the capture
+        pass
+    return time.time() - start - (stream.slept if speed > 0 else 0.0), durations, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='Capture file written with IBREST_CAPTURE_DIR')
+    parser.add_argument('--speed', type=float, default=0, help='Times faster than captured, or 0 for as fast as we can')
+    parser.add_argument('--no-handlers', action='store_true', help="Dispatch to no listeners, so skip our handlers")
+    parser.add_argument('--json', help='File to save the results in as JSON')
+    args = parser.parse_args()
+
+    # Measure the code rather than our log output
+    logging.disable(logging.WARNING)
+    busy, durations, lags = replay(args.capture, args.speed, not args.no_handlers)
+    count = sum(len(d) for d in durations.values())
+    types = dict((name, summarize(d)) for name, d in durations.items())
+    result = dict(capture=args.capture, speed=args.speed, handlers=not args.no_handlers, messages=count,
+                  busy_seconds=busy, msgs_per_sec=count / busy if busy else 0.0, types=types, buckets_usec=BUCKETS)
+    if lags:
+        result['lag_msec'] = dict((k, v / 1e3) for k, v in summarize(lags).items() if k != 'histogram')
+
+    print('messages={} busy seconds={:.3f} msgs/sec={:.0f}'.format(count, busy, result['msgs_per_sec']))
+    if lags:
+        print('behind schedule msec: p50={p50:.2f} p99={p99:.2f} max={max:.2f}'.format(**result['lag_msec']))
+    print('\n{:<24} {:>8} {:>8} {:>8} {:>8}  usec histogram (<=1, 2, 4 ... {}, more)'.format(
+        'type', 'count', 'mean', 'p99', 'max', BUCKETS[-1]))
+    for name, stats in sorted(types.items(), key=lambda item: -item[1]['mean'] * item[1]['count']):
+        print('{:<24} {count:>8} {mean:>8.1f} {p99:>8.1f} {max:>8.1f}  {}'.format(
+            name, ' '.join('{:>5}'.format(n) for n in stats['histogram']), **stats))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()